@@ -0,0 +1,103 @@
+"""
+Compares rows/sec for the execute_values insert path and the COPY bulk 
+loader at 10k, 100k and 1M synthetic rows, after checking that the COPY 
+loader stores missing integers and dates as NULL and empty strings as 
+empty strings.
+
+Usage (from the repository root, with the DB_* variables pointing at a 
+local Postgres):
+    PYTHONPATH=modules python benchmarks/bench_bulk_load.py [sizes...]
+
+The benchmark works in its own bench_properties table, which is recreated 
+for every measurement and dropped at the end.
+"""
+import sys
+import time
+import random
+import datetime
+from database import connect_db, close_database, insert_properties, bulk_load_properties
+
+BENCH_TABLE = 'bench_properties'
+
+def synthetic_properties(n, seed=0):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    for i in range(n):
+        yield {
+            'title': f'Apartment {i} for rent',
+            'description': 'Bright flat close to the tram, fully furnished. ' * rng.randint(1, 6),
+            'property_type': rng.choice(['Apartment', 'Villa', 'Studio', 'House']),
+            'city': rng.choice(['Casablanca', 'Rabat', 'Marrakech', 'Tanger', 'Agadir']),
+            'area': rng.choice(['Maarif', 'Agdal', 'Gueliz', None]),
+            'size': rng.randint(30, 400),
+            # Listings often leave out the room counts
+            'rooms': rng.choice([rng.randint(1, 8), None]),
+            'bedrooms': rng.choice([rng.randint(1, 5), None]),
+            'bathrooms': rng.choice([rng.randint(1, 4), None]),
+            'price': rng.randint(2000, 60000),
+            'features': 'Terrace, Elevator, Parking',
+            'condition': rng.choice(['Good', 'New', None]),
+            'age': rng.choice(['1-5', '5-10', None]),
+            'date_published': (today - datetime.timedelta(days=rng.randint(0, 365))
+                               if rng.random() > 0.1 else None),
+            'url': f'https://www.mubawab.ma/en/a/bench-{i}',
+        }
+
+def reset_table(cursor):
+    cursor.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+    cursor.execute(f'''
+        CREATE TABLE {BENCH_TABLE} (LIKE properties_for_rent INCLUDING CONSTRAINTS INCLUDING GENERATED INCLUDING INDEXES);
+        ALTER TABLE {BENCH_TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY;
+        ALTER TABLE {BENCH_TABLE} ALTER COLUMN scraped_at SET DEFAULT CURRENT_TIMESTAMP;
+    ''')
+    cursor.connection.commit()
+
+def time_execute_values(cursor, n, batch_size=10000):
+    reset_table(cursor)
+    start = time.perf_counter()
+    batch = []
+    for prop in synthetic_properties(n):
+        batch.append(prop)
+        if len(batch) == batch_size:
+            insert_properties(cursor, batch, table=BENCH_TABLE)
+            batch = []
+    insert_properties(cursor, batch, table=BENCH_TABLE)
+    return n / (time.perf_counter() - start)
+
+def time_copy(cursor, n):
+    reset_table(cursor)
+    start = time.perf_counter()
+    bulk_load_properties(cursor, synthetic_properties(n), table=BENCH_TABLE)
+    return n / (time.perf_counter() - start)
+
+def check_nulls(cursor):
+    reset_table(cursor)
+    sparse = {
+        'title': 'Studio', 'description': '', 'property_type': None, 'city': 'Rabat',
+        'area': None, 'size': None, 'rooms': None, 'bedrooms': None, 'bathrooms': None,
+        'price': None, 'features': '', 'condition': None, 'age': None,
+        'date_published': None, 'url': 'https://www.mubawab.ma/en/a/bench-sparse',
+    }
+    bulk_load_properties(cursor, [sparse], table=BENCH_TABLE)
+    cursor.execute(f'''
+        SELECT size, rooms, bedrooms, bathrooms, price, date_published, features
+        FROM {BENCH_TABLE}
+    ''')
+    return cursor.fetchall() == [(None, None, None, None, None, None, '')]
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    conn, cursor = connect_db()
+    try:
+        if not check_nulls(cursor):
+            sys.exit('COPY did not load missing values as NULL')
+        print(f'{"rows":>10} {"execute_values":>16} {"COPY":>12} {"speed-up":>9}')
+        for n in sizes:
+            values_rate = time_execute_values(cursor, n)
+            copy_rate = time_copy(cursor, n)
+            print(f'{n:>10,} {values_rate:>12,.0f} r/s {copy_rate:>8,.0f} r/s '
+                  f'{copy_rate / values_rate:>8.1f}x')
+    finally:
+        cursor.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+        conn.commit()
+        close_database(conn, cursor)
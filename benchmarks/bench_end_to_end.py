@@ -0,0 +1,155 @@
+"""
+Measures the full `main.main` flow end to end against a local replay of
+mubawab.ma: listings/sec, wall and CPU time per stage, and peak RSS, for
+the sequential scraper, the staged pipeline and the city scheduler.
+
+Usage (from the repository root, with the DB_* variables pointing at a
+local Postgres):
+    PYTHONPATH=modules python benchmarks/bench_end_to_end.py [--fixtures DIR]
+        [--latency-ms 20] [--error-rate 0] [--rps 1000] [--max-pages 2]
+
+Pages come from a fixtures directory recorded with
+`python modules/replay.py --record`, or are generated for a handful of
+cities when none is given. Every run starts from an empty page cache, and
+only rows scraped from the replay server are deleted between runs.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from database import transaction, MARKETS
+import replay
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITIES = [('casablanca', 'Casablanca'), ('rabat', 'Rabat'), ('marrakech', 'Marrakech'),
+          ('tanger', 'Tanger'), ('agadir', 'Agadir'), ('kénitra', 'Kenitra')]
+AREAS = ['Maarif', 'Agdal', 'Gueliz', 'Hay Riad', 'Californie', 'Malabata']
+FEATURES = ['Terrace', 'Elevator', 'Parking', 'Garden', 'Pool', 'Concierge']
+
+def listing_page(city, market, page, pages, ids):
+    items = ''.join(
+        f'<li class="listingBox"><h2 class="listingTit">'
+        f'<a href="{replay.ORIGIN}/en/a/{i}/property-for-{market}-in-{city}">Property {i}</a></h2>'
+        f'<div class="controlBar sMargTop"><span class="listingDetails iconPadR">'
+        f'<i class="icon-calendar"></i>Published {i % 30} days ago</span></div></li>'
+        for i in ids
+    )
+    url = f'{replay.ORIGIN}/en/ct/{city}/real-estate-for-{market}:o:n'
+    next_link = f'<a class="arrowDot" href="{url}:p:{page + 1}">Next</a>' if page < pages else ''
+    return f'<html><body><ul>{items}</ul>{next_link}</body></html>'.encode('utf-8')
+
+def detail_page(i, city_name, market, rng):
+    size = rng.randint(30, 400)
+    price = size * (rng.randint(60, 160) if market == 'rent' else rng.randint(8000, 20000))
+    details = ''.join(
+        f'<div class="adDetailFeature"><i></i><span>{text}</span></div>'
+        for text in (f'{size} m²', f'{rng.randint(1, 8)} Pieces', f'{rng.randint(1, 5)} Rooms',
+                     f'{rng.randint(1, 3)} Bathrooms')
+    )
+    features = ''.join(f'<span class="fSize11 centered">{f}</span>'
+                       for f in rng.sample(FEATURES, rng.randint(0, 4)))
+    return (
+        f'<html><body><h1 class="searchTitle">Property {i} for {market}</h1>'
+        f'<h3 class="orangeTit">{price:,} DH</h3>'
+        f'<h3 class="greyTit">{rng.choice(AREAS)} in {city_name}</h3>'
+        f'<div class="blockProp"><p>Bright property close to the tram. {"Quiet street. " * rng.randint(1, 20)}</p></div>'
+        f'<p class="adMainFeatureContentValue">{rng.choice(["Apartment", "Villa", "Studio"])}</p>'
+        f'<p class="adMainFeatureContentValue">{rng.choice(["Good condition", "New"])}</p>'
+        f'<p class="adMainFeatureContentValue">{rng.choice(["1-5 years", "5-10 years"])}</p>'
+        f'{details}{features}</body></html>'
+    ).encode('utf-8')
+
+def synthetic_pages(pages=3, per_page=30, seed=0):
+    """Yields listing and detail pages for a few cities of both markets."""
+    rng = random.Random(seed)
+    next_id = 1
+    for city, city_name in CITIES:
+        for market in MARKETS:
+            url = f'{replay.ORIGIN}/en/ct/{city}/real-estate-for-{market}:o:n'
+            for page in range(1, pages + 1):
+                ids = range(next_id, next_id + per_page)
+                next_id += per_page
+                yield f'{url}:p:{page}', listing_page(city, market, page, pages, ids)
+                for i in ids:
+                    yield (f'{replay.ORIGIN}/en/a/{i}/property-for-{market}-in-{city}',
+                           detail_page(i, city_name, market, rng))
+
+def delete_replayed_rows(base_url):
+    with transaction() as cursor:
+        for table in MARKETS.values():
+            cursor.execute(f'DELETE FROM {table} WHERE url LIKE %s', (base_url + '/%',))
+
+def run(mode, server, tmp, args):
+    delete_replayed_rows(server.base_url)
+    summary_path = os.path.join(tmp, f'{mode}.json')
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.join(ROOT, 'modules'),
+        MUBAWAB_BASE_URL=server.base_url,
+        PAGE_CACHE_DIR=os.path.join(tmp, f'cache-{mode}'),
+        SCRAPER_REQUESTS_PER_SECOND=str(args.rps),
+        SCRAPER_MAX_IN_FLIGHT=str(args.in_flight),
+    )
+    command = [sys.executable, os.path.join(ROOT, 'main.py'), '--max-pages', str(args.max_pages),
+               '--metrics-file', summary_path]
+    if mode == 'pipeline':
+        command.append('--pipeline')
+    elif mode == 'scheduled':
+        command += ['--scheduled', '--force']
+    requests_before = server.requests
+    # wait4 reports the peak RSS and CPU time of this run alone
+    process = subprocess.Popen(command, env=env, cwd=tmp, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        sys.exit(f'The {mode} run failed with exit code {process.returncode}.')
+
+    with open(summary_path) as f:
+        summary = json.load(f)
+    inserted = sum(c['value'] for c in summary['counters'] if c['name'] == 'records_inserted')
+    duration = summary['duration_seconds']
+    print(f'\n{mode}: {inserted:,} listings in {duration:.1f}s '
+          f'({inserted / duration:,.1f} listings/s), {server.requests - requests_before:,} '
+          f'requests, CPU {usage.ru_utime + usage.ru_stime:.1f}s, '
+          f'peak RSS {usage.ru_maxrss / 1024:.0f} MB')
+    print(f'  {"stage":<22} {"calls":>7} {"wall s":>9} {"cpu s":>9}')
+    for name, entry in sorted(summary['stages'].items()):
+        print(f'  {name:<22} {entry["count"]:>7,} {entry["seconds"]:>9.2f} '
+              f'{entry["cpu_seconds"]:>9.2f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', help='recorded fixtures directory (default: synthetic)')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rps', type=float, default=1000, help='politeness budget per second')
+    parser.add_argument('--in-flight', type=int, default=8, help='concurrent requests')
+    parser.add_argument('--max-pages', type=int, default=2)
+    parser.add_argument('--mode', choices=['sequential', 'pipeline', 'scheduled'],
+                        action='append', help='flow to run, may be repeated (default: all)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.fixtures:
+            pages = replay.load_fixtures(args.fixtures)
+        else:
+            directory = os.path.join(tmp, 'fixtures')
+            replay.save_fixtures(synthetic_pages(pages=args.max_pages), directory)
+            pages = replay.load_fixtures(directory)
+        server = replay.ReplayServer(('127.0.0.1', 0), pages, latency_ms=args.latency_ms,
+                                     jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f'Replaying {len(pages):,} pages with {args.latency_ms:.0f} ms latency and '
+              f'{args.error_rate:.0%} errors.')
+        try:
+            for mode in args.mode or ['sequential', 'pipeline', 'scheduled']:
+                run(mode, server, tmp, args)
+        finally:
+            delete_replayed_rows(server.base_url)
+            server.shutdown()
@@ -0,0 +1,93 @@
+"""
+Measures the near-duplicate detector of near_duplicates on synthetic
+listings with planted reposts: MinHash signatures per second, and the
+recall, precision and number of comparisons of LSH candidates within
+blocks, against the all-pairs comparisons they replace.
+
+Usage (from the repository root):
+    PYTHONPATH=modules python benchmarks/bench_near_duplicates.py [listings] [duplicate_share]
+"""
+import sys
+import time
+import random
+import numpy as np
+from near_duplicates import (
+    signatures, listing_text, block_key, probe_keys, band_buckets, SIMILARITY_THRESHOLD,
+)
+
+CITIES = ['casablanca', 'rabat', 'marrakech', 'tanger', 'agadir', 'fès']
+WORDS = (
+    'appartement villa studio lumineux spacieux calme moderne neuf rénové terrasse jardin '
+    'piscine parking garage ascenseur concierge cuisine équipée salon chambres suite douche '
+    'proche tram école mosquée commerces plage centre quartier résidence sécurisée vue mer '
+    'bright spacious quiet modern furnished balcony elevator doorman kitchen living room '
+    'bedroom bathroom close to the tram school shops beach downtown secure residence sea view'
+).split()
+
+def random_listing(rng):
+    size = rng.randint(30, 400)
+    return {
+        'title': ' '.join(rng.choices(WORDS, k=rng.randint(4, 8))),
+        'description': ' '.join(rng.choices(WORDS, k=rng.randint(30, 120))),
+        'features': ', '.join(rng.sample(WORDS, rng.randint(0, 6))),
+        'city': rng.choice(CITIES),
+        'size': size,
+        'price': size * rng.randint(60, 160),
+    }
+
+def repost(listing, rng):
+    """Copies a listing as another agent would: a few words edited, a rounded size and price."""
+    words = listing['description'].split()
+    for _ in range(max(1, len(words) // 60)):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return dict(listing, description=' '.join(words),
+                size=listing['size'] + rng.randint(-3, 3),
+                price=int(round(listing['price'] * rng.uniform(0.95, 1.05), -2)))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    rng = random.Random(0)
+    # Reposts of reposts are duplicates of the whole group
+    listings, groups = [], []
+    while len(listings) < count:
+        if listings and rng.random() < share:
+            original = rng.randrange(len(listings))
+            groups.append(groups[original])
+            listings.append(repost(listings[original], rng))
+        else:
+            groups.append(len(listings))
+            listings.append(random_listing(rng))
+    members_of = {}
+    for i, group in enumerate(groups):
+        members_of.setdefault(group, []).append(i)
+    planted = {(a, b) for ids in members_of.values() for j, a in enumerate(ids) for b in ids[j + 1:]}
+
+    start = time.perf_counter()
+    sigs = signatures([listing_text(p['title'], p['description'], p['features'])
+                       for p in listings])
+    signature_rate = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    members = {}
+    for i, (p, sig) in enumerate(zip(listings, sigs)):
+        for bucket in band_buckets(sig, [block_key(p['city'], p['size'], p['price'])]):
+            members.setdefault(bucket, []).append(i)
+    compared, found = set(), set()
+    for i, (p, sig) in enumerate(zip(listings, sigs)):
+        for bucket in band_buckets(sig, probe_keys(p['city'], p['size'], p['price'])):
+            for other in members.get(bucket, ()):
+                pair = (min(i, other), max(i, other))
+                if other == i or pair in compared:
+                    continue
+                compared.add(pair)
+                if np.mean(sigs[i] == sigs[other]) >= SIMILARITY_THRESHOLD:
+                    found.add(pair)
+    lsh_seconds = time.perf_counter() - start
+
+    recall = len(found & planted) / len(planted) if planted else 1.0
+    precision = len(found & planted) / len(found) if found else 1.0
+    print(f'signatures: {signature_rate:,.0f} listings/sec')
+    print(f'LSH: {len(compared):,} comparisons instead of {count * (count - 1) // 2:,} '
+          f'in {lsh_seconds:.1f}s')
+    print(f'{len(planted):,} planted duplicate pairs: recall {recall:.1%}, precision {precision:.1%}')
@@ -0,0 +1,76 @@
+"""
+Checks that the lxml and BeautifulSoup backends produce identical property 
+details, then measures the parse throughput of each over saved HTML pages.
+
+Usage (from the repository root):
+    PYTHONPATH=modules python benchmarks/bench_parsers.py [fixtures_dir] [repeats]
+
+The fixtures directory defaults to the recorded replay fixtures. Pass 
+data/cache to benchmark against the pages of the last scraper run.
+"""
+import os
+import sys
+import gzip
+import time
+from extractors import SoupExtractor, LxmlExtractor
+from replay import FIXTURES_DIR
+from scraper import parse_details
+
+def load_fixtures(directory):
+    pages = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith('.html.gz'):
+                with gzip.open(path, 'rb') as f:
+                    pages.append((path, f.read()))
+            elif name.endswith('.html'):
+                with open(path, 'rb') as f:
+                    pages.append((path, f.read()))
+    return pages
+
+def parse_or_error(content, extractor):
+    try:
+        return parse_details(content, 'fixture', None, extractor=extractor)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+def check_parity(pages, reference, candidate):
+    mismatches = 0
+    for path, content in pages:
+        expected = parse_or_error(content, reference)
+        actual = parse_or_error(content, candidate)
+        if expected != actual:
+            mismatches += 1
+            print(f'MISMATCH {path}')
+            if isinstance(expected, dict) and isinstance(actual, dict):
+                for key in expected:
+                    if expected[key] != actual.get(key):
+                        print(f'  {key}: {expected[key]!r} != {actual.get(key)!r}')
+            else:
+                print(f'  {expected!r} != {actual!r}')
+    return mismatches
+
+def benchmark(pages, extractor, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for _, content in pages:
+            parse_or_error(content, extractor)
+    elapsed = time.perf_counter() - start
+    return len(pages) * repeats / elapsed
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else FIXTURES_DIR
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    pages = load_fixtures(directory)
+    if not pages:
+        sys.exit(f'No .html or .html.gz fixtures found in {directory}')
+
+    soup, lxml = SoupExtractor(), LxmlExtractor()
+    mismatches = check_parity(pages, soup, lxml)
+    print(f'Parity: {len(pages) - mismatches}/{len(pages)} pages identical')
+
+    for extractor in (soup, lxml):
+        rate = benchmark(pages, extractor, repeats)
+        print(f'{extractor.name:>5}: {rate:,.1f} pages/sec')
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,142 @@
+"""
+Measures p50/p99 latency and throughput of price prediction at batch sizes
+1, 64 and 1024: in process, over HTTP, and for many concurrent single
+listing clients sharing the micro-batcher. Also times the inline scoring
+of one insert batch, as done by `main.py --score`.
+
+Usage (from the repository root):
+    PYTHONPATH=modules python benchmarks/bench_predict.py
+
+A model is trained on synthetic listings in a temporary directory, no
+database needed.
+"""
+import json
+import time
+import random
+import tempfile
+import threading
+import http.client
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import train
+import predict
+
+CITIES = ['Casablanca', 'Rabat', 'Marrakech', 'Tanger', 'Agadir', 'Fes', 'Kenitra']
+AREAS = [f'Area {i}' for i in range(200)]
+FEATURES = ['Terrace', 'Elevator', 'Parking', 'Garden', 'Pool', 'Concierge', 'Furnished',
+            'Air conditioning', 'Security', 'Double glazing']
+BATCH_SIZES = [1, 64, 1024]
+# Default batch of `database.BatchSink`
+SINK_BATCH_SIZE = 200
+
+def synthetic_listings(n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        size = rng.randint(30, 400)
+        city = rng.choice(CITIES)
+        features = rng.sample(FEATURES, rng.randint(0, 6))
+        price = size * (140 if city == 'Casablanca' else 90) * rng.uniform(0.8, 1.2)
+        yield {
+            'title': 'Apartment for rent', 'description': 'Bright flat.',
+            'property_type': rng.choice(['Apartment', 'Villa', 'Studio']),
+            'city': city, 'area': rng.choice(AREAS), 'size': size,
+            'rooms': rng.randint(1, 8), 'bedrooms': rng.randint(1, 5),
+            'bathrooms': rng.choice([1, 2, 3, None]), 'price': int(price),
+            'features': ', '.join(features), 'condition': None, 'age': None,
+            'date_published': None, 'url': 'https://www.mubawab.ma/en/a/0',
+        }
+
+def train_model(n=50_000):
+    df = pd.DataFrame(list(synthetic_listings(n)))
+    vocabulary = []
+    matrix = train.encode_frame(df, vocabulary)
+    target = np.log1p(df['price'].to_numpy(dtype=float))
+    split = int(n * 0.9)
+    model, backend = train.fit_model(matrix[:split], target[:split], matrix[split:],
+                                     target[split:], train.feature_names(vocabulary))
+    train.save_model('rent', model, backend, {'vocabulary': vocabulary, 'last_id': n})
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return (1000 * statistics.median(timings),
+            1000 * timings[min(len(timings) - 1, int(len(timings) * 0.99))])
+
+def report(label, batch_size, timings, elapsed):
+    p50, p99 = percentiles(timings)
+    rate = batch_size * len(timings) / elapsed
+    print(f'{label:<14} {batch_size:>6} {p50:>9.2f} ms {p99:>9.2f} ms {rate:>12,.0f} /s')
+
+def bench_in_process(listings, batch_size, calls):
+    predictor = predict.get_predictor('rent')
+    batch = listings[:batch_size]
+    timings = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        call = time.perf_counter()
+        predictor.predict(batch)
+        timings.append(time.perf_counter() - call)
+    report('in-process', batch_size, timings, time.perf_counter() - start)
+
+def bench_scoring(listings, batch_size, calls):
+    batch = [dict(prop) for prop in listings[:batch_size]]
+    timings = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        call = time.perf_counter()
+        predict.score_properties(batch)
+        timings.append(time.perf_counter() - call)
+    report('score batch', batch_size, timings, time.perf_counter() - start)
+
+def bench_http(port, listings, batch_size, calls):
+    body = json.dumps(listings[:batch_size])
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    timings = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        call = time.perf_counter()
+        conn.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        timings.append(time.perf_counter() - call)
+    report('http', batch_size, timings, time.perf_counter() - start)
+    conn.close()
+
+def bench_concurrent_clients(port, listings, clients, calls):
+    body = json.dumps(listings[0])
+
+    def client(_):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        timings = []
+        for _ in range(calls):
+            call = time.perf_counter()
+            conn.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+            conn.getresponse().read()
+            timings.append(time.perf_counter() - call)
+        conn.close()
+        return timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        timings = [t for result in executor.map(client, range(clients)) for t in result]
+    report(f'http x{clients}', 1, timings, time.perf_counter() - start)
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        train.MODEL_DIR = tmp
+        train_model()
+        listings = list(synthetic_listings(max(BATCH_SIZES), seed=1))
+        print(f'{"mode":<14} {"batch":>6} {"p50":>12} {"p99":>12} {"listings":>14}')
+        for batch_size in BATCH_SIZES:
+            bench_in_process(listings, batch_size, 2000 if batch_size < 1024 else 200)
+        bench_scoring(listings, SINK_BATCH_SIZE, 1000)
+
+        server = predict.create_server(port=0)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for batch_size in BATCH_SIZES:
+            bench_http(port, listings, batch_size, 1000 if batch_size < 1024 else 100)
+        bench_concurrent_clients(port, listings, clients=32, calls=100)
+        batcher = server.RequestHandlerClass.batcher
+        print(f'Micro-batcher: {batcher.scored:,} listings in {batcher.batches:,} batches.')
+        server.shutdown()
@@ -0,0 +1,129 @@
+"""
+Times the queries the scraper and the analytics notebooks run against the
+property table, on millions of synthetic rows, before and after the
+indexes of `migrations.PROPERTY_INDEXES`.
+
+The baseline is the original schema, whose only index is the one behind
+`url UNIQUE`. Each query is timed with EXPLAIN ANALYZE, taking the median
+of several runs, and the sizes of the URL and URL hash indexes are compared.
+
+Usage (from the repository root, with the DB_* variables pointing at a
+local Postgres whose schema is migrated):
+    PYTHONPATH=modules python benchmarks/bench_queries.py [rows]
+
+The benchmark works in its own bench_query_properties table, which is
+dropped at the end.
+"""
+import sys
+import time
+import random
+import statistics
+from database import connect_db, close_database, url_key
+from migrations import property_index_ddl
+
+BENCH_TABLE = 'bench_query_properties'
+RUNS = 5
+
+def seed_table(cursor, n):
+    """
+    Fills the bench table with `n` rows generated inside the database. Rows
+    are appended in scrape order and about 2% of them have no city.
+    """
+    cursor.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+    cursor.execute(f'''
+        CREATE TABLE {BENCH_TABLE}
+        (LIKE properties_for_rent INCLUDING DEFAULTS INCLUDING GENERATED)
+    ''')
+    cursor.execute(f'''
+        INSERT INTO {BENCH_TABLE} (id, title, property_type, city, area, size, rooms,
+            price, date_published, url, scraped_at)
+        SELECT i,
+            'Apartment ' || i,
+            (ARRAY['Apartment', 'Villa', 'Studio', 'House', 'Riad'])[1 + i % 5],
+            CASE WHEN random() < 0.02 THEN NULL
+                 ELSE (ARRAY['casablanca', 'rabat', 'marrakech', 'tanger', 'agadir',
+                             'fes', 'kenitra', 'oujda', 'tetouan', 'sale'])[1 + (i * 7) % 10]
+            END,
+            'Area ' || (i % 300),
+            30 + (i % 370),
+            1 + (i % 8),
+            2000 + (i * 37) % 58000,
+            DATE '2020-01-01' + (i * 1500 / %s)::integer,
+            'https://www.mubawab.ma/en/a/' || i || '/apartment-for-rent-' || md5(i::text),
+            TIMESTAMP '2020-01-01' + (i * 1500 / %s) * INTERVAL '1 day'
+        FROM generate_series(1, %s) AS i
+    ''', (n, n, n))
+    cursor.execute(f'ALTER TABLE {BENCH_TABLE} ADD PRIMARY KEY (id), ADD UNIQUE (url)')
+    cursor.execute(f'ANALYZE {BENCH_TABLE}')
+    cursor.connection.commit()
+
+def queries(n, seed=0):
+    rng = random.Random(seed)
+    urls = [
+        f'https://www.mubawab.ma/en/a/{i}/apartment-for-rent-'
+        for i in rng.sample(range(1, n + 1), 1000)
+    ]
+    return {
+        'missing city page': (
+            f"SELECT id, area, url FROM {BENCH_TABLE} "
+            f"WHERE (city IS NULL OR city = '') AND id > %s ORDER BY id LIMIT 1000",
+            (n // 2,)),
+        'missing city count': (
+            f"SELECT count(*) FROM {BENCH_TABLE} WHERE (city IS NULL OR city = '') AND id > 0",
+            None),
+        'city/type/date filter': (
+            f"SELECT count(*), avg(price) FROM {BENCH_TABLE} "
+            f"WHERE city = 'rabat' AND property_type = 'Villa' "
+            f"AND date_published >= DATE '2023-06-01'",
+            None),
+        'recently scraped': (
+            f"SELECT count(*) FROM {BENCH_TABLE} "
+            f"WHERE scraped_at >= TIMESTAMP '2024-02-01'",
+            None),
+        # Matches nothing, like most dedup lookups of new listings
+        'dedup 1000 urls': (
+            f'SELECT url FROM {BENCH_TABLE} WHERE url = ANY(%s)', (urls,)),
+        'dedup 1000 url hashes': (
+            f'SELECT url_hash FROM {BENCH_TABLE} WHERE url_hash = ANY(%s)',
+            ([url_key(url) for url in urls],)),
+    }
+
+def time_query(cursor, query, params):
+    timings = []
+    for _ in range(RUNS):
+        cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + query, params)
+        timings.append(cursor.fetchone()[0][0]['Execution Time'])
+    return statistics.median(timings)
+
+def index_size(cursor, name):
+    cursor.execute('SELECT pg_size_pretty(pg_relation_size(%s::regclass))', (name,))
+    return cursor.fetchone()[0]
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    conn, cursor = connect_db()
+    try:
+        start = time.perf_counter()
+        seed_table(cursor, n)
+        print(f'Seeded {n:,} rows in {time.perf_counter() - start:.0f}s.')
+        baseline = {name: time_query(cursor, *query) for name, query in queries(n).items()}
+
+        start = time.perf_counter()
+        for statement in property_index_ddl(BENCH_TABLE):
+            cursor.execute(statement)
+        cursor.execute(f'ANALYZE {BENCH_TABLE}')
+        conn.commit()
+        print(f'Built indexes in {time.perf_counter() - start:.0f}s.')
+        indexed = {name: time_query(cursor, *query) for name, query in queries(n).items()}
+
+        print(f'{"query":<24} {"baseline":>12} {"indexed":>12} {"speed-up":>9}')
+        for name in baseline:
+            print(f'{name:<24} {baseline[name]:>9.1f} ms {indexed[name]:>9.1f} ms '
+                  f'{baseline[name] / max(indexed[name], 1e-3):>8.1f}x')
+        print(f'url index: {index_size(cursor, BENCH_TABLE + "_url_key")}, '
+              f'url_hash index: {index_size(cursor, BENCH_TABLE + "_url_hash")}')
+    finally:
+        conn.rollback()
+        cursor.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+        conn.commit()
+        close_database(conn, cursor)
@@ -0,0 +1,86 @@
+"""
+Checks the t-digests of the market rollups against exact quantiles on
+synthetic listing prices, as built in one go and as merged from monthly
+rollups, then measures how fast listings are rolled up, how large the
+stored digests are, and how long a dashboard read of the city rollups
+takes compared with recomputing them from the listings.
+
+Usage (from the repository root):
+    PYTHONPATH=modules python benchmarks/bench_rollups.py [listings]
+"""
+import sys
+import time
+import random
+import datetime
+import numpy as np
+import pandas as pd
+from rollups import TDigest, Rollup, rollup_rows, QUANTILES
+
+CITIES = [f'city-{i}' for i in range(60)]
+AREAS = [f'area-{i}' for i in range(20)]
+TYPES = ['Apartment', 'Villa', 'Studio', 'House', 'Office']
+MONTHS = [datetime.date(2023 + m // 12, m % 12 + 1, 1) for m in range(24)]
+
+def synthetic_rows(count, rng):
+    # City sizes follow a power law, like the real crawl
+    weights = [1 / (i + 1) for i in range(len(CITIES))]
+    for city in rng.choices(CITIES, weights, k=count):
+        size = rng.randint(25, 400)
+        price = int(size * rng.lognormvariate(4.5, 0.4)) if rng.random() > 0.03 else None
+        yield city, rng.choice(AREAS), rng.choice(TYPES), rng.choice(MONTHS), price, size
+
+def relative_error(estimate, exact):
+    return abs(estimate - exact) / exact
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    rng = random.Random(0)
+    rows = list(synthetic_rows(count, rng))
+    prices = np.array([price for *_, price, _ in rows if price], dtype=float)
+
+    whole = TDigest()
+    whole.update(prices.tolist())
+    monthly = {}
+    for *_, month, price, size in rows:
+        monthly.setdefault(month, Rollup()).add(price, size)
+    merged = Rollup()
+    for rollup in monthly.values():
+        merged.merge(Rollup(*rollup.values()))
+    worst = 0.0
+    for name, q in QUANTILES.items():
+        exact = np.quantile(prices, q)
+        errors = (relative_error(whole.quantile(q), exact),
+                  relative_error(merged.price.quantile(q), exact))
+        worst = max(worst, *errors)
+        print(f'{name:>6}: exact {exact:>9,.0f}, digest error {errors[0]:.3%}, '
+              f'merged from {len(monthly)} months {errors[1]:.3%}')
+
+    start = time.perf_counter()
+    rollups = rollup_rows(rows)
+    elapsed = time.perf_counter() - start
+    stored = [rollup.values() for rollup in rollups.values()]
+    digest_bytes = sum(len(values[-2]) + len(values[-1]) for values in stored)
+    print(f'rollup: {count / elapsed:,.0f} listings/sec into {len(rollups):,} rows, '
+          f'{digest_bytes / len(rollups):,.0f} digest bytes per row')
+
+    city_rows = [(key[1], values) for key, values in zip(rollups, stored) if key[0] == 'city']
+    df = pd.DataFrame(rows, columns=['city', 'area', 'property_type', 'month', 'price', 'size'])
+    read_ms = scan_ms = float('inf')
+    # Best of a few runs, as single reads are short enough to be noisy
+    for _ in range(3):
+        start = time.perf_counter()
+        cities = {}
+        for city, values in city_rows:
+            rollup = Rollup(*values)
+            cities[city] = cities[city].merge(rollup) if city in cities else rollup
+        top = sorted(cities.items(), key=lambda item: -item[1].listings)[:15]
+        summaries = [rollup.summary() for _, rollup in top]
+        read_ms = min(read_ms, 1000 * (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        top_cities = df['city'].value_counts().index[:15]
+        df[df['city'].isin(top_cities)].groupby('city')['price'].describe()
+        scan_ms = min(scan_ms, 1000 * (time.perf_counter() - start))
+    print(f'top-15 cities: {read_ms:.1f} ms from {len(city_rows):,} rollup rows, '
+          f'{scan_ms:.1f} ms scanning {count:,} listings already in memory')
+    sys.exit(1 if worst > 0.01 else 0)
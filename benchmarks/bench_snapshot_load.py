@@ -0,0 +1,67 @@
+"""
+Compares loading a pickled dump of the properties table, as the analysis
+notebook does, with reading the partitioned Parquet snapshot written by
+`export`: in full, for the columns a model uses, and for one city.
+
+Usage (from the repository root):
+    PYTHONPATH=modules python benchmarks/bench_snapshot_load.py [rows]
+
+Synthetic rows are written to a temporary directory, no database needed.
+"""
+import os
+import sys
+import time
+import random
+import datetime
+import tempfile
+import pandas as pd
+import pyarrow.dataset as ds
+import export
+
+CITIES = ['casablanca', 'rabat', 'marrakech', 'tanger', 'agadir', 'fes', 'kenitra', 'oujda']
+
+def synthetic_rows(n, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2023, 1, 1)
+    for i in range(1, n + 1):
+        yield (
+            i, f'Apartment {i} for rent', 'Bright flat close to the tram. ' * rng.randint(1, 6),
+            rng.choice(['Apartment', 'Villa', 'Studio', 'House']), rng.choice(CITIES),
+            rng.choice(['Maarif', 'Agdal', 'Gueliz', None]), rng.randint(30, 400),
+            rng.randint(1, 8), rng.randint(1, 5), rng.randint(1, 4), rng.randint(2000, 60000),
+            'Terrace, Elevator, Parking', rng.choice(['Good', 'New', None]),
+            rng.choice(['1-5 years', '5-10 years', None]),
+            (start + datetime.timedelta(days=i * 500 // n)).date(),
+            f'https://www.mubawab.ma/en/a/{i}',
+            start + datetime.timedelta(days=i * 500 // n),
+        )
+
+def timed(label, load):
+    start = time.perf_counter()
+    df = load()
+    print(f'{label:<28} {time.perf_counter() - start:>8.3f}s {len(df):>10,} rows')
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        export.EXPORT_DIR = tmp
+        rows = list(synthetic_rows(n))
+        os.makedirs(export.dataset_path())
+        for part, offset in enumerate(range(0, n, export.EXPORT_CHUNK_SIZE)):
+            ds.write_dataset(
+                export._to_table(rows[offset:offset + export.EXPORT_CHUNK_SIZE]),
+                export.dataset_path(), format='parquet',
+                partitioning=export.PARTITION_COLUMNS, partitioning_flavor='hive',
+                basename_template=f'part-0-{part}-{{i}}.parquet',
+                existing_data_behavior='overwrite_or_ignore',
+            )
+        pickle_path = os.path.join(tmp, 'full_db.pkl')
+        pd.DataFrame(rows, columns=export.EXPORT_COLUMNS).to_pickle(pickle_path)
+        del rows
+
+        timed('pickle, full', lambda: pd.read_pickle(pickle_path))
+        timed('parquet, full', lambda: export.load_properties())
+        timed('parquet, model columns', lambda: export.load_properties(
+            columns=['property_type', 'city', 'size', 'rooms', 'bedrooms', 'bathrooms', 'price']))
+        timed('parquet, one city', lambda: export.load_properties(
+            filter=ds.field('city') == 'rabat'))
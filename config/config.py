@@ -1,15 +0,0 @@
-CITIES = [
-    "casablanca", "rabat", "dar-bouazza", "mohammédia", "meknes", "bouznika",
-    "oujda", "berrechid", "sidi-rahal", "safi", "harhoura", "tamesna",
-    "al-hoceima", "sidi-rahal-chatai", "deroua", "sidi-bouknadel", "ait-melloul",
-    "sidi-allal-el-bahraoui", "tiznit", "ain-attig", "sidi-abdallah-ghiat",
-    "ksar-sghir", "sidi-bouzid", "bir-jdid", "marrakech", "agadir", "kénitra",
-    "temara", "el-jadida", "martil", "asilah", "saïdia", "nador", "m'diq",
-    "nouaceur", "béni-mellal", "mehdia", "chefchaouen", "taghazout",
-    "taroudant", "ourika", "oued-laou", "médiouna", "berkane", "tifelt",
-    "ifrane", "khémisset", "taza", "tanger", "bouskoura", "fès", "salé",
-    "essaouira", "tétouan", "el-mansouria", "benslimane", "skhirat", "el-menzeh",
-    "had-soualem", "zenata", "errahma", "settat", "cabo-negro", "larache",
-    "fnideq", "tit-mellil", "ain-aouda", "azemmour", "khouribga", "ben-guerir",
-    "azrou", "ouarzazate"
-]
\ No newline at end of file
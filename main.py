@@ -1,49 +1,141 @@
-from scraper import prepare_url, get_links, get_details
+from scraper import prepare_url, crawl_jobs, get_links, iter_details, dedup_stats
 from database import *
+from http_session import log_latency_stats, latency_stats
+from metrics import registry, profile
+from pipeline import run_pipeline
+from frontier import crawl
+from scheduler import run_schedule
+from config import CITIES
+from near_duplicates import index_inserted
+from revisit import revisit_listings
+from rollups import update_rollups
+import argparse
 import logging
+import contextlib
 import pandas as pd
 
-def main():
-    cities = [
-        "casablanca", "rabat", "dar-bouazza", "mohammédia", "meknès", "bouznika", 
-        "oujda", "berrechid", "sidi-rahal", "safi", "harhoura", "tamesna", 
-        "al-hoceïma", "sidi-rahal-chatai", "deroua", "sidi-bouknadel", "ait-melloul", 
-        "sidi-allal-el-bahraoui", "tiznit", "ain-attig", "sidi-abdallah-ghiat", 
-        "ksar-sghir", "sidi-bouzid", "bir-jdid", "marrakech", "agadir", "kénitra", 
-        "témara", "el-jadida", "martil", "asilah", "saïdia", "nador", "m'diq", 
-        "nouaceur", "béni-mellal", "mehdia", "chefchaouen", "taghazout", 
-        "taroudant", "ourika", "oued-laou", "médiouna", "berkane", "tiflet", 
-        "ifrane", "khémisset", "taza", "tanger", "bouskoura", "fès", "salé", 
-        "essaouira", "tétouan", "el-mansouria", "benslimane", "skhirat", "el-menzeh", 
-        "had-soualem", "zenata", "errahma", "settat", "cabo-negro", "larache", 
-        "fnideq", "tit-mellil", "ain-aouda", "azemmour", "khouribga", "ben-guerir", 
-        "azrou", "ouarzazate"
-    ]
-    conn = None
-    cursor = None
+def main(use_pipeline=False, resumable=False, incremental=False, max_pages=2,
+         markets=('rent', 'sale'), score=False, metrics_file='run_summary.json',
+         prometheus_file=None, scheduled=False, force=False, cities=CITIES,
+         near_duplicates=True, revisit=False, rollups=True):
+    scorer = None
+    if score:
+        from predict import get_predictor, score_properties
+        # Load the models up front, so a missing one fails before crawling
+        for market in markets:
+            get_predictor(market)
+        scorer = score_properties
+    indexer = index_inserted if near_duplicates else None
+    pipeline_metrics = schedule_summary = revisit_summary = None
     try:
-        # Initialise the database connection once
-        conn, cursor = initialise_database()
-        for city in cities:
-            try:
-                url = prepare_url(city, 'rent')
-                links = get_links(url, max_pages=2, cursor=cursor)
-                if links:
-                    properties = get_details(links)
-                    if not properties.empty:
-                        insert_properties(cursor, properties.to_dict('records'))
-                    else:
-                        logging.info('No new properties to insert.')
-                else:
-                    logging.info('No new property links found.')
-            except Exception as e:
-                logging.error(f'An error occurred: {e}')
-        conn.commit()
+        # Load the known URLs once so that dedup needs no per-page queries
+        with transaction() as cursor:
+            known_urls = load_scraped_urls(cursor, markets)
+        if scheduled:
+            schedule_summary = run_schedule(cities, markets, known_urls=known_urls,
+                                            incremental=incremental, scorer=scorer,
+                                            indexer=indexer, force=force)
+        elif resumable:
+            crawl(cities, known_urls=known_urls, markets=markets, max_pages=max_pages,
+                  incremental=incremental, scorer=scorer, indexer=indexer)
+        elif use_pipeline:
+            pipeline_metrics = run_pipeline(
+                cities, known_urls=known_urls, markets=markets, max_pages=max_pages,
+                incremental=incremental, scorer=scorer, indexer=indexer)
+        else:
+            for market, city in crawl_jobs(cities, markets):
+                with registry.labels(market=market, city=city):
+                    try:
+                        url = prepare_url(city, market)
+                        since = None
+                        if incremental:
+                            with transaction() as cursor:
+                                since = get_high_water_mark(cursor, city, market)
+                        links = get_links(url, max_pages=max_pages, known_urls=known_urls,
+                                          incremental=incremental, since=since, market=market)
+                        if links:
+                            # Records are streamed to the database in small batches
+                            with BatchSink(scorer=scorer, indexer=indexer) as sink:
+                                for prop in iter_details(links):
+                                    sink.write(prop, market)
+                                    known_urls.add(url_key(prop['url']))
+                            with transaction() as cursor:
+                                update_high_water_mark(cursor, city, links, market)
+                            if not sink.written:
+                                logging.info('No new properties to insert.')
+                        else:
+                            logging.info('No new property links found.')
+                    except Exception as e:
+                        logging.error(f'An error occurred: {e}')
+        if revisit:
+            revisit_summary = revisit_listings(markets)
+        if rollups:
+            for market in markets:
+                try:
+                    update_rollups(market)
+                except Exception as e:
+                    logging.error(f'Error updating the {market} rollups: {e}')
+        log_latency_stats()
+        log_pool_stats()
+        registry.log()
+        extra = {'http': latency_stats(), 'pool': pool_stats(), 'dedup': dict(dedup_stats)}
+        if pipeline_metrics:
+            extra['pipeline'] = pipeline_metrics
+        if schedule_summary:
+            extra['schedule'] = schedule_summary
+        if revisit_summary:
+            extra['revisit'] = revisit_summary
+        if metrics_file:
+            registry.write_summary(metrics_file, extra)
+        if prometheus_file:
+            registry.write_prometheus(prometheus_file)
     except Exception as e:
         logging.error(f'An error occurred during database initialization: {e}', exc_info=True)
     finally:
-        if conn and cursor:
-            close_database(conn, cursor)
+        close_pool()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Scrape property listings from mubawab.ma.')
+    parser.add_argument('--scheduled', action='store_true',
+                        help='walk the cities that are due concurrently, each within a page '
+                             'budget learnt from its previous walks')
+    parser.add_argument('--force', action='store_true',
+                        help='with --scheduled, walk every city even if it is not due')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run fetching, parsing and inserting as concurrent stages')
+    parser.add_argument('--resumable', action='store_true',
+                        help='checkpoint progress in the database so an interrupted crawl '
+                             'resumes, and several workers can share one crawl')
+    parser.add_argument('--incremental', action='store_true',
+                        help='stop walking a city at the first page of already seen listings')
+    parser.add_argument('--max-pages', type=int, default=2,
+                        help='listing pages to walk per city (default: 2)')
+    parser.add_argument('--market', dest='markets', action='append', choices=sorted(MARKETS),
+                        help='market to crawl, may be repeated (default: rent and sale)')
+    parser.add_argument('--score', action='store_true',
+                        help='store the predicted price of each new listing, using the '
+                             'models trained by train.py')
+    parser.add_argument('--revisit', action='store_true',
+                        help='after crawling, check known listings that are due for price '
+                             'drops and edits, recording changes in listing_history')
+    parser.add_argument('--no-near-duplicates', dest='near_duplicates', action='store_false',
+                        help='do not index new listings for near-duplicate detection')
+    parser.add_argument('--no-rollups', dest='rollups', action='store_false',
+                        help='do not add the new listings to the market rollups')
+    parser.add_argument('--metrics-file', default='run_summary.json',
+                        help='where to write the JSON run summary (default: run_summary.json)')
+    parser.add_argument('--prometheus-file',
+                        help='also write the metrics in Prometheus text format, e.g. for '
+                             'the node exporter textfile collector')
+    parser.add_argument('--profile', nargs='?', const='scraper.prof', metavar='PATH',
+                        help='profile the run with pyinstrument, or cProfile when it is not '
+                             'installed (default path: scraper.prof)')
+    args = parser.parse_args()
+    with profile(args.profile) if args.profile else contextlib.nullcontext():
+        main(use_pipeline=args.pipeline, resumable=args.resumable,
+             incremental=args.incremental, max_pages=args.max_pages,
+             markets=args.markets or ('rent', 'sale'), score=args.score,
+             metrics_file=args.metrics_file, prometheus_file=args.prometheus_file,
+             scheduled=args.scheduled, force=args.force,
+             near_duplicates=args.near_duplicates, revisit=args.revisit,
+             rollups=args.rollups)
\ No newline at end of file
@@ -0,0 +1,26 @@
+import os
+import json
+
+# The cities crawled in every mode, by their mubawab.ma URL slug
+CITIES_FILE = os.environ.get(
+    'CITIES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'raw', 'cities.json')
+)
+
+
+def load_cities(path=CITIES_FILE):
+    """
+    Loads the list of city slugs to crawl.
+
+    Args:
+        path (str, optional): JSON file holding a "cities" list.
+
+    Returns:
+        list: The city slugs, in crawl order and without duplicates.
+    """
+    with open(path, encoding='utf-8') as f:
+        cities = json.load(f)['cities']
+    return list(dict.fromkeys(cities))
+
+
+CITIES = load_cities()
@@ -1,9 +1,38 @@
 import re
 import pandas as pd
 import math
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, date
 import logging
+from metrics import registry
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pyarrow is optional, it only speeds up the column-wise cleaners
+    pa = pc = None
+
+# Patterns shared by the scalar and the column-wise cleaners, compiled once.
+# Flags are inline and groups named so that Arrow's RE2 engine accepts them.
+NON_DIGIT_RE = re.compile(r'[^\d]')
+DIGITS_RE = re.compile(r'\d+')
+ROOMS_RE = re.compile(r'(?i)(?P<rooms>\d+)\s*(?:\w+\s)?rooms?\b')
+AREA_CITY_RE = re.compile(r'(?i)^(?P<area>.*)\s+in\s+(?P<city>.*)$')
+# Exactly two runs of digits, i.e. what `clean_age` accepts
+TWO_NUMBERS_RE = re.compile(r'^\D*(?P<low>\d+)\D+(?P<high>\d+)\D*$')
+# A digit outside 0-9, which int() converts but pandas and RE2 do not
+UNICODE_DIGIT_RE = re.compile(r'(?![0-9])\d')
+# Characters that RE2 and Python's re classify differently (non-ASCII, plus 
+# the ASCII controls Python treats as whitespace)
+NON_PORTABLE_RE = re.compile(r'[^\x00-\x0a\x0c-\x1b\x20-\x7f]')
+
+# Mirrors clean_condition, which currently leaves 'Due for reform' as is
+CONDITIONS = {
+    'Good condition': 'Good',
+    'Due for reform': 'Due for reform',
+    'New': 'New',
+}
 
 def clean_integer(number_str):
     """
@@ -21,7 +50,7 @@ def clean_integer(number_str):
         return None
     try:
         # Remove all non-digit characters
-        number_str = re.sub(r'[^\d]', '', number_str)
+        number_str = NON_DIGIT_RE.sub('', number_str)
         return int(number_str)
     except ValueError:
         return None
@@ -54,7 +83,7 @@ def clean_age(age_str):
         return None
 
     # Extract all numbers from the string
-    numbers = re.findall(r'\d+', age_str)
+    numbers = DIGITS_RE.findall(age_str)
     if len(numbers) == 2:
         # Exactly two numbers found, format as 'min-max'
         min_age = int(numbers[0])
@@ -65,8 +94,7 @@ def clean_age(age_str):
         return None
         
 def clean_rooms(description):
-    pattern = r'(\d+)\s*(?:\w+\s)?rooms?\b'
-    match = re.search(pattern, description, re.IGNORECASE)
+    match = ROOMS_RE.search(description)
     if match:
         return int(match.group(1))
     return None
@@ -114,6 +142,7 @@ def safe_int(value):
         return None
     return int(value)
 
+@registry.timed('clean_property_data')
 def clean_property_data(prop):
     # Clean size
     prop['size'] = safe_int(prop.get('size'))
@@ -129,6 +158,9 @@ def clean_property_data(prop):
     date_published = prop.get('date_published')
     if isinstance(date_published, (pd.Timestamp, datetime)):
         prop['date_published'] = date_published.date()
+    elif isinstance(date_published, date):
+        # Already cleaned
+        prop['date_published'] = date_published
     else:
         prop['date_published'] = None
 
@@ -139,8 +171,7 @@ def parse_area_and_city(raw_area_text):
         logging.warning("raw_area_text is None or empty.")
         return None, None
     raw_area_text = raw_area_text.strip()
-    pattern = r'^(.*)\s+in\s+(.*)$'
-    match = re.search(pattern, raw_area_text, re.IGNORECASE)
+    match = AREA_CITY_RE.search(raw_area_text)
     if match:
         area = match.group(1).strip()
         city = match.group(2).strip()
@@ -150,3 +181,240 @@ def parse_area_and_city(raw_area_text):
         city = raw_area_text.strip()
         logging.debug(f"No 'in' found. Set area to None and city to '{city}' from raw_area_text: '{raw_area_text}'")
     return area, city
+
+# Column-wise versions of the cleaners above. Each takes a pandas Series of 
+# raw strings and returns, for every element, the value the scalar function 
+# would give, with missing values as None/<NA>. When pyarrow is installed 
+# the strings are Arrow-backed, so the .str methods run in compiled code. 
+# Rows where Arrow's regex engine would disagree with Python's re (see 
+# NON_PORTABLE_RE and UNICODE_DIGIT_RE) go through the scalar function.
+
+def _strings(series):
+    """
+    Returns the non-missing, non-empty values of a column as strings.
+    """
+    series = series.astype(object)
+    present = series[series.notna() & (series != '')]
+    return present.astype(pd.ArrowDtype(pa.string()) if pa else str)
+
+def _mask(text, pattern):
+    """
+    Flags the strings matching `pattern`, with Arrow when possible.
+    """
+    if pa is not None and isinstance(text.dtype, pd.ArrowDtype):
+        if pattern is UNICODE_DIGIT_RE:
+            # RE2 has no lookahead, but supports Unicode classes
+            matches = pc.match_substring_regex(pa.array(text), r'[^\P{Nd}0-9]')
+        else:
+            matches = pc.match_substring_regex(pa.array(text), pattern.pattern)
+        return pd.Series(matches.to_numpy(zero_copy_only=False), index=text.index, dtype=bool)
+    return text.str.contains(pattern).astype(bool)
+
+def _scalar(text, function):
+    """
+    Applies a scalar cleaner to the fallback rows, keeping Python ints as 
+    they are (Series.map would turn large ones into floats).
+    """
+    return pd.Series([function(value) for value in text.astype(object)],
+                     index=text.index, dtype=object)
+
+def _to_ints(digits, index):
+    """
+    Converts strings of digits to a nullable integer column aligned to 
+    `index`. Numbers too large for int64 are kept as Python ints.
+    """
+    result = pd.Series(pd.NA, index=index, dtype='Int64')
+    digits = digits[digits.notna() & (digits != '')]
+    short = (digits.str.len() <= 18).astype(bool)
+    if short.any():
+        result.loc[short[short].index] = digits[short].astype('int64').astype('Int64')
+    if not short.all():
+        result = result.astype(object)
+        result.loc[short[~short].index] = _scalar(digits[~short], int)
+    return result
+
+def _merge(result, fallback):
+    """
+    Writes the scalar function's results for the fallback rows into `result`.
+    """
+    if fallback.empty:
+        return result
+    if result.dtype == 'Int64':
+        try:
+            fallback = fallback.astype('Int64')
+        except (TypeError, ValueError, OverflowError):
+            result = result.astype(object)
+    result.loc[fallback.index] = fallback
+    return result
+
+def _to_object(series):
+    series = series.astype(object)
+    return series.where(series.notna(), None)
+
+def clean_integer_column(series):
+    """
+    Column-wise version of `clean_integer`.
+
+    Args:
+        series (pandas.Series): Raw numeric strings, e.g. prices.
+
+    Returns:
+        pandas.Series: The cleaned integers.
+    """
+    text = _strings(series)
+    slow = _mask(text, UNICODE_DIGIT_RE)
+    digits = text[~slow].str.replace(NON_DIGIT_RE.pattern, '', regex=True)
+    result = _to_ints(digits, series.index)
+    return _merge(result, _scalar(text[slow], clean_integer))
+
+def clean_text_column(series):
+    """
+    Column-wise version of `clean_text`.
+    """
+    # Python's strip() is kept, Arrow trims a different set of whitespace
+    series = series.astype(object)
+    present = series.notna() & (series != '')
+    return _to_object(series[present].astype(str).str.strip().reindex(series.index))
+
+def clean_age_column(series):
+    """
+    Column-wise version of `clean_age`.
+
+    Args:
+        series (pandas.Series): Raw age strings.
+
+    Returns:
+        pandas.Series: Age ranges in 'min-max' format, or None.
+    """
+    text = _strings(series)
+    slow = _mask(text, NON_PORTABLE_RE)
+    fast = text[~slow]
+    fast = fast[fast.str.lower().str.contains('years', regex=False).astype(bool)]
+    numbers = fast.str.extract(TWO_NUMBERS_RE.pattern).dropna()
+
+    result = pd.Series(None, index=series.index, dtype=object)
+    if not numbers.empty:
+        # Strip leading zeros as int() would
+        low = numbers['low'].str.lstrip('0').replace('', '0')
+        high = numbers['high'].str.lstrip('0').replace('', '0')
+        result.loc[numbers.index] = (low + '-' + high).astype(object)
+    return _merge(result, _scalar(text[slow], clean_age))
+
+def clean_rooms_column(series):
+    """
+    Column-wise version of `clean_rooms`. Missing descriptions give None.
+    """
+    text = _strings(series)
+    slow = _mask(text, NON_PORTABLE_RE)
+    digits = text[~slow].str.extract(ROOMS_RE.pattern)['rooms']
+    result = _to_ints(digits, series.index)
+    return _merge(result, _scalar(text[slow], clean_rooms))
+
+def clean_condition_column(series):
+    """
+    Column-wise version of `clean_condition`.
+    """
+    series = series.astype(object)
+    return _to_object(series.map(CONDITIONS).where(series.isin(list(CONDITIONS))))
+
+def parse_area_and_city_column(series):
+    """
+    Column-wise version of `parse_area_and_city`.
+
+    Args:
+        series (pandas.Series): Raw area text such as 'Maarif in Casablanca'.
+
+    Returns:
+        tuple: Two pandas.Series, the areas and the cities.
+    """
+    text = _strings(series)
+    slow = _mask(text, NON_PORTABLE_RE)
+    stripped = text[~slow].str.strip()
+    parts = stripped.str.extract(AREA_CITY_RE.pattern)
+    area = _to_object(parts['area'].str.strip().reindex(series.index))
+    city = parts['city'].str.strip()
+    city = _to_object(city.where(city.notna(), stripped).reindex(series.index))
+
+    if slow.any():
+        parsed = _scalar(text[slow], parse_area_and_city)
+        area.loc[parsed.index] = parsed.str[0]
+        city.loc[parsed.index] = parsed.str[1]
+    return area, city
+
+def clean_property_frame(df):
+    """
+    Column-wise version of `clean_property_data`, for whole DataFrames of 
+    parsed properties such as historical dumps.
+
+    Args:
+        df (pandas.DataFrame): One row per property.
+
+    Returns:
+        pandas.DataFrame: A cleaned copy of the DataFrame.
+    """
+    df = df.copy()
+    for field in ['size', 'price', 'rooms', 'bedrooms', 'bathrooms']:
+        if field not in df:
+            df[field] = None
+        column = df[field]
+        if pd.api.types.is_integer_dtype(column):
+            continue
+        if pd.api.types.is_float_dtype(column) and not (column.abs() >= 2 ** 63).any():
+            df[field] = np.trunc(column).astype('Int64')
+        else:
+            # Kept as Python ints, which pandas would otherwise turn into floats
+            df[field] = pd.Series(
+                [None if pd.isna(value) else safe_int(value) for value in column],
+                index=column.index, dtype=object)
+
+    dates = df['date_published'] if 'date_published' in df else pd.Series(None, index=df.index)
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        df['date_published'] = dates.dt.date.astype(object).where(dates.notna(), None)
+    else:
+        df['date_published'] = dates.map(
+            lambda value: clean_property_data({'date_published': value})['date_published'])
+    return df
+
+def clean_raw_frame(raw):
+    """
+    Cleans a whole table of raw scraped strings at once. Produces the same 
+    properties as running `scraper.parse_details` and `clean_property_data` 
+    on each row, using vectorised string operations and precompiled 
+    patterns instead of per-row Python.
+
+    Args:
+        raw (pandas.DataFrame or pyarrow.Table): One row per property, with 
+        the raw text of 'title', 'description', 'property_type', 
+        'area_text', 'size', 'rooms', 'bedrooms', 'bathrooms', 'price', 
+        'features', 'condition', 'age', plus 'date_published' and 'url'.
+
+    Returns:
+        pandas.DataFrame: The cleaned properties.
+    """
+    if hasattr(raw, 'to_pandas'):
+        raw = raw.to_pandas()
+    area, city = parse_area_and_city_column(raw['area_text'])
+    description = _to_object(raw['description'])
+    rooms = clean_integer_column(raw['rooms'])
+    missing_rooms = (rooms.isna() & description.notna() & (description != '')).astype(bool)
+    if missing_rooms.any():
+        rooms = _merge(rooms, clean_rooms_column(description[missing_rooms]).dropna())
+
+    cleaned = pd.DataFrame({
+        'title': clean_text_column(raw['title']),
+        'description': description,
+        'property_type': _to_object(raw['property_type']),
+        'city': city,
+        'area': area,
+        'size': clean_integer_column(raw['size']),
+        'rooms': rooms,
+        'bedrooms': clean_integer_column(raw['bedrooms']),
+        'bathrooms': clean_integer_column(raw['bathrooms']),
+        'price': clean_integer_column(raw['price']),
+        'features': _to_object(raw['features']),
+        'condition': clean_condition_column(raw['condition']),
+        'age': clean_age_column(raw['age']),
+        'date_published': raw['date_published'],
+        'url': raw['url'],
+    }, index=raw.index)
+    return clean_property_frame(cleaned)
@@ -1,88 +1,143 @@
-from database import connect_db, close_database
+from database import transaction, close_pool, market_table, MARKETS
 from scraper import fetch_raw_area_text_from_url
-from data_cleaning import parse_area_and_city 
+from data_cleaning import parse_area_and_city_column
+from throttle import MAX_IN_FLIGHT
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2.extras
+from psycopg2 import sql
+import pandas as pd
+import argparse
 import logging
 
-def fetch_records_with_missing_city(cursor):
-    query = "SELECT id, area, url FROM properties_for_rent WHERE city IS NULL OR city = ''"
-    cursor.execute(query)
+def fetch_records_with_missing_city(cursor, after_id=0, limit=None, market='rent'):
+    query = sql.SQL('''
+        SELECT id, area, url FROM {}
+        WHERE (city IS NULL OR city = '') AND id > %s
+        ORDER BY id
+        LIMIT %s
+    ''').format(sql.Identifier(market_table(market)))
+    cursor.execute(query, (after_id, limit))
     return cursor.fetchall()
 
-def update_city_for_record(cursor, record_id, area=None, city=None):
-    # Build the SET clause based on provided parameters
-    set_clauses = []
-    params = []
-
-    if area is not None:
-        set_clauses.append("area = %s")
-        params.append(area)
-    if city is not None:
-        set_clauses.append("city = %s")
-        params.append(city)
-
-    if not set_clauses:
-        # If neither area nor city is provided, do nothing
-        logging.warning(f"No data to update for record ID {record_id}")
-        return
-
-    params.append(record_id)
-    set_clause = ", ".join(set_clauses)
-    query = f"UPDATE properties_for_rent SET {set_clause} WHERE id = %s"
-    cursor.execute(query, params)
-
-
-def backfill_city_data():
-    import logging
-    conn = None
-    cursor = None
-    try:
-        # Attempt to connect to the database
-        conn, cursor = connect_db()
-    except Exception as e:
-        # If connection fails, log the error and exit
-        logging.error(f"Error connecting to the database: {e}", exc_info=True)
-        return
+def count_records_with_missing_city(cursor, after_id=0, market='rent'):
+    cursor.execute(
+        sql.SQL("SELECT count(*) FROM {} WHERE (city IS NULL OR city = '') AND id > %s").format(
+            sql.Identifier(market_table(market))),
+        (after_id,))
+    return cursor.fetchone()[0]
+
+def update_cities(cursor, updates, market='rent'):
+    """
+    Applies a batch of parsed areas and cities in a single statement.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        updates (list): Tuples of (record id, area, city). A None area 
+        leaves the stored area untouched.
+        market (str, optional): Either 'rent' or 'sale'.
+    """
+    query = sql.SQL('''
+        UPDATE {} AS p
+        SET area = COALESCE(v.area, p.area), city = v.city
+        FROM (VALUES %s) AS v(id, area, city)
+        WHERE p.id = v.id
+    ''').format(sql.Identifier(market_table(market)))
+    psycopg2.extras.execute_values(
+        cursor, query, updates, template='(%s::integer, %s::text, %s::text)',
+        page_size=len(updates) or 1)
+
+def refetch_raw_area_texts(urls, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Re-fetches the area text of several listings concurrently. Requests go 
+    through the scraper's shared rate limit and page cache.
+
+    Args:
+        urls (list): The listing URLs.
+
+    Returns:
+        list: The raw area text of each URL, or None where it failed.
+    """
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        return list(executor.map(fetch_raw_area_text_from_url, urls))
 
+def backfill_city_data(start_id=0, batch_size=1000, market='rent'):
+    """
+    Fills in the city (and area) of every record missing one.
+
+    Records are processed in id order, one batch per transaction: the area 
+    texts of the batch are parsed together, missing ones are re-fetched 
+    concurrently, and all updates are applied with one statement. Progress 
+    is logged with the last id committed, which can be passed back as 
+    `start_id` to resume.
+
+    Args:
+        start_id (int, optional): Only process records with a larger id.
+        batch_size (int, optional): Records per batch and transaction.
+        market (str, optional): Either 'rent' or 'sale'.
+    """
+    last_id = start_id
     try:
-        # Proceed with fetching records and updating the database
-        records = fetch_records_with_missing_city(cursor)
-        logging.info(f"Found {len(records)} records with missing city.")
-
-        for record in records:
-            record_id, raw_area_text, url = record
-            if raw_area_text is None:
-                logging.info(f"raw_area_text is None for record ID {record_id}, re-fetching from URL.")
-                raw_area_text = fetch_raw_area_text_from_url(url)
-                if raw_area_text is None:
-                    logging.warning(f"Could not fetch raw_area_text for record ID {record_id}")
-                    continue  # Skip this record
-
-            area, city = parse_area_and_city(raw_area_text)
-            if city:
-                if area:
-                    update_city_for_record(cursor, record_id, area=area, city=city)
-                    logging.info(f"Updated record ID {record_id}: area set to '{area}', city set to '{city}'")
-                else:
-                    update_city_for_record(cursor, record_id, city=city)
-                    logging.info(f"Updated record ID {record_id}: city set to '{city}'")
-            else:
-                logging.warning(f"Unable to parse city for record ID {record_id} with area text '{raw_area_text}'")
-
-        conn.commit()
+        with transaction() as cursor:
+            total = count_records_with_missing_city(cursor, start_id, market)
+        logging.info(f"Found {total} {market} records with missing city.")
+        done = updated = 0
+
+        while True:
+            with transaction(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                records = fetch_records_with_missing_city(cursor, last_id, batch_size, market)
+            if not records:
+                break
+            ids = [record[0] for record in records]
+            raw_texts = [record[1] for record in records]
+
+            # Re-fetch the area text of records that never had one, outside
+            # of any transaction so no connection is held during the requests
+            missing = [i for i, text in enumerate(raw_texts) if text is None]
+            if missing:
+                logging.info(f"Re-fetching area text for {len(missing)} records.")
+                fetched = refetch_raw_area_texts([records[i][2] for i in missing])
+                for i, text in zip(missing, fetched):
+                    raw_texts[i] = text
+
+            areas, cities = parse_area_and_city_column(pd.Series(raw_texts, dtype=object))
+            updates = [
+                (record_id, area, city)
+                for record_id, area, city in zip(ids, areas, cities) if city
+            ]
+            for record_id, text, city in zip(ids, raw_texts, cities):
+                if not city:
+                    logging.warning(f"Unable to parse city for record ID {record_id} with area text '{text}'")
+
+            if updates:
+                with transaction() as cursor:
+                    update_cities(cursor, updates, market)
+            last_id = ids[-1]
+            done += len(records)
+            updated += len(updates)
+            logging.info(
+                f"Backfill progress: {done}/{total} records, {updated} updated, "
+                f"last id {last_id}.")
+
         logging.info("City fields have been updated successfully.")
 
     except Exception as e:
-        # Handle exceptions during record processing
-        if conn:
-            conn.rollback()
-        logging.error(f"An error occurred during backfill: {e}", exc_info=True)
+        # The batch in progress was rolled back with its transaction
+        logging.error(
+            f"An error occurred during backfill: {e}. "
+            f"Resume with --market {market} --start-id {last_id}.",
+            exc_info=True)
     finally:
-        # Close cursor and connection
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        close_pool()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backfill missing cities and areas.')
+    parser.add_argument('--start-id', type=int, default=0,
+                        help='resume after this record id')
+    parser.add_argument('--market', choices=sorted(MARKETS), default='rent',
+                        help='market whose table to backfill (default: rent)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='records per batch and transaction (default: 1000)')
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
-    backfill_city_data()
+    backfill_city_data(start_id=args.start_id, batch_size=args.batch_size,
+                       market=args.market)
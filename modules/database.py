@@ -1,13 +1,230 @@
 import os
+import io
+import json
+import time
+import hashlib
+import threading
 import psycopg2
 import logging
 import psycopg2.extras
+import psycopg2.pool
+from contextlib import contextmanager
+from psycopg2 import sql
 from dotenv import load_dotenv
 import datetime
+import pandas as pd
 from data_cleaning import clean_property_data
+from migrations import migrate, URL_KEY_SQL
+from metrics import registry
 
 load_dotenv()  # Load variables from .env file
 
+# Bounds of the shared connection pool. Callers beyond POOL_MAX_CONN wait 
+# for a connection to be returned instead of failing.
+POOL_MIN_CONN = int(os.environ.get('DB_POOL_MIN_CONN', 1))
+POOL_MAX_CONN = int(os.environ.get('DB_POOL_MAX_CONN', 8))
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_ready = False
+_pool_stats = {'checkouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'in_use': 0}
+
+# Table holding the listings of each market, keyed by the payment slug used
+# in listing URLs. Every statement touching properties routes through here.
+MARKETS = {
+    'rent': 'properties_for_rent',
+    'sale': 'properties_for_sale',
+}
+
+def market_table(market):
+    """
+    Returns the table holding the listings of a market.
+
+    Args:
+        market (str): Either 'rent' or 'sale'.
+
+    Returns:
+        str: The table name.
+
+    Raises:
+        ValueError: If the market is unknown.
+    """
+    try:
+        return MARKETS[market]
+    except KeyError:
+        raise ValueError(f'Unknown market {market!r}, expected one of {sorted(MARKETS)}')
+
+def connection_params():
+    """
+    Reads the connection settings from the environment.
+
+    Returns:
+        dict: Keyword arguments for `psycopg2.connect`.
+    """
+    return {
+        'host': os.environ['DB_HOST'],
+        'database': os.environ['DB_NAME'],
+        'user': os.environ['DB_USER'],
+        'password': os.environ['DB_PASS'],
+        'port': os.environ['DB_PORT'],
+    }
+
+def normalize_url(url):
+    """
+    Strips the query string, fragment and trailing slash of a listing URL, 
+    which don't change the listing it points to.
+
+    Args:
+        url (str): The listing URL.
+
+    Returns:
+        str: The normalized URL.
+    """
+    return url.split('#', 1)[0].split('?', 1)[0].rstrip('/')
+
+def url_key(url):
+    """
+    Computes the uniqueness key of a listing, matching the `url_hash` 
+    column generated by the database.
+
+    Args:
+        url (str): The listing URL.
+
+    Returns:
+        bytes: The md5 digest of the normalized URL.
+    """
+    return hashlib.md5(normalize_url(url).encode('utf-8')).digest()
+
+def get_pool():
+    """
+    Returns the connection pool shared by every thread of the process, 
+    creating it on first use.
+
+    Returns:
+        psycopg2.pool.ThreadedConnectionPool: The shared pool.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN_CONN, POOL_MAX_CONN, **connection_params())
+            _pool_slots = threading.BoundedSemaphore(POOL_MAX_CONN)
+            logging.info(f'Opened a database pool of up to {POOL_MAX_CONN} connections.')
+        return _pool
+
+@contextmanager
+def pooled_connection():
+    """
+    Checks a connection out of the shared pool for the duration of the 
+    block, waiting for one to be returned if all are in use. The schema is 
+    bootstrapped on the first checkout of the process.
+
+    Yields:
+        psycopg2.extensions.connection: The database connection.
+    """
+    pool = get_pool()
+    start = time.perf_counter()
+    _pool_slots.acquire()
+    waited = time.perf_counter() - start
+    try:
+        conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    with _pool_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['wait_seconds'] += waited
+        _pool_stats['max_wait_seconds'] = max(_pool_stats['max_wait_seconds'], waited)
+        _pool_stats['in_use'] += 1
+    try:
+        ensure_schema(conn)
+        yield conn
+    finally:
+        with _pool_lock:
+            _pool_stats['in_use'] -= 1
+        # The pool rolls back a connection returned mid-transaction, and
+        # discards one that was closed
+        pool.putconn(conn, close=conn.closed != 0)
+        _pool_slots.release()
+
+def ensure_schema(conn):
+    """
+    Applies pending schema migrations once per process, on the first 
+    connection used.
+
+    Args:
+        conn (psycopg2.extensions.connection): The database connection.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        migrate(conn)
+        _schema_ready = True
+
+@contextmanager
+def transaction(cursor_factory=None):
+    """
+    Runs one unit of work in its own transaction, on a pooled connection 
+    and a fresh cursor. The transaction is committed when the block exits 
+    and rolled back if it raises.
+
+    Safe to use from any number of threads, each getting its own connection.
+
+    Args:
+        cursor_factory (type, optional): Cursor class, e.g. 
+        `psycopg2.extras.DictCursor`.
+
+    Yields:
+        psycopg2.extensions.cursor: The database cursor.
+    """
+    with pooled_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def pool_stats():
+    """
+    Summarises the use of the connection pool.
+
+    Returns:
+        dict: Checkouts, connections currently in use, and the total, mean 
+        and maximum time spent waiting for a free connection.
+    """
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    stats['pool_size'] = POOL_MAX_CONN
+    if stats['checkouts']:
+        stats['mean_wait_ms'] = 1000 * stats['wait_seconds'] / stats['checkouts']
+    return stats
+
+def log_pool_stats():
+    stats = pool_stats()
+    if not stats['checkouts']:
+        return
+    logging.info(
+        f"Database pool: {stats['checkouts']} checkouts, {stats['mean_wait_ms']:.1f}ms "
+        f"mean wait, {1000 * stats['max_wait_seconds']:.0f}ms max wait.")
+
+def close_pool():
+    """
+    Closes every connection of the shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            logging.info('Database pool closed.')
+
 def initialise_database():
     """
     Intialises the database connection and ensures the necessary tables 
@@ -17,121 +234,423 @@ def initialise_database():
         tuple: A tuple containing the database connection and cursor.
     """
     try:
-        conn = psycopg2.connect(
-            host=os.environ['DB_HOST'],
-            database=os.environ['DB_NAME'],
-            user=os.environ['DB_USER'],
-            password=os.environ['DB_PASS'],
-            port=os.environ['DB_PORT']
-        )
+        conn = psycopg2.connect(**connection_params())
+        ensure_schema(conn)
         cursor = conn.cursor()
-        # Create table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS properties_for_rent (
-                id SERIAL PRIMARY KEY,
-                title TEXT,
-                description TEXT,
-                property_type TEXT,
-                city TEXT,
-                area TEXT,
-                size INTEGER,
-                rooms INTEGER,
-                bedrooms INTEGER,
-                bathrooms INTEGER,
-                price INTEGER,
-                features TEXT,
-                condition TEXT,
-                age TEXT,
-                date_published DATE,
-                url TEXT UNIQUE,
-                scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        ''')
-        conn.commit()
         return conn, cursor
     except Exception as e:
         logging.error(f'Error connecting to the database: {e}')
         raise
 
-def is_url_scraped(cursor, url):
+@registry.timed('is_url_scraped')
+def is_url_scraped(cursor, url, market='rent'):
     """
     Checks if the URL is already present in the properties table
 
     Args:
         cursor (psycopg2.extensions.cursor): The database cursor.
         url (str): The URL to check.
+        market (str, optional): Either 'rent' or 'sale'.
 
     Returns:
         bool: True if the URL exists, False otherwise.
     """
     try:
-        cursor.execute('SELECT 1 FROM properties_for_rent WHERE url = %s', (url,))
+        cursor.execute(
+            sql.SQL('SELECT 1 FROM {} WHERE url_hash = %s').format(
+                sql.Identifier(market_table(market))),
+            (url_key(url),))
         result = cursor.fetchone()
         return result is not None
     except Exception as e:
         logging.error(f'Error checking if URL is scraped: {e}')
         return False
         
-def insert_properties(cursor, properties):
+@registry.timed('filter_scraped_urls')
+def filter_scraped_urls(cursor, urls, market='rent'):
+    """
+    Checks a batch of URLs against the properties table in a single query. 
+    URLs are matched on their normalized hash, so a listing seen under a 
+    different query string counts as scraped.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        urls (list): The URLs to check.
+        market (str, optional): Either 'rent' or 'sale'.
+
+    Returns:
+        set: The URLs that are already present in the table.
+    """
+    if not urls:
+        return set()
+    try:
+        keys = {}
+        for url in urls:
+            keys.setdefault(url_key(url), []).append(url)
+        cursor.execute(
+            sql.SQL('SELECT url_hash FROM {} WHERE url_hash = ANY(%s)').format(
+                sql.Identifier(market_table(market))),
+            (list(keys),))
+        return {url for (key,) in cursor.fetchall() for url in keys[bytes(key)]}
+    except Exception as e:
+        logging.error(f'Error checking if URLs are scraped: {e}')
+        return set()
+
+def load_scraped_urls(cursor, markets=None):
+    """
+    Loads the key of every URL already in the properties tables, so that a 
+    run can dedup listings in memory without querying the database per 
+    page. Keys are the `url_key` of each URL, so a listing linked with a 
+    tracking query or a trailing slash is still recognised. The markets 
+    share one set, as listing URLs never overlap between them.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        markets (list, optional): Markets to load, all of them by default.
+
+    Returns:
+        set: The `url_key` of every URL present in the tables.
+    """
+    keys = set()
+    for market in markets or MARKETS:
+        cursor.execute(sql.SQL('SELECT url_hash FROM {} WHERE url_hash IS NOT NULL').format(
+            sql.Identifier(market_table(market))))
+        keys.update(bytes(row[0]) for row in cursor.fetchall())
+    logging.info(f'Loaded {len(keys)} known URLs for deduplication.')
+    return keys
+
+def get_high_water_mark(cursor, city, market='rent'):
+    """
+    Returns the newest publication date seen in previous crawls of a city.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        city (str): The city slug used to build the crawl URL.
+        market (str, optional): Either 'rent' or 'sale'.
+
+    Returns:
+        datetime.date or None: The high-water mark, if the city was crawled.
+    """
+    cursor.execute(
+        'SELECT high_water FROM crawl_watermarks WHERE market = %s AND city = %s',
+        (market, city))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def update_high_water_mark(cursor, city, links_with_dates, market='rent'):
+    """
+    Raises the high-water mark of a city to the newest publication date 
+    among the given links. Should be called once those links are stored, 
+    and is committed with the caller's transaction.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        city (str): The city slug used to build the crawl URL.
+        links_with_dates (list): Tuples of (URL, publication date).
+        market (str, optional): Either 'rent' or 'sale'.
+    """
+    dates = [date.date() for _, date in links_with_dates if date is not None]
+    if not dates:
+        return
+    cursor.execute('''
+        INSERT INTO crawl_watermarks (market, city, high_water) VALUES (%s, %s, %s)
+        ON CONFLICT (market, city) DO UPDATE
+        SET high_water = GREATEST(crawl_watermarks.high_water, EXCLUDED.high_water)
+    ''', (market, city, max(dates)))
+
+# Columns written for each property, in the order used by every insert path
+PROPERTY_COLUMNS = [
+    'title', 'description', 'property_type', 'city', 'area', 'size', 'rooms',
+    'bedrooms', 'bathrooms', 'price', 'features', 'condition', 'age',
+    'date_published', 'url',
+]
+# Filled in by the optional scoring stage, left NULL for unscored listings
+SCORE_COLUMNS = ['predicted_price', 'price_residual']
+# Columns whose values make up the content hash of a listing. The URL and
+# publication date come from outside the listing page, so a revisit would
+# not see them.
+HASHED_COLUMNS = [column for column in PROPERTY_COLUMNS if column not in ('date_published', 'url')]
+_HASHED_POSITIONS = [PROPERTY_COLUMNS.index(column) for column in HASHED_COLUMNS]
+
+def prepare_property_record(prop):
+    """
+    Cleans a property dictionary and converts it to a tuple ordered as 
+    `PROPERTY_COLUMNS`.
+
+    Args:
+        prop (dict): The property data.
+
+    Returns:
+        tuple: The values to insert.
+    """
+    date_published = prop.get('date_published')
+    if date_published and isinstance(date_published, str):
+        # Parsed before cleaning, which drops dates that are not date objects
+        prop['date_published'] = datetime.datetime.strptime(date_published, '%Y-%m-%d').date()
+    prop = clean_property_data(prop)
+    return tuple(prop[column] for column in PROPERTY_COLUMNS)
+
+def content_hash(record):
+    """
+    Computes the content hash of a listing, stored in the `content_hash` 
+    column so a revisit can tell whether the listing changed.
+
+    Args:
+        record (tuple): The cleaned values, as returned by 
+        `prepare_property_record`.
+
+    Returns:
+        bytes: The md5 digest of the `HASHED_COLUMNS` values.
+    """
+    values = [record[position] for position in _HASHED_POSITIONS]
+    return hashlib.md5(json.dumps(values, default=str).encode('utf-8')).digest()
+
+@registry.timed('insert_properties')
+def insert_properties(cursor, properties, table='properties_for_rent'):
     """
     Inserts a list of property dictionaries into the database.
 
     Args:
         cursor (psycopg2.extensions.cursor): The database cursor.
         properties (list): A list of dictionaries containing property data.
+        table (str, optional): The table to insert into.
+
+    Returns:
+        list: The ids of the rows inserted, leaving out listings that were 
+        already in the table.
     """
     records = []
     for prop in properties:
         try:
-            prop = clean_property_data(prop)
-            date_published = prop.get('date_published')
-            if date_published and isinstance(date_published, str):
-                # Convert date string to datetime object
-                date_published = datetime.strptime(date_published, '%Y-%m-%d')
-            prop['date_published'] = date_published
-            record = (
-                prop['title'],
-                prop['description'],
-                prop['property_type'],
-                prop['city'],
-                prop['area'],
-                prop['size'],
-                prop['rooms'],
-                prop['bedrooms'],
-                prop['bathrooms'],
-                prop['price'],
-                prop['features'],
-                prop['condition'],
-                prop['age'],
-                prop['date_published'],
-                prop['url'],
-            )
-            records.append(record)
+            record = prepare_property_record(prop)
+            records.append(record + (content_hash(record),)
+                           + tuple(prop.get(column) for column in SCORE_COLUMNS))
         except Exception as e:
             logging.error(f'Error preparing record for URL {prop["url"]}: {e}')
+            registry.inc('records_rejected')
             continue
         
     if records:
         try:
-            insert_query = '''
-                INSERT INTO properties_for_rent (
-                    title, description, property_type, city, area, size, rooms, 
-                    bedrooms, bathrooms, price, features, condition, age, 
-                    date_published, url
-                ) VALUES %s
-                ON CONFLICT (url) DO NOTHING
-            '''
-            psycopg2.extras.execute_values(
-                cursor, insert_query, records, template=None, page_size=100
+            insert_query = sql.SQL('''
+                INSERT INTO {} ({}) VALUES %s
+                ON CONFLICT (url_hash) DO NOTHING
+                RETURNING id
+            ''').format(
+                sql.Identifier(table),
+                sql.SQL(', ').join(map(sql.Identifier,
+                                       PROPERTY_COLUMNS + ['content_hash'] + SCORE_COLUMNS)),
             )
+            ids = [row[0] for row in psycopg2.extras.execute_values(
+                cursor, insert_query, records, template=None, page_size=100, fetch=True
+            )]
             cursor.connection.commit()
+            registry.inc('records_inserted', len(ids))
             logging.info(
-                f'Inserted {len(records)} new properties into the database.')
+                f'Inserted {len(ids)} new properties into the database.')
+            return ids
         except Exception as e:
             logging.error(f'Error inserting properties into database: {e}')
+            registry.inc('insert_errors')
             logging.error(f'Problematic record: {records}')
             cursor.connection.rollback()
-            
+    return []
+
+def _copy_csv_line(record):
+    """
+    Formats a record as a line of CSV for COPY. Strings are always quoted 
+    and NULLs written as empty unquoted fields, which is how COPY tells an 
+    empty string from a missing value. The csv module cannot do this: 
+    QUOTE_NONNUMERIC quotes None as an empty string, and QUOTE_MINIMAL 
+    leaves empty strings unquoted. Bytes are written in bytea's hex format.
+    """
+    return ','.join(
+        '' if value is None
+        else '"' + value.replace('"', '""') + '"' if isinstance(value, str)
+        else '\\x' + value.hex() if isinstance(value, bytes)
+        else str(value)
+        for value in record
+    ) + '\n'
+
+def bulk_load_properties(cursor, properties, table='properties_for_rent',
+                         upsert=False, chunk_size=50000):
+    """
+    Loads a large number of properties with COPY, for backfills and 
+    re-imports where `insert_properties` would be too slow.
+
+    Rows are streamed in chunks into a temporary staging table, then merged 
+    into the target table with a single INSERT ... SELECT. Duplicate URLs 
+    within the input, after normalization, keep their last occurrence. 
+    Rows are loaded with their content hash, which an upsert also updates, 
+    so a revisit compares them like rows from `insert_properties`.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        properties (iterable): Dictionaries containing property data.
+        table (str, optional): The table to load into.
+        upsert (bool, optional): Overwrite existing rows with the same URL 
+        instead of skipping them.
+        chunk_size (int, optional): Rows buffered in memory per COPY.
+
+    Returns:
+        int: The number of rows inserted or updated.
+    """
+    loaded = PROPERTY_COLUMNS + ['content_hash']
+    columns = sql.SQL(', ').join(map(sql.Identifier, loaded))
+    try:
+        cursor.execute(sql.SQL('''
+            CREATE TEMP TABLE properties_staging ON COMMIT DROP AS
+            SELECT {} FROM {} WITH NO DATA
+        ''').format(columns, sql.Identifier(table)))
+        cursor.execute('ALTER TABLE properties_staging ADD COLUMN seq BIGSERIAL')
+        copy_query = sql.SQL(
+            "COPY properties_staging ({}) FROM STDIN WITH (FORMAT csv)"
+        ).format(columns).as_string(cursor)
+
+        buffer = io.StringIO()
+        staged = skipped = 0
+        for prop in properties:
+            try:
+                record = prepare_property_record(prop)
+                buffer.write(_copy_csv_line(record + (content_hash(record),)))
+                staged += 1
+            except Exception as e:
+                logging.error(f'Error preparing record for URL {prop.get("url")}: {e}')
+                skipped += 1
+                continue
+            if staged % chunk_size == 0:
+                buffer.seek(0)
+                cursor.copy_expert(copy_query, buffer)
+                buffer.seek(0)
+                buffer.truncate()
+        buffer.seek(0)
+        cursor.copy_expert(copy_query, buffer)
+
+        if upsert:
+            conflict = sql.SQL('DO UPDATE SET {}').format(sql.SQL(', ').join(
+                sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(column))
+                for column in loaded if column != 'url'
+            ))
+        else:
+            conflict = sql.SQL('DO NOTHING')
+        key = sql.SQL(URL_KEY_SQL.format('url'))
+        cursor.execute(sql.SQL('''
+            INSERT INTO {table} ({columns})
+            SELECT DISTINCT ON ({key}) {columns} FROM properties_staging
+            ORDER BY {key}, seq DESC
+            ON CONFLICT (url_hash) {conflict}
+        ''').format(table=sql.Identifier(table), columns=columns, key=key,
+                     conflict=conflict))
+        merged = cursor.rowcount
+        cursor.connection.commit()
+        logging.info(
+            f'Bulk loaded {staged} rows into {table}: {merged} merged, '
+            f'{skipped} skipped.')
+        return merged
+    except Exception as e:
+        logging.error(f'Error bulk loading properties into database: {e}')
+        cursor.connection.rollback()
+        raise
+
+def load_property_file(cursor, path, table='properties_for_rent', upsert=False):
+    """
+    Bulk loads a pickled DataFrame or CSV dump of properties, such as those 
+    in data/processed.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        path (str): Path to a .pkl or .csv file.
+        table (str, optional): The table to load into.
+        upsert (bool, optional): Overwrite existing rows with the same URL.
+
+    Returns:
+        int: The number of rows inserted or updated.
+    """
+    if path.endswith('.pkl'):
+        df = pd.read_pickle(path)
+    else:
+        df = pd.read_csv(path, parse_dates=['date_published'])
+    df = df.reindex(columns=PROPERTY_COLUMNS)
+    # Missing values become None rather than NaN so they load as NULL
+    df = df.astype(object).where(df.notna(), None)
+    return bulk_load_properties(
+        cursor, df.to_dict('records'), table=table, upsert=upsert)
+
+class BatchSink:
+    """
+    Collects property records and writes them to the database in 
+    fixed-size micro-batches, each committed on its own. A crash therefore 
+    loses at most one batch, and memory stays bounded by the batch size.
+
+    Records are routed to the table of the market they are written for, 
+    with a separate batch per market.
+
+    Usable as a context manager, which flushes the final partial batches. 
+    `written` counts the rows actually inserted, leaving out duplicates 
+    and batches that failed.
+
+    Args:
+        cursor (psycopg2.extensions.cursor, optional): The database cursor. 
+        When omitted, each batch is written in its own pooled transaction, 
+        so several sinks can write from different threads.
+        batch_size (int, optional): Number of records per insert.
+        scorer (callable, optional): Called as `scorer(batch, market)` on 
+        each whole batch before it is inserted, e.g. 
+        `predict.score_properties`, to fill in `SCORE_COLUMNS`.
+        indexer (callable, optional): Called as `indexer(cursor, market, 
+        ids)` with the ids of the rows each batch inserted, e.g. 
+        `near_duplicates.index_inserted`.
+    """
+
+    def __init__(self, cursor=None, batch_size=200, scorer=None, indexer=None):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.scorer = scorer
+        self.indexer = indexer
+        self.batches = {}
+        self.markets = {market_table(market): market for market in MARKETS}
+        self.written = 0
+
+    def write(self, prop, market='rent'):
+        table = market_table(market)
+        batch = self.batches.setdefault(table, [])
+        batch.append(prop)
+        if len(batch) >= self.batch_size:
+            self._write_batch(table)
+
+    def _write_batch(self, table):
+        batch = self.batches.pop(table, None)
+        if batch:
+            if self.scorer is not None:
+                try:
+                    self.scorer(batch, self.markets[table])
+                except Exception as e:
+                    # Listings are still worth keeping without a score
+                    logging.error(f'Error scoring a batch of {len(batch)} properties: {e}')
+            if self.cursor is None:
+                with transaction() as cursor:
+                    ids = self._insert(cursor, batch, table)
+            else:
+                ids = self._insert(self.cursor, batch, table)
+            self.written += len(ids)
+
+    def _insert(self, cursor, batch, table):
+        ids = insert_properties(cursor, batch, table)
+        if ids and self.indexer is not None:
+            self.indexer(cursor, self.markets[table], ids)
+            cursor.connection.commit()
+        return ids
+
+    def flush(self):
+        for table in list(self.batches):
+            self._write_batch(table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
 def close_database(conn, cursor):
     """
     Closes the database cursor and connection.
@@ -149,13 +668,7 @@ def close_database(conn, cursor):
         
 def connect_db():
     try:
-        conn = psycopg2.connect(
-                host=os.environ['DB_HOST'],
-                database=os.environ['DB_NAME'],
-                user=os.environ['DB_USER'],
-                password=os.environ['DB_PASS'],
-                port=os.environ['DB_PORT']
-        )
+        conn = psycopg2.connect(**connection_params())
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         return conn, cursor
     except Exception as e:
@@ -0,0 +1,259 @@
+import os
+import glob
+import json
+import shutil
+import logging
+import argparse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+from psycopg2 import sql
+from database import pooled_connection, close_pool, market_table, MARKETS
+
+# Snapshots are written to one hive-partitioned Parquet dataset per market,
+# <EXPORT_DIR>/<market>/city=<city>/scrape_month=<YYYY-MM>/part-<id>-<n>.parquet
+EXPORT_DIR = os.environ.get(
+    'EXPORT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'processed', 'parquet')
+)
+# Rows fetched from the database per round trip while streaming an export
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 50000))
+# Rows younger than this are left for the next export, as ids are handed out
+# before the transactions inserting them commit, and a row committed late
+# under a lower id would fall behind the bookmark
+EXPORT_SETTLE_SECONDS = int(os.environ.get('EXPORT_SETTLE_SECONDS', 300))
+STATE_FILE = '_export_state.json'
+PARTITION_COLUMNS = ['city', 'scrape_month']
+
+# Low-cardinality text is stored dictionary-encoded, and loads as pandas
+# categoricals
+SNAPSHOT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('title', pa.string()),
+    ('description', pa.string()),
+    ('property_type', pa.dictionary(pa.int32(), pa.string())),
+    ('city', pa.string()),
+    ('area', pa.dictionary(pa.int32(), pa.string())),
+    ('size', pa.int32()),
+    ('rooms', pa.int32()),
+    ('bedrooms', pa.int32()),
+    ('bathrooms', pa.int32()),
+    ('price', pa.int64()),
+    ('features', pa.string()),
+    ('condition', pa.dictionary(pa.int32(), pa.string())),
+    ('age', pa.dictionary(pa.int32(), pa.string())),
+    ('date_published', pa.date32()),
+    ('url', pa.string()),
+    ('scraped_at', pa.timestamp('us')),
+    ('scrape_month', pa.string()),
+])
+EXPORT_COLUMNS = [name for name in SNAPSHOT_SCHEMA.names if name != 'scrape_month']
+
+
+def dataset_path(market='rent'):
+    return os.path.join(EXPORT_DIR, market)
+
+
+def read_state(market='rent'):
+    """
+    Reads the bookmark of the last export of a market.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+
+    Returns:
+        dict: The last exported id and scrape time, zero and None when
+        nothing was exported yet.
+    """
+    try:
+        with open(os.path.join(dataset_path(market), STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'last_id': 0, 'last_scraped_at': None}
+
+
+def _write_state(market, state):
+    path = os.path.join(dataset_path(market), STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    # Replacing the file is atomic, so the bookmark is never half written
+    os.replace(path + '.tmp', path)
+
+
+def _to_table(rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for name, values in zip(EXPORT_COLUMNS, columns):
+        field = SNAPSHOT_SCHEMA.field(name)
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    scraped_at = arrays[EXPORT_COLUMNS.index('scraped_at')]
+    arrays.append(pc.strftime(scraped_at, format='%Y-%m'))
+    return pa.Table.from_arrays(arrays, schema=SNAPSHOT_SCHEMA)
+
+
+def export_properties(market='rent', chunk_size=EXPORT_CHUNK_SIZE,
+                      settle_seconds=EXPORT_SETTLE_SECONDS):
+    """
+    Appends the rows added since the last export of a market to its Parquet
+    dataset, partitioned by city and scrape month.
+
+    Rows are streamed from a server-side cursor in id order, so memory
+    stays bounded by the chunk size. Files written by the run are named
+    after the id the run started from: an export interrupted before its
+    bookmark was saved is cleaned up and redone by the next run, instead of
+    leaving duplicate rows behind.
+
+    The export stops before the first row younger than `settle_seconds`,
+    which is left for the next run with every row after it.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        chunk_size (int, optional): Rows fetched and written per batch.
+        settle_seconds (int, optional): Age a row must reach to be exported.
+
+    Returns:
+        int: The number of rows exported.
+    """
+    path = dataset_path(market)
+    os.makedirs(path, exist_ok=True)
+    state = read_state(market)
+    after_id = state['last_id']
+    for leftover in glob.glob(os.path.join(path, '**', f'part-{after_id}-*.parquet'),
+                              recursive=True):
+        os.remove(leftover)
+
+    exported = 0
+    last_scraped_at = state['last_scraped_at']
+    table_name = sql.Identifier(market_table(market))
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL('''
+                SELECT min(id) FROM {} WHERE id > %s
+                AND scraped_at >= now() - %s * interval '1 second'
+            ''').format(table_name), (after_id, settle_seconds))
+            unsettled_id = cursor.fetchone()[0]
+        # A named cursor streams the result instead of loading it at once
+        with conn.cursor(name='export_properties') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(sql.SQL('''
+                SELECT {} FROM {} WHERE id > %s AND (%s::bigint IS NULL OR id < %s)
+                ORDER BY id
+            ''').format(
+                sql.SQL(', ').join(map(sql.Identifier, EXPORT_COLUMNS)), table_name,
+            ), (after_id, unsettled_id, unsettled_id))
+            part = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                table = _to_table(rows)
+                ds.write_dataset(
+                    table, path, format='parquet',
+                    partitioning=PARTITION_COLUMNS, partitioning_flavor='hive',
+                    basename_template=f'part-{after_id}-{part}-{{i}}.parquet',
+                    existing_data_behavior='overwrite_or_ignore',
+                )
+                part += 1
+                exported += len(rows)
+                state['last_id'] = rows[-1][0]
+                latest = max((row[-1] for row in rows if row[-1] is not None), default=None)
+                if latest and (last_scraped_at is None or latest.isoformat() > last_scraped_at):
+                    last_scraped_at = latest.isoformat()
+        conn.rollback()
+
+    if exported:
+        state['last_scraped_at'] = last_scraped_at
+        _write_state(market, state)
+    logging.info(f'Exported {exported} {market} rows to {path}, up to id {state["last_id"]}.')
+    return exported
+
+
+def open_dataset(market='rent'):
+    """
+    Opens the Parquet dataset of a market without reading it. Files are
+    memory-mapped, so only the columns and partitions a query touches are
+    paged in.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+
+    Returns:
+        pyarrow.dataset.Dataset: The dataset.
+    """
+    return ds.dataset(
+        dataset_path(market), format='parquet',
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+        partitioning='hive',
+    )
+
+
+def load_properties(market='rent', columns=None, filter=None):
+    """
+    Loads an exported snapshot into pandas, for analysis or model training.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        columns (list, optional): Columns to read, all of them by default.
+        filter (pyarrow.compute.Expression, optional): Row filter, e.g.
+        `ds.field('city') == 'rabat'`. Filters on city and scrape month
+        skip whole partitions.
+
+    Returns:
+        pd.DataFrame: The properties, with categorical text columns.
+    """
+    table = open_dataset(market).to_table(columns=columns, filter=filter)
+    df = table.to_pandas()
+    # Partition values are plain strings in the dataset, as Arrow cannot
+    # unify partition dictionaries holding the null city
+    for column in PARTITION_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def compact(market='rent'):
+    """
+    Rewrites the dataset of a market with one file per partition, merging
+    the small files left by frequent incremental exports.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+    """
+    path = dataset_path(market)
+    state = read_state(market)
+    staging = path + '.compacting'
+    shutil.rmtree(staging, ignore_errors=True)
+    ds.write_dataset(
+        open_dataset(market), staging, format='parquet',
+        partitioning=PARTITION_COLUMNS, partitioning_flavor='hive',
+        basename_template='compacted-{i}.parquet',
+    )
+    shutil.rmtree(path)
+    os.rename(staging, path)
+    _write_state(market, state)
+    logging.info(f'Compacted the {market} dataset.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export properties to Parquet.')
+    parser.add_argument('--market', dest='markets', action='append', choices=sorted(MARKETS),
+                        help='market to export, may be repeated (default: all)')
+    parser.add_argument('--full', action='store_true',
+                        help='discard the existing dataset and export every row')
+    parser.add_argument('--compact', action='store_true',
+                        help='merge small files after exporting')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    try:
+        for market in args.markets or sorted(MARKETS):
+            if args.full:
+                shutil.rmtree(dataset_path(market), ignore_errors=True)
+            export_properties(market)
+            if args.compact:
+                compact(market)
+    finally:
+        close_pool()
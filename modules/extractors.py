@@ -0,0 +1,156 @@
+import os
+import logging
+from bs4 import BeautifulSoup, UnicodeDammit
+
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:  # lxml is optional, BeautifulSoup remains the fallback
+    etree = lxml_html = None
+
+# Declarative description of everything read from a property page. Each
+# entry is (field, tag, class, multiple, child tag):
+#   - single fields without a child return the stripped text of the first
+#     match and are required;
+#   - single fields with a child return the space-separated text of the
+#     child inside the first match, or None;
+#   - multiple fields return the raw text of every match, paired with the
+#     stripped text of the child when one is given.
+DETAIL_SPEC = [
+    ('price', 'h3', 'orangeTit', False, None),
+    ('area_text', 'h3', 'greyTit', False, None),
+    ('title', 'h1', 'searchTitle', False, None),
+    ('description', 'div', 'blockProp', False, 'p'),
+    ('descriptors', 'p', 'adMainFeatureContentValue', True, None),
+    ('details', 'div', 'adDetailFeature', True, 'span'),
+    ('features', 'span', 'fSize11 centered', True, None),
+]
+
+
+class SoupExtractor:
+    """Extracts the raw fields of a property page with BeautifulSoup."""
+
+    name = 'bs4'
+
+    def parse(self, content):
+        return BeautifulSoup(content, 'html.parser')
+
+    def find_all(self, root, tag, cls):
+        return root.find_all(tag, class_=cls)
+
+    def find_child(self, node, tag):
+        return node.find(tag)
+
+    def text(self, node):
+        return node.text
+
+    def spaced_text(self, node):
+        return node.get_text(separator=" ")
+
+
+class LxmlExtractor:
+    """
+    Extracts the raw fields of a property page with lxml, using XPath
+    expressions compiled once from `DETAIL_SPEC`. Text extraction skips
+    comments, scripts and styles to match BeautifulSoup's `get_text`.
+    """
+
+    name = 'lxml'
+
+    def __init__(self):
+        self._selectors = {
+            (tag, cls): etree.XPath(self._class_xpath(tag, cls))
+            for _, tag, cls, _, _ in DETAIL_SPEC
+        }
+        self._children = {
+            child: etree.XPath(f'descendant::{child}[1]')
+            for _, _, _, _, child in DETAIL_SPEC if child
+        }
+        self._text = etree.XPath(
+            './/text()[not(parent::script) and not(parent::style)]')
+
+    @staticmethod
+    def _class_xpath(tag, cls):
+        # A multi-word class only matches the exact attribute, as in bs4
+        if ' ' in cls:
+            return f"//{tag}[normalize-space(@class)='{cls}']"
+        return f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]"
+
+    def parse(self, content):
+        if isinstance(content, bytes):
+            try:
+                content = content.decode('utf-8')
+            except UnicodeDecodeError:
+                content = UnicodeDammit(content).unicode_markup
+        return lxml_html.document_fromstring(content)
+
+    def find_all(self, root, tag, cls):
+        return self._selectors[(tag, cls)](root)
+
+    def find_child(self, node, tag):
+        found = self._children[tag](node)
+        return found[0] if found else None
+
+    def text(self, node):
+        return ''.join(self._text(node))
+
+    def spaced_text(self, node):
+        return ' '.join(self._text(node))
+
+
+def extract_details(content, extractor):
+    """
+    Extracts the raw, uncleaned fields of a property page.
+
+    Args:
+        content (bytes): The raw HTML of the property page.
+        extractor (SoupExtractor or LxmlExtractor): The parser backend.
+
+    Returns:
+        dict: The raw text of every field in `DETAIL_SPEC`.
+
+    Raises:
+        AttributeError: If a required field or child is missing.
+    """
+    root = extractor.parse(content)
+    raw = {}
+    for field, tag, cls, multiple, child in DETAIL_SPEC:
+        nodes = extractor.find_all(root, tag, cls)
+        if multiple:
+            if child:
+                values = []
+                for node in nodes:
+                    child_node = extractor.find_child(node, child)
+                    if child_node is None:
+                        raise AttributeError(f"'{cls}' has no <{child}>")
+                    values.append((extractor.text(node), extractor.text(child_node).strip()))
+                raw[field] = values
+            else:
+                raw[field] = [extractor.text(node) for node in nodes]
+        elif child:
+            child_node = extractor.find_child(nodes[0], child) if nodes else None
+            raw[field] = extractor.spaced_text(child_node).strip() if child_node is not None else None
+        else:
+            if not nodes:
+                raise AttributeError(f"No <{tag}> with class '{cls}' found")
+            raw[field] = extractor.text(nodes[0]).strip()
+    return raw
+
+
+def get_extractor(name=None):
+    """
+    Returns the parser backend to use, defaulting to lxml when it is
+    installed. The choice can be forced with the PARSER_BACKEND variable.
+
+    Args:
+        name (str, optional): Either 'lxml' or 'bs4'.
+
+    Returns:
+        SoupExtractor or LxmlExtractor: The parser backend.
+    """
+    name = name or os.environ.get('PARSER_BACKEND') or ('lxml' if etree else 'bs4')
+    if name == 'lxml':
+        if etree is None:
+            logging.warning('lxml is not installed, falling back to BeautifulSoup.')
+            return SoupExtractor()
+        return LxmlExtractor()
+    return SoupExtractor()
@@ -0,0 +1,307 @@
+import os
+import re
+import time
+import socket
+import logging
+import requests
+from scraper import prepare_url, crawl_jobs, iter_listing_pages, iter_details
+from database import BatchSink, transaction, url_key, get_high_water_mark, update_high_water_mark
+from metrics import registry
+
+# A claim not renewed within this many seconds is assumed to belong to a
+# worker that died, and is handed to the next worker that asks.
+CLAIM_TIMEOUT = int(os.environ.get('CRAWL_CLAIM_TIMEOUT', 900))
+CLAIM_BATCH_SIZE = int(os.environ.get('CRAWL_CLAIM_BATCH_SIZE', 50))
+MAX_ATTEMPTS = 3
+
+
+def worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def _is_local_worker(worker):
+    """
+    Tells whether a `worker_name` was given on this machine.
+    """
+    host, _, pid = worker.rpartition('-')
+    return host == socket.gethostname() and pid.isdigit()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def release_dead_claims(cursor):
+    """
+    Releases claims held by workers on this machine that are no longer
+    running, so a restarted crawl resumes immediately instead of waiting
+    for those claims to time out.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+    """
+    # Matched exactly, as LIKE would also take in hosts whose name starts
+    # with this one, and read `_` in a hostname as a wildcard
+    pattern = '^' + re.escape(socket.gethostname()) + r'-\d+$'
+    cursor.execute('''
+        SELECT claimed_by FROM crawl_progress WHERE claimed_by ~ %s
+        UNION
+        SELECT claimed_by FROM crawl_frontier WHERE status = 'claimed' AND claimed_by ~ %s
+    ''', (pattern, pattern))
+    dead = [
+        worker for (worker,) in cursor.fetchall()
+        if _is_local_worker(worker) and not _pid_alive(int(worker.rsplit('-', 1)[1]))
+    ]
+    if dead:
+        cursor.execute(
+            'UPDATE crawl_progress SET claimed_by = NULL WHERE claimed_by = ANY(%s)', (dead,))
+        cursor.execute('''
+            UPDATE crawl_frontier SET status = 'pending', claimed_by = NULL
+            WHERE status = 'claimed' AND claimed_by = ANY(%s)
+        ''', (dead,))
+        logging.info(f'Released work claimed by {len(dead)} stopped workers.')
+
+
+def seed_jobs(cursor, jobs):
+    """
+    Registers the listing walks of a crawl. Walks that already have
+    progress recorded keep it, so calling this on restart resumes the crawl,
+    and walks that failed too often get their attempts back.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        jobs (list): Tuples of (market, city) to walk, in order.
+    """
+    cursor.executemany(
+        'INSERT INTO crawl_progress (market, city, position) VALUES (%s, %s, %s) '
+        'ON CONFLICT (market, city) DO UPDATE SET attempts = 0',
+        [(market, city, position) for position, (market, city) in enumerate(jobs)]
+    )
+
+
+def claim_city(cursor, worker):
+    """
+    Claims the next unfinished city whose listing pages nobody is walking.
+
+    Returns:
+        tuple or None: The market, the city and the last page already walked.
+    """
+    cursor.execute('''
+        UPDATE crawl_progress SET claimed_by = %s, claimed_at = now()
+        WHERE (market, city) = (
+            SELECT market, city FROM crawl_progress
+            WHERE NOT finished AND attempts < %s AND (
+                claimed_by IS NULL
+                OR claimed_at < now() - %s * INTERVAL '1 second')
+            ORDER BY position
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING market, city, last_page
+    ''', (worker, MAX_ATTEMPTS, CLAIM_TIMEOUT))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def discover_city(market, city, last_page, max_pages, known_urls, incremental=False):
+    """
+    Walks the listing pages of a city from where the last walk stopped,
+    adding new links to the frontier and checkpointing after every page.
+    Each page is committed in its own transaction, together with the
+    checkpoint and the city's high-water mark.
+
+    The city is marked finished only when the walk reaches the end of its
+    listings or the page limit. A request error releases the claim
+    instead, so the walk is retried from the last page committed, until
+    it has failed `MAX_ATTEMPTS` times.
+
+    Returns:
+        bool: True if the walk finished, False if it failed.
+    """
+    url = prepare_url(city, market)
+    since = None
+    if incremental:
+        with transaction() as cursor:
+            since = get_high_water_mark(cursor, city, market)
+    pages = iter_listing_pages(url, max_pages, known_urls=known_urls,
+                               start_page=last_page + 1, incremental=incremental,
+                               since=since, market=market, raise_errors=True)
+    try:
+        for page, links in pages:
+            with transaction() as cursor:
+                if links:
+                    cursor.executemany(
+                        'INSERT INTO crawl_frontier (url, market, city, date_published) '
+                        'VALUES (%s, %s, %s, %s) ON CONFLICT (url) DO NOTHING',
+                        [(link, market, city, publication_date)
+                         for link, publication_date in links]
+                    )
+                cursor.execute(
+                    'UPDATE crawl_progress SET last_page = %s, claimed_at = now() '
+                    'WHERE market = %s AND city = %s',
+                    (page, market, city))
+                update_high_water_mark(cursor, city, links, market)
+    except requests.RequestException as e:
+        with transaction() as cursor:
+            cursor.execute(
+                'UPDATE crawl_progress SET attempts = attempts + 1, claimed_by = NULL '
+                'WHERE market = %s AND city = %s RETURNING attempts, last_page',
+                (market, city))
+            attempts, page = cursor.fetchone()
+        if attempts >= MAX_ATTEMPTS:
+            logging.error(
+                f'Giving up on the {market} listing pages of {city} after page {page}, '
+                f'{attempts} walks failed: {e}')
+        else:
+            logging.warning(
+                f'Walk of the {market} listing pages of {city} failed after page {page}, '
+                f'releasing it to be resumed: {e}')
+        return False
+    with transaction() as cursor:
+        cursor.execute(
+            'UPDATE crawl_progress SET finished = TRUE, claimed_by = NULL '
+            'WHERE market = %s AND city = %s',
+            (market, city))
+    logging.info(f'Finished walking the {market} listing pages of {city}.')
+    return True
+
+
+def claim_urls(cursor, worker, limit=CLAIM_BATCH_SIZE):
+    """
+    Claims a batch of pending detail URLs, including ones whose claim has
+    expired. SKIP LOCKED lets any number of workers claim concurrently.
+
+    Returns:
+        list: Tuples of (URL, publication date, market).
+    """
+    cursor.execute('''
+        UPDATE crawl_frontier SET status = 'claimed', claimed_by = %s,
+            claimed_at = now(), attempts = attempts + 1
+        WHERE url IN (
+            SELECT url FROM crawl_frontier
+            WHERE status = 'pending' OR (
+                status = 'claimed'
+                AND claimed_at < now() - %s * INTERVAL '1 second')
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING url, date_published, market
+    ''', (worker, CLAIM_TIMEOUT, limit))
+    rows = [tuple(row) for row in cursor.fetchall()]
+    return rows
+
+
+def complete_urls(cursor, done, failed):
+    """
+    Marks fetched URLs as done, and returns failed ones to the frontier
+    until they run out of attempts.
+    """
+    if done:
+        cursor.execute(
+            "UPDATE crawl_frontier SET status = 'done' WHERE url = ANY(%s)", (list(done),))
+    if failed:
+        cursor.execute('''
+            UPDATE crawl_frontier
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                claimed_by = NULL
+            WHERE url = ANY(%s)
+        ''', (MAX_ATTEMPTS, list(failed)))
+
+
+def crawl_outstanding(cursor):
+    """
+    Returns True while any city is still being walked or any URL is still
+    waiting to be fetched.
+    """
+    cursor.execute('''
+        SELECT EXISTS (SELECT 1 FROM crawl_progress WHERE NOT finished AND attempts < %s)
+            OR EXISTS (SELECT 1 FROM crawl_frontier WHERE status IN ('pending', 'claimed'))
+    ''', (MAX_ATTEMPTS,))
+    return cursor.fetchone()[0]
+
+
+def finish_crawl(cursor):
+    """
+    Clears the checkpoint once a crawl is complete, so the next run starts
+    a new one. Failed URLs are kept for inspection, and walks that failed
+    are kept so the next crawl resumes them from their last page.
+    """
+    cursor.execute('DELETE FROM crawl_progress WHERE finished')
+    cursor.execute("DELETE FROM crawl_frontier WHERE status = 'done'")
+    logging.info('Crawl complete, checkpoint cleared.')
+
+
+def crawl(cities, known_urls=None, markets=('rent',), max_pages=2, incremental=False,
+          poll_interval=10, scorer=None, indexer=None):
+    """
+    Runs a resumable crawl as one worker. Progress lives in the database,
+    so a crawl that is interrupted picks up where it stopped, and several
+    workers, on one machine or many, can share the same crawl.
+
+    Each worker first helps walk the listing pages of unclaimed cities,
+    then fetches claimed batches of detail URLs until the frontier is empty.
+    Every step runs in its own short transaction on a pooled connection.
+    Each market of each city is a separate walk, and detail URLs of every
+    market share the same frontier.
+
+    Args:
+        cities (list): City slugs to crawl.
+        known_urls (set, optional): `database.url_key` of the URLs already
+        in the database.
+        markets (list, optional): Markets to crawl, 'rent' and/or 'sale'.
+        max_pages (int, optional): Listing pages to walk per city.
+        incremental (bool, optional): Stop walking a city at the first page
+        of already seen listings.
+        poll_interval (int, optional): Seconds to wait when other workers
+        hold all the remaining work.
+        scorer (callable, optional): Scores each insert batch, see
+        `database.BatchSink`.
+        indexer (callable, optional): Indexes the rows each batch inserted,
+        see `database.BatchSink`.
+    """
+    worker = worker_name()
+    with transaction() as cursor:
+        release_dead_claims(cursor)
+        seed_jobs(cursor, crawl_jobs(cities, markets))
+
+    while True:
+        with transaction() as cursor:
+            claimed_city = claim_city(cursor, worker)
+        if claimed_city:
+            market, city, last_page = claimed_city
+            if last_page:
+                logging.info(f'Resuming {market} listings of {city} after page {last_page}.')
+            with registry.labels(market=market, city=city):
+                discover_city(market, city, last_page, max_pages, known_urls, incremental)
+            continue
+
+        with transaction() as cursor:
+            batch = claim_urls(cursor, worker)
+        if batch:
+            done = set()
+            markets_by_url = {url: market for url, _, market in batch}
+            with BatchSink(scorer=scorer, indexer=indexer) as sink:
+                for prop in iter_details([(url, date) for url, date, _ in batch]):
+                    sink.write(prop, markets_by_url[prop['url']])
+                    done.add(prop['url'])
+            if known_urls is not None:
+                known_urls.update(url_key(url) for url in done)
+            with transaction() as cursor:
+                complete_urls(cursor, done, set(markets_by_url) - done)
+            continue
+
+        with transaction() as cursor:
+            outstanding = crawl_outstanding(cursor)
+        if not outstanding:
+            break
+        # Other workers still hold claims, wait in case they fail
+        time.sleep(poll_interval)
+
+    with transaction() as cursor:
+        finish_crawl(cursor)
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+from throttle import politeness, MAX_IN_FLIGHT
+
+# (connect, read) timeouts in seconds and the retry policy for transient
+# errors. The retry backoff doubles on every attempt and honours the
+# Retry-After header on 429 responses.
+CONNECT_TIMEOUT = float(os.environ.get('SCRAPER_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('SCRAPER_READ_TIMEOUT', 20))
+MAX_RETRIES = int(os.environ.get('SCRAPER_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('SCRAPER_BACKOFF_FACTOR', 0.5))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'header_seconds': 0.0, 'transfer_seconds': 0.0}
+
+
+def create_session(pool_size=MAX_IN_FLIGHT):
+    """
+    Creates a requests session with keep-alive pooling, compression
+    negotiation and retries.
+
+    Args:
+        pool_size (int, optional): Number of connections kept alive per
+        host. Should match the number of concurrent workers.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Advertises brotli alongside gzip/deflate when a decoder is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+
+def get_session():
+    """
+    Returns the session shared by every request in the scraper, creating it
+    on first use.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def fetch(url, **kwargs):
+    """
+    Performs a GET request through the shared session under the politeness
+    budget, recording how long it spent waiting for headers (connection
+    setup and server time) and reading the body.
+
+    Args:
+        url (str): The URL to fetch.
+        **kwargs: Extra arguments passed to `requests.Session.get`.
+
+    Returns:
+        requests.Response: The response, with its body already read.
+    """
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    politeness.acquire()
+    start = time.perf_counter()
+    response = get_session().get(url, **kwargs)
+    total = time.perf_counter() - start
+    header_seconds = response.elapsed.total_seconds()
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['header_seconds'] += header_seconds
+        _stats['transfer_seconds'] += max(total - header_seconds, 0.0)
+    return response
+
+
+def latency_stats():
+    """
+    Summarises request latency and connection reuse for the shared session.
+
+    Returns:
+        dict: Request count, connections opened, and the time spent before
+        the response headers arrived versus reading the body.
+    """
+    connections = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            for pool in adapter.poolmanager.pools.values():
+                connections += pool.num_connections
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['connections_opened'] = connections
+    if stats['requests']:
+        stats['mean_header_ms'] = 1000 * stats['header_seconds'] / stats['requests']
+        stats['mean_transfer_ms'] = 1000 * stats['transfer_seconds'] / stats['requests']
+    return stats
+
+
+def log_latency_stats():
+    stats = latency_stats()
+    if not stats['requests']:
+        return
+    logging.info(
+        f"HTTP: {stats['requests']} requests over {stats['connections_opened']} "
+        f"connections; {stats['mean_header_ms']:.0f}ms to headers and "
+        f"{stats['mean_transfer_ms']:.0f}ms transfer on average.")
@@ -0,0 +1,307 @@
+import os
+import io
+import json
+import time
+import bisect
+import pstats
+import logging
+import cProfile
+import datetime
+import functools
+import threading
+from contextlib import contextmanager
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# Upper bounds in seconds of the latency histogram buckets, spanning an
+# in-memory dedup check to a slow page fetch
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = 'scraper'
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets, in the Prometheus
+    model: quantiles are estimated from the buckets, so memory stays
+    constant however many values are observed.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimates a quantile by interpolating within its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count, 'sum': self.sum, 'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of the counters and latency histograms of a run.
+
+    Every value is recorded under a name and a set of labels. Labels set
+    with `labels()` apply to everything the current thread records, so
+    functions deep in the call stack are attributed to the city and market
+    being scraped without passing them down.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._context = threading.local()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.histograms.clear()
+
+    def current_labels(self):
+        return getattr(self._context, 'labels', {})
+
+    @contextmanager
+    def labels(self, **labels):
+        """Adds labels to everything recorded by this thread in the block."""
+        previous = self.current_labels()
+        self._context.labels = {**previous, **labels}
+        try:
+            yield
+        finally:
+            self._context.labels = previous
+
+    def bind(self, func):
+        """
+        Wraps a function so it records under the labels of the calling
+        thread, for work handed to a thread pool.
+        """
+        labels = self.current_labels()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.labels(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _key(self, name, labels):
+        return name, tuple(sorted({**self.current_labels(), **labels}.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Records how long the block took in the `name` histogram, and the CPU
+        time its thread spent in the `<name>_cpu_seconds` counter.
+        """
+        start = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+            self.inc(f'{name}_cpu_seconds', time.thread_time() - cpu, **labels)
+
+    def timed(self, name=None):
+        """Decorator recording every call of a function in a histogram."""
+        def decorator(func):
+            metric = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(metric):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self, extra=None):
+        """
+        Summarises the run so far.
+
+        Args:
+            extra (dict, optional): Other statistics to include, such as
+            the HTTP session's latency stats.
+
+        Returns:
+            dict: Totals per timed stage, then counters and histogram
+            summaries, each a list of entries with their labels.
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                {'name': name, 'labels': dict(labels), **histogram.summary()}
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        summary = {
+            'started_at': datetime.datetime.fromtimestamp(self.started).isoformat(),
+            'duration_seconds': time.time() - self.started,
+            'stages': self.totals(),
+            'counters': counters,
+            'histograms': histograms,
+        }
+        summary.update(extra or {})
+        return summary
+
+    def totals(self):
+        """
+        Returns each histogram's count, wall time and CPU time summed over
+        all its labels.
+        """
+        totals = {}
+        with self._lock:
+            for (name, _), histogram in self.histograms.items():
+                entry = totals.setdefault(name, {'count': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+                entry['count'] += histogram.count
+                entry['seconds'] += histogram.sum
+            for (name, _), value in self.counters.items():
+                timed = name[:-len('_cpu_seconds')]
+                if name.endswith('_cpu_seconds') and timed in totals:
+                    totals[timed]['cpu_seconds'] += value
+        return totals
+
+    def to_prometheus(self):
+        """
+        Renders the counters and histograms in the Prometheus text
+        exposition format, for the node exporter's textfile collector.
+
+        Returns:
+            str: The exposition text.
+        """
+        def label_text(labels, **more):
+            pairs = list(labels) + list(more.items())
+            if not pairs:
+                return ''
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f'{METRIC_PREFIX}_{name}_total'
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric}{label_text(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f'{METRIC_PREFIX}_{name}_seconds'
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{label_text(labels, le=bound)} {cumulative}')
+                lines.append(f'{metric}_bucket{label_text(labels, le="+Inf")} {histogram.count}')
+                lines.append(f'{metric}_sum{label_text(labels)} {histogram.sum}')
+                lines.append(f'{metric}_count{label_text(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_summary(self, path, extra=None):
+        _write_atomic(path, json.dumps(self.summary(extra), indent=2, default=str))
+        logging.info(f'Wrote the run summary to {path}.')
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.to_prometheus())
+        logging.info(f'Wrote Prometheus metrics to {path}.')
+
+    def log(self):
+        for name, entry in sorted(self.totals().items()):
+            logging.info(
+                f"Timed {name}: {entry['count']} calls, {entry['seconds']:.1f}s total, "
+                f"{entry['cpu_seconds']:.1f}s CPU.")
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    # Scrapers of the textfile collector must never see a partial file
+    os.replace(path + '.tmp', path)
+
+
+@contextmanager
+def profile(path):
+    """
+    Profiles the block, writing the report to `path`. Uses pyinstrument
+    when it is installed, as an HTML report for `.html` paths and text
+    otherwise, and falls back to cProfile, whose stats file can be opened
+    with `pstats` or snakeviz.
+
+    Only the calling thread is profiled, so work done by thread pools shows
+    up as time spent waiting on them.
+
+    Args:
+        path (str): Where to write the report.
+    """
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            report = profiler.output_html() if path.endswith('.html') else profiler.output_text()
+            _write_atomic(path, report)
+            logging.info(f'Wrote the pyinstrument profile to {path}.')
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        top = io.StringIO()
+        pstats.Stats(profiler, stream=top).sort_stats('cumulative').print_stats(15)
+        logging.info(f'Wrote the cProfile stats to {path}. Top functions:\n{top.getvalue()}')
+
+
+registry = MetricsRegistry()
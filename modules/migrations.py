@@ -0,0 +1,388 @@
+import logging
+import argparse
+from psycopg2 import sql
+
+# Lock key serialising migrations between workers starting at the same time
+MIGRATION_LOCK = 0x6D6F726F
+
+# The uniqueness key of a listing: the md5 of its URL without query string,
+# fragment or trailing slash. `database.url_key` computes the same value.
+URL_KEY_SQL = "decode(md5(rtrim(split_part(split_part({}, '#', 1), '?', 1), '/')), 'hex')"
+
+# Indexes of a property table, each matched to the queries that use it:
+#   - missing_city: the keyset scan of `data_update.fetch_records_with_missing_city`;
+#   - city_type_published: analytics filtering by city, type and date;
+#   - scraped_at: time-range scans. Rows are appended in scrape order, so a
+#     BRIN index prunes as well as a B-tree at a fraction of the size;
+#   - url_hash: uniqueness and dedup lookups on 16 bytes instead of the URL.
+PROPERTY_INDEXES = [
+    ('missing_city', False, "(id) WHERE city IS NULL OR city = ''"),
+    ('city_type_published', False, '(city, property_type, date_published)'),
+    ('scraped_at', False, 'USING brin (scraped_at)'),
+    ('url_hash', True, '(url_hash)'),
+]
+
+
+def property_index_ddl(table, names=None):
+    """
+    Builds the CREATE INDEX statements of `PROPERTY_INDEXES` for a table.
+
+    Args:
+        table (str): The property table.
+        names (list, optional): Only build these indexes.
+
+    Returns:
+        list: The statements, as `psycopg2.sql.Composed` objects.
+    """
+    return [
+        sql.SQL('CREATE {}INDEX IF NOT EXISTS {} ON {} {}').format(
+            sql.SQL('UNIQUE ' if unique else ''),
+            sql.Identifier(f'{table}_{name}'),
+            sql.Identifier(table),
+            sql.SQL(definition),
+        )
+        for name, unique, definition in PROPERTY_INDEXES
+        if names is None or name in names
+    ]
+
+
+def _create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS properties_for_rent (
+            id SERIAL PRIMARY KEY,
+            title TEXT,
+            description TEXT,
+            property_type TEXT,
+            city TEXT,
+            area TEXT,
+            size INTEGER,
+            rooms INTEGER,
+            bedrooms INTEGER,
+            bathrooms INTEGER,
+            price INTEGER,
+            features TEXT,
+            condition TEXT,
+            age TEXT,
+            date_published DATE,
+            url TEXT UNIQUE,
+            scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS crawl_watermarks (
+            city TEXT PRIMARY KEY,
+            high_water DATE NOT NULL
+        );
+    ''')
+
+
+def _create_frontier_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_progress (
+            city TEXT PRIMARY KEY,
+            position INTEGER,
+            last_page INTEGER NOT NULL DEFAULT 0,
+            finished BOOLEAN NOT NULL DEFAULT FALSE,
+            claimed_by TEXT,
+            claimed_at TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS crawl_frontier (
+            url TEXT PRIMARY KEY,
+            city TEXT,
+            date_published TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'pending',
+            claimed_by TEXT,
+            claimed_at TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS crawl_frontier_status ON crawl_frontier (status);
+    ''')
+
+
+def _index_query_patterns(cursor):
+    for statement in property_index_ddl(
+            'properties_for_rent', ['missing_city', 'city_type_published', 'scraped_at']):
+        cursor.execute(statement)
+
+
+def _hash_url_key(cursor):
+    cursor.execute(sql.SQL('''
+        ALTER TABLE properties_for_rent
+        ADD COLUMN IF NOT EXISTS url_hash BYTEA GENERATED ALWAYS AS ({}) STORED
+    ''').format(sql.SQL(URL_KEY_SQL.format('url'))))
+    # Listings stored under URLs differing only by query string or trailing
+    # slash are the same listing. The first one scraped is kept, the others
+    # are moved to an archive table with the id of the row they collided with
+    cursor.execute('''
+        CREATE TABLE properties_url_collisions (LIKE properties_for_rent);
+        ALTER TABLE properties_url_collisions
+            ADD COLUMN kept_id INTEGER NOT NULL,
+            ADD COLUMN archived_at TIMESTAMP NOT NULL DEFAULT now();
+        WITH kept AS (
+            SELECT url_hash, min(id) AS kept_id FROM properties_for_rent
+            GROUP BY url_hash HAVING count(*) > 1
+        ), moved AS (
+            DELETE FROM properties_for_rent AS p USING kept AS k
+            WHERE p.url_hash = k.url_hash AND p.id > k.kept_id
+            RETURNING p.*, k.kept_id
+        )
+        INSERT INTO properties_url_collisions SELECT * FROM moved
+    ''')
+    if cursor.rowcount:
+        logging.warning(
+            f'Moved {cursor.rowcount} listings duplicated under another URL to '
+            'properties_url_collisions.')
+    for statement in property_index_ddl('properties_for_rent', ['url_hash']):
+        cursor.execute(statement)
+    cursor.execute(
+        'ALTER TABLE properties_for_rent DROP CONSTRAINT IF EXISTS properties_for_rent_url_key')
+
+
+def _add_sale_market(cursor):
+    # Same columns and indexes as the rent table, with its own id sequence
+    cursor.execute('''
+        CREATE TABLE properties_for_sale (
+            LIKE properties_for_rent INCLUDING DEFAULTS INCLUDING GENERATED
+        );
+        CREATE SEQUENCE properties_for_sale_id_seq OWNED BY properties_for_sale.id;
+        ALTER TABLE properties_for_sale
+            ALTER COLUMN id SET DEFAULT nextval('properties_for_sale_id_seq'),
+            ADD PRIMARY KEY (id);
+    ''')
+    for statement in property_index_ddl('properties_for_sale'):
+        cursor.execute(statement)
+    # Crawl state written so far belongs to the rent market
+    cursor.execute('''
+        ALTER TABLE crawl_watermarks ADD COLUMN market TEXT NOT NULL DEFAULT 'rent';
+        ALTER TABLE crawl_watermarks DROP CONSTRAINT crawl_watermarks_pkey,
+            ADD PRIMARY KEY (market, city);
+        ALTER TABLE crawl_progress ADD COLUMN market TEXT NOT NULL DEFAULT 'rent';
+        ALTER TABLE crawl_progress DROP CONSTRAINT crawl_progress_pkey,
+            ADD PRIMARY KEY (market, city);
+        ALTER TABLE crawl_frontier ADD COLUMN market TEXT NOT NULL DEFAULT 'rent';
+    ''')
+
+
+def _add_price_scores(cursor):
+    # The residual is log(price / predicted_price): positive for listings
+    # asking more than the model expects, comparable across price ranges
+    for table in ('properties_for_rent', 'properties_for_sale'):
+        cursor.execute(sql.SQL('''
+            ALTER TABLE {}
+                ADD COLUMN predicted_price INTEGER,
+                ADD COLUMN price_residual REAL
+        ''').format(sql.Identifier(table)))
+
+
+def _create_city_stats(cursor):
+    # What each walk of a city found, from which the scheduler derives the
+    # city's page budget and when it is next due
+    cursor.execute('''
+        CREATE TABLE crawl_city_stats (
+            market TEXT NOT NULL,
+            city TEXT NOT NULL,
+            runs INTEGER NOT NULL DEFAULT 0,
+            requests BIGINT NOT NULL DEFAULT 0,
+            new_listings BIGINT NOT NULL DEFAULT 0,
+            page_budget INTEGER NOT NULL,
+            new_per_hour REAL,
+            last_crawled_at TIMESTAMP,
+            next_due_at TIMESTAMP,
+            PRIMARY KEY (market, city)
+        )
+    ''')
+
+
+
+def _create_near_duplicate_index(cursor):
+    # MinHash signatures of listing texts and their LSH buckets, the pairs
+    # found similar, and the clusters those pairs form, each identified by
+    # its oldest listing
+    cursor.execute('''
+        CREATE TABLE listing_signatures (
+            market TEXT NOT NULL,
+            id BIGINT NOT NULL,
+            signature BYTEA,
+            PRIMARY KEY (market, id)
+        );
+        CREATE TABLE listing_lsh_buckets (
+            market TEXT NOT NULL,
+            bucket BIGINT NOT NULL,
+            id BIGINT NOT NULL,
+            PRIMARY KEY (market, bucket, id)
+        );
+        CREATE TABLE near_duplicate_pairs (
+            market TEXT NOT NULL,
+            id_a BIGINT NOT NULL,
+            id_b BIGINT NOT NULL,
+            similarity REAL NOT NULL,
+            found_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (market, id_a, id_b)
+        );
+        CREATE TABLE near_duplicate_clusters (
+            market TEXT NOT NULL,
+            id BIGINT NOT NULL,
+            cluster_id BIGINT NOT NULL,
+            PRIMARY KEY (market, id)
+        );
+        CREATE INDEX near_duplicate_clusters_cluster ON near_duplicate_clusters (market, cluster_id);
+        CREATE VIEW near_duplicate_listings AS
+        SELECT c.market, c.cluster_id, c.id, c.id = c.cluster_id AS is_original,
+            count(*) OVER (PARTITION BY c.market, c.cluster_id) AS cluster_size,
+            p.title, p.city, p.area, p.size, p.price, p.url, p.scraped_at
+        FROM near_duplicate_clusters c
+        JOIN (
+            SELECT 'rent' AS market, id, title, city, area, size, price, url, scraped_at
+            FROM properties_for_rent
+            UNION ALL
+            SELECT 'sale', id, title, city, area, size, price, url, scraped_at
+            FROM properties_for_sale
+        ) p ON p.market = c.market AND p.id = c.id;
+    ''')
+
+
+def _create_listing_history(cursor):
+    # Hash of each listing's content as last seen, and a row per change a
+    # revisit found, with the price before and after it
+    for table in ('properties_for_rent', 'properties_for_sale'):
+        cursor.execute(sql.SQL('ALTER TABLE {} ADD COLUMN content_hash BYTEA').format(
+            sql.Identifier(table)))
+    cursor.execute('''
+        CREATE TABLE listing_history (
+            market TEXT NOT NULL,
+            id BIGINT NOT NULL,
+            observed_at TIMESTAMP NOT NULL DEFAULT now(),
+            price INTEGER,
+            previous_price INTEGER,
+            content_hash BYTEA NOT NULL,
+            PRIMARY KEY (market, id, observed_at)
+        )
+    ''')
+
+
+def _create_market_rollups(cursor):
+    # Aggregates of the listings of each market by city, area, property type
+    # and month, at several groupings, and the last listing id they include
+    cursor.execute('''
+        CREATE TABLE market_rollups (
+            market TEXT NOT NULL,
+            level TEXT NOT NULL,
+            city TEXT NOT NULL,
+            area TEXT NOT NULL,
+            property_type TEXT NOT NULL,
+            month DATE NOT NULL,
+            listings BIGINT NOT NULL,
+            priced BIGINT NOT NULL,
+            price_sum DOUBLE PRECISION NOT NULL,
+            sized BIGINT NOT NULL,
+            size_sum DOUBLE PRECISION NOT NULL,
+            price_per_m2_sum DOUBLE PRECISION NOT NULL,
+            price_digest BYTEA,
+            price_per_m2_digest BYTEA,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (market, level, city, area, property_type, month)
+        );
+        CREATE TABLE rollup_watermarks (
+            market TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0
+        );
+    ''')
+
+
+def _count_walk_attempts(cursor):
+    # Walks of a city that failed, so an unreachable city is retried from
+    # its last page a few times instead of being marked finished
+    cursor.execute(
+        'ALTER TABLE crawl_progress ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+
+
+# Applied in order, each in its own transaction. Never edit a migration that
+# has shipped, add a new one instead.
+MIGRATIONS = [
+    (1, 'Create the properties and watermark tables', _create_base_tables),
+    (2, 'Create the crawl frontier tables', _create_frontier_tables),
+    (3, 'Index missing cities, analytics filters and scrape time', _index_query_patterns),
+    (4, 'Key listings by the hash of their normalized URL', _hash_url_key),
+    (5, 'Add the sale market and key crawl state by market', _add_sale_market),
+    (6, 'Store the predicted price and residual of scored listings', _add_price_scores),
+    (7, 'Track the yield of each city walk for the crawl scheduler', _create_city_stats),
+    (8, 'Index listing texts to detect near duplicates', _create_near_duplicate_index),
+    (9, 'Hash listing contents and record the changes found by revisits',
+     _create_listing_history),
+    (10, 'Roll up listings by city, area, property type and month', _create_market_rollups),
+    (11, 'Count the failed walks of each city', _count_walk_attempts),
+]
+
+
+def current_version(cursor):
+    """
+    Returns the version of the newest migration applied.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+
+    Returns:
+        int: The schema version, 0 for an empty database.
+    """
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """
+    Brings the schema up to date by applying every pending migration, each
+    in its own transaction. An advisory lock makes concurrent callers wait
+    for each other, so only one applies each migration.
+
+    Args:
+        conn (psycopg2.extensions.connection): The database connection.
+        target (int, optional): Stop after this version.
+
+    Returns:
+        int: The schema version reached.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        ''')
+        conn.commit()
+        cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK,))
+        try:
+            version = current_version(cursor)
+            for number, description, apply in MIGRATIONS:
+                if number <= version or (target is not None and number > target):
+                    continue
+                try:
+                    apply(cursor)
+                    cursor.execute(
+                        'INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                        (number, description))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logging.error(f'Migration {number} ({description}) failed: {e}')
+                    raise
+                logging.info(f'Applied migration {number}: {description}.')
+                version = number
+            conn.commit()
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK,))
+            conn.commit()
+    return version
+
+
+if __name__ == '__main__':
+    from database import connection_params
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations.')
+    parser.add_argument('--target', type=int, help='stop after this version')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    conn = psycopg2.connect(**connection_params())
+    try:
+        logging.info(f'Schema is at version {migrate(conn, args.target)}.')
+    finally:
+        conn.close()
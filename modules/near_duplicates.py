@@ -0,0 +1,346 @@
+import os
+import re
+import zlib
+import math
+import hashlib
+import logging
+import argparse
+import numpy as np
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from database import transaction, close_pool, market_table, MARKETS
+
+# Signatures are NUM_PERM MinHash values, split into BANDS bands for LSH.
+# With 16 bands of 8 rows, listings of Jaccard similarity 0.8 share a
+# bucket 95% of the time, and ones of 0.4 less than 1% of the time.
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# Candidates are confirmed when their signatures agree on this share of
+# values, an estimate of the Jaccard similarity of their texts
+SIMILARITY_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.8))
+# Listings are only compared within a block of the same city and of close
+# size and price, on a log scale. Neighbouring blocks are probed too, so
+# listings either side of a block boundary still meet.
+SIZE_STEP = 1.15
+PRICE_STEP = 1.25
+INDEX_BATCH_SIZE = int(os.environ.get('NEAR_DUPLICATE_BATCH_SIZE', 5000))
+
+_rng = np.random.default_rng(0x6D696E68)
+# Multiply-shift hash functions, one per permutation. Products wrap around
+# 64 bits, and the high half is kept.
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+# Band hashes, one multiplier per row and band so equal bands of different
+# band numbers land in different buckets
+_BAND_MULTIPLIERS = _rng.integers(1, 2 ** 63, (BANDS, ROWS), dtype=np.uint64) | np.uint64(1)
+_MAX_HASH = np.uint32(0xFFFFFFFF)
+# Shingle hashes processed at once, bounding the NUM_PERM x n work matrix
+_CHUNK = 8192
+_WORD_RE = re.compile(r'\w+')
+
+
+def listing_text(title, description, features):
+    return ' '.join(filter(None, (title, description, features)))
+
+
+def shingles(text):
+    """
+    Returns the distinct word shingles of a text, hashed to 32 bits.
+
+    Args:
+        text (str): The listing text.
+
+    Returns:
+        np.ndarray: The shingle hashes as uint64.
+    """
+    words = _WORD_RE.findall((text or '').lower())
+    if len(words) < SHINGLE_SIZE:
+        grams = [' '.join(words)] if words else []
+    else:
+        grams = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.unique(np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams),
+                                 dtype=np.uint64, count=len(grams)))
+
+
+def signatures(texts):
+    """
+    Computes the MinHash signatures of several texts, vectorized over all
+    their shingles at once.
+
+    Args:
+        texts (list): The listing texts.
+
+    Returns:
+        np.ndarray: One row of NUM_PERM uint32 values per text. Texts
+        without any word get a row of the maximum value, and no bucket.
+    """
+    hashed = [shingles(text) for text in texts]
+    result = np.full((len(texts), NUM_PERM), _MAX_HASH, dtype=np.uint32)
+    start = 0
+    while start < len(hashed):
+        # Documents are grouped until the chunk holds enough shingles
+        end, total = start, 0
+        while end < len(hashed) and (total == 0 or total + len(hashed[end]) <= _CHUNK):
+            total += len(hashed[end])
+            end += 1
+        group = [h for h in hashed[start:end] if len(h)]
+        if group:
+            values = np.concatenate(group)
+            with np.errstate(over='ignore'):
+                mixed = (_MULTIPLIERS[:, None] * values[None, :] + _OFFSETS[:, None]) >> np.uint64(32)
+            offsets = np.cumsum([0] + [len(h) for h in group[:-1]])
+            minimums = np.minimum.reduceat(mixed.astype(np.uint32), offsets, axis=1).T
+            rows = [i for i in range(start, end) if len(hashed[i])]
+            result[rows] = minimums
+        start = end
+    return result
+
+
+def _step(value, step):
+    if value is None or value <= 0:
+        return None
+    return int(math.floor(math.log(value) / math.log(step)))
+
+
+def block_key(city, size, price, size_offset=0, price_offset=0):
+    size_step = _step(size, SIZE_STEP)
+    price_step = _step(price, PRICE_STEP)
+    return '|'.join((
+        (city or '').strip().lower(),
+        'na' if size_step is None else str(size_step + size_offset),
+        'na' if price_step is None else str(price_step + price_offset),
+    ))
+
+
+def probe_keys(city, size, price):
+    """Returns the block of a listing and the neighbouring blocks it probes."""
+    size_offsets = (-1, 0, 1) if _step(size, SIZE_STEP) is not None else (0,)
+    price_offsets = (-1, 0, 1) if _step(price, PRICE_STEP) is not None else (0,)
+    return [block_key(city, size, price, s, p) for s in size_offsets for p in price_offsets]
+
+
+def band_buckets(signature, blocks):
+    """
+    Hashes each band of a signature, salted with the listing's block, to
+    the signed 64-bit bucket ids stored in the index. The bands are hashed
+    once for all the blocks probed.
+
+    Args:
+        signature (np.ndarray): The listing's MinHash signature.
+        blocks (list): Block keys, see `block_key`.
+
+    Returns:
+        list: BANDS bucket ids per block.
+    """
+    salts = np.array([int.from_bytes(hashlib.blake2b(block.encode('utf-8'), digest_size=8).digest(),
+                                     'big') for block in blocks], dtype=np.uint64)
+    bands = signature.reshape(BANDS, ROWS).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        hashed = (bands * _BAND_MULTIPLIERS).sum(axis=1, dtype=np.uint64)
+    return (hashed[None, :] ^ salts[:, None]).view(np.int64).ravel().tolist()
+
+
+def index_listings(cursor, market, ids):
+    """
+    Adds listings to the signature index, and records the near duplicates
+    they have among the listings already indexed, including each other.
+
+    Only listings sharing an LSH bucket are compared, so the cost grows
+    with the number of new listings, not the size of the index.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str): Either 'rent' or 'sale'.
+        ids (list): Ids of the listings to index.
+
+    Returns:
+        int: The number of near-duplicate pairs found.
+    """
+    cursor.execute(sql.SQL('''
+        SELECT id, title, description, features, city, size, price
+        FROM {} WHERE id = ANY(%s)
+    ''').format(sql.Identifier(market_table(market))), (list(ids),))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    sigs = signatures([listing_text(title, description, features)
+                       for _, title, description, features, *_ in rows])
+    has_text = (sigs != _MAX_HASH).any(axis=1)
+
+    signature_rows, bucket_rows, probes = [], [], {}
+    for (id_, _, _, _, city, size, price), sig, text in zip(rows, sigs, has_text):
+        signature_rows.append((market, id_, sig.tobytes() if text else None))
+        if not text:
+            continue
+        for bucket in band_buckets(sig, [block_key(city, size, price)]):
+            bucket_rows.append((market, bucket, id_))
+        probes[id_] = band_buckets(sig, probe_keys(city, size, price))
+    execute_values(cursor, '''
+        INSERT INTO listing_signatures (market, id, signature) VALUES %s
+        ON CONFLICT (market, id) DO UPDATE SET signature = EXCLUDED.signature
+    ''', signature_rows)
+    if bucket_rows:
+        execute_values(cursor, '''
+            INSERT INTO listing_lsh_buckets (market, bucket, id) VALUES %s
+            ON CONFLICT DO NOTHING
+        ''', bucket_rows)
+    if not probes:
+        return 0
+
+    cursor.execute('''
+        SELECT b.bucket, b.id, s.signature
+        FROM listing_lsh_buckets b JOIN listing_signatures s USING (market, id)
+        WHERE b.market = %s AND b.bucket = ANY(%s)
+    ''', (market, list({bucket for buckets in probes.values() for bucket in buckets})))
+    members, candidate_sigs = {}, {}
+    for bucket, id_, signature in cursor.fetchall():
+        members.setdefault(bucket, []).append(id_)
+        candidate_sigs[id_] = np.frombuffer(bytes(signature), dtype=np.uint32)
+
+    pairs = {}
+    for id_, buckets in probes.items():
+        sig = candidate_sigs.get(id_)
+        if sig is None:
+            continue
+        candidates = {other for bucket in buckets for other in members.get(bucket, ())
+                      if other != id_}
+        for other in candidates:
+            pair = (min(id_, other), max(id_, other))
+            if pair in pairs:
+                continue
+            similarity = float(np.mean(sig == candidate_sigs[other]))
+            if similarity >= SIMILARITY_THRESHOLD:
+                pairs[pair] = similarity
+    if pairs:
+        execute_values(cursor, '''
+            INSERT INTO near_duplicate_pairs (market, id_a, id_b, similarity) VALUES %s
+            ON CONFLICT (market, id_a, id_b) DO UPDATE SET similarity = EXCLUDED.similarity
+        ''', [(market, a, b, similarity) for (a, b), similarity in pairs.items()])
+        _merge_clusters(cursor, market, list(pairs))
+    return len(pairs)
+
+
+def _merge_clusters(cursor, market, pairs):
+    """
+    Merges the clusters joined by new pairs, with union-find over the
+    pairs and the clusters their listings already belong to. A cluster is
+    identified by its oldest listing.
+    """
+    ids = {id_ for pair in pairs for id_ in pair}
+    cursor.execute(
+        'SELECT id, cluster_id FROM near_duplicate_clusters WHERE market = %s AND id = ANY(%s)',
+        (market, list(ids)))
+    current = dict(cursor.fetchall())
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(a, b):
+        a, b = find(a), find(b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    for a, b in pairs:
+        union(a, b)
+    for id_, cluster_id in current.items():
+        union(id_, cluster_id)
+
+    merged = {}
+    for node in list(parent):
+        merged.setdefault(find(node), set()).add(node)
+    for root, nodes in merged.items():
+        old_clusters = {current[id_] for id_ in nodes if id_ in current} - {root}
+        if old_clusters:
+            cursor.execute(
+                'UPDATE near_duplicate_clusters SET cluster_id = %s '
+                'WHERE market = %s AND cluster_id = ANY(%s)',
+                (root, market, list(old_clusters)))
+        execute_values(cursor, '''
+            INSERT INTO near_duplicate_clusters (market, id, cluster_id) VALUES %s
+            ON CONFLICT (market, id) DO UPDATE SET cluster_id = EXCLUDED.cluster_id
+        ''', [(market, id_, root) for id_ in nodes])
+
+
+def index_new_listings(market='rent', batch_size=INDEX_BATCH_SIZE):
+    """
+    Indexes every listing of a market that is not in the index yet, e.g.
+    rows loaded before the index existed or whose indexing failed. Each
+    batch is committed on its own.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        batch_size (int, optional): Listings indexed per transaction.
+
+    Returns:
+        tuple: The number of listings indexed and of pairs found.
+    """
+    indexed = found = 0
+    last_id = 0
+    while True:
+        with transaction() as cursor:
+            cursor.execute(sql.SQL('''
+                SELECT p.id FROM {} p
+                WHERE p.id > %s AND NOT EXISTS (
+                    SELECT 1 FROM listing_signatures s WHERE s.market = %s AND s.id = p.id)
+                ORDER BY p.id LIMIT %s
+            ''').format(sql.Identifier(market_table(market))), (last_id, market, batch_size))
+            ids = [id_ for id_, in cursor.fetchall()]
+            if not ids:
+                break
+            found += index_listings(cursor, market, ids)
+        indexed += len(ids)
+        last_id = ids[-1]
+        logging.info(f'Indexed {indexed} {market} listings, {found} near-duplicate pairs so far.')
+    return indexed, found
+
+
+def index_inserted(cursor, market, ids):
+    """
+    Indexes freshly inserted listings, for use as the `indexer` of a
+    `database.BatchSink`. A failure leaves the listings for
+    `index_new_listings` to pick up.
+    """
+    try:
+        cursor.execute('SAVEPOINT near_duplicates')
+        found = index_listings(cursor, market, ids)
+        cursor.execute('RELEASE SAVEPOINT near_duplicates')
+    except Exception as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT near_duplicates')
+        logging.error(f'Error indexing {len(ids)} {market} listings for near duplicates: {e}')
+        return
+    if found:
+        logging.info(f'Found {found} near-duplicate pairs among new {market} listings.')
+
+
+def duplicate_ids(cursor, market='rent'):
+    """
+    Returns the listings that duplicate an older one, i.e. every member of
+    a cluster but the one identifying it.
+
+    Returns:
+        set: The ids of the duplicate listings.
+    """
+    cursor.execute(
+        'SELECT id FROM near_duplicate_clusters WHERE market = %s AND id <> cluster_id',
+        (market,))
+    return {id_ for id_, in cursor.fetchall()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index listings for near-duplicate detection.')
+    parser.add_argument('--market', dest='markets', action='append', choices=sorted(MARKETS),
+                        help='market to index, may be repeated (default: all)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    try:
+        for market in args.markets or sorted(MARKETS):
+            index_new_listings(market)
+    finally:
+        close_pool()
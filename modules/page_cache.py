@@ -0,0 +1,218 @@
+import os
+import gzip
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+import requests
+from http_session import fetch
+
+# Pages are stored gzip-compressed under a key derived from their URL, with
+# an SQLite index holding the validators used for conditional requests.
+CACHE_DIR = os.environ.get(
+    'PAGE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache', 'pages')
+)
+DEFAULT_TTL = float(os.environ.get('PAGE_CACHE_TTL', 7 * 24 * 3600))
+MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# In offline mode every page is served from the cache and misses fail fast
+OFFLINE = os.environ.get('PAGE_CACHE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+_lock = threading.Lock()
+_index = None
+_total_bytes = 0
+
+
+class PageNotCached(requests.RequestException):
+    """Raised in offline mode when a page has never been cached."""
+
+
+def _connect():
+    global _index, _total_bytes
+    if _index is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _index = sqlite3.connect(
+            os.path.join(CACHE_DIR, 'index.sqlite'), check_same_thread=False
+        )
+        _index.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )
+        ''')
+        _index.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)')
+        _total_bytes = _index.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+    return _index
+
+
+def _key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, key[:2], key + '.html.gz')
+
+
+def _lookup(url):
+    key = _key(url)
+    with _lock:
+        row = _connect().execute(
+            'SELECT etag, last_modified, fetched_at FROM pages WHERE key = ?', (key,)
+        ).fetchone()
+    if row is None:
+        return None
+    try:
+        with gzip.open(_path(key), 'rb') as f:
+            content = f.read()
+    except OSError:
+        return None
+    etag, last_modified, fetched_at = row
+    return {'etag': etag, 'last_modified': last_modified,
+            'fetched_at': fetched_at, 'content': content}
+
+
+def _touch(url, revalidated=False):
+    now = time.time()
+    with _lock:
+        if revalidated:
+            _connect().execute(
+                'UPDATE pages SET accessed_at = ?, fetched_at = ? WHERE key = ?',
+                (now, now, _key(url)))
+        else:
+            _connect().execute(
+                'UPDATE pages SET accessed_at = ? WHERE key = ?', (now, _key(url)))
+        _index.commit()
+
+
+def _store(url, response):
+    global _total_bytes
+    key = _key(url)
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = gzip.compress(response.content)
+    with open(path, 'wb') as f:
+        f.write(data)
+    now = time.time()
+    with _lock:
+        index = _connect()
+        previous = index.execute('SELECT size FROM pages WHERE key = ?', (key,)).fetchone()
+        index.execute(
+            'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, url, response.headers.get('ETag'),
+             response.headers.get('Last-Modified'), now, now, len(data)))
+        _total_bytes += len(data) - (previous[0] if previous else 0)
+        if _total_bytes > MAX_BYTES:
+            _evict(index)
+        index.commit()
+
+
+def _evict(index):
+    """
+    Removes the least recently used pages until the cache is back under 90%
+    of its size limit. Must be called with the lock held.
+    """
+    global _total_bytes
+    target = 0.9 * MAX_BYTES
+    evicted = 0
+    for key, size in index.execute('SELECT key, size FROM pages ORDER BY accessed_at').fetchall():
+        if _total_bytes <= target:
+            break
+        try:
+            os.remove(_path(key))
+        except OSError:
+            pass
+        index.execute('DELETE FROM pages WHERE key = ?', (key,))
+        _total_bytes -= size
+        evicted += 1
+    logging.info(f'Evicted {evicted} pages from the page cache.')
+
+
+def fetch_page(url, ttl=DEFAULT_TTL):
+    """
+    Returns the HTML of a page, serving it from the local cache when possible.
+
+    Pages younger than `ttl` are served without touching the network. Older
+    pages are revalidated with a conditional GET, so an unchanged page costs
+    a 304 response instead of a full download.
+
+    Args:
+        url (str): The URL of the page.
+        ttl (float, optional): Seconds a cached page is served without
+        revalidation. Use 0 to always revalidate.
+
+    Returns:
+        bytes: The raw HTML of the page.
+
+    Raises:
+        requests.RequestException: If the page cannot be fetched, or is not
+        cached while running offline.
+    """
+    return _fetch(url, ttl)[0]
+
+
+def fetch_changed_page(url, ttl=DEFAULT_TTL):
+    """
+    Returns the HTML of a page only if it changed since it was cached, for
+    revisits that have nothing to do with an unchanged page.
+
+    A page younger than `ttl`, answered with a 304, or downloaded again
+    byte for byte identical counts as unchanged. A page that was never
+    cached counts as changed.
+
+    Args:
+        url (str): The URL of the page.
+        ttl (float, optional): Seconds a cached page is not revalidated.
+
+    Returns:
+        bytes or None: The raw HTML of the page, or None if it is unchanged.
+
+    Raises:
+        requests.RequestException: If the page cannot be fetched, or is not
+        cached while running offline.
+    """
+    content, changed = _fetch(url, ttl)
+    return content if changed else None
+
+
+def _fetch(url, ttl):
+    entry = _lookup(url)
+    if entry and (OFFLINE or time.time() - entry['fetched_at'] < ttl):
+        _touch(url)
+        return entry['content'], False
+    if OFFLINE:
+        raise PageNotCached(f'{url} is not in the page cache')
+
+    headers = {}
+    if entry and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    response = fetch(url, headers=headers)
+    if response.status_code == 304 and entry:
+        _touch(url, revalidated=True)
+        return entry['content'], False
+    response.raise_for_status()
+    _store(url, response)
+    return response.content, not entry or response.content != entry['content']
+
+
+def iter_cached_pages():
+    """
+    Yields every page held in the cache.
+
+    Yields:
+        tuple: The URL and raw HTML of each page.
+    """
+    with _lock:
+        urls = [url for url, in _connect().execute('SELECT url FROM pages ORDER BY url')]
+    for url in urls:
+        entry = _lookup(url)
+        if entry is not None:
+            yield url, entry['content']
@@ -0,0 +1,255 @@
+import os
+import time
+import queue
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from scraper import prepare_url, crawl_jobs, get_links, parse_details
+from page_cache import fetch_page
+from data_cleaning import clean_property_data
+from database import BatchSink, transaction, url_key, get_high_water_mark, update_high_water_mark
+from throttle import MAX_IN_FLIGHT
+from metrics import registry
+
+# Bounds on each hand-off queue. A full queue blocks the stage feeding it,
+# which is how a slow stage pushes back on the ones before it.
+QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 100))
+PARSE_WORKERS = int(os.environ.get('PIPELINE_PARSE_WORKERS', os.cpu_count() or 1))
+BATCH_SIZE = int(os.environ.get('PIPELINE_BATCH_SIZE', 200))
+# Parser processes are started by a fork server, or spawned, rather than
+# forked from this process: by the first parse its fetch threads are running
+# and may hold locks a forked child would inherit held
+PARSE_START_METHOD = ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                      else 'spawn')
+
+_STOP = object()
+
+
+def _parse_timed(content, link, publication_date):
+    """
+    Parses a property page in a parser process, also returning the wall and
+    CPU seconds it took, as time spent waiting on the future includes time
+    queued.
+    """
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    prop = parse_details(content, link, publication_date)
+    return prop, time.perf_counter() - start, time.thread_time() - cpu
+
+
+class PipelineMetrics:
+    """
+    Thread-safe counters for each stage and queue of the pipeline.
+
+    For every stage it records the items processed, the time spent working
+    and the time spent blocked on a full downstream queue (backpressure).
+    For every queue it records the mean and maximum depth seen on each put.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.queues = {}
+
+    def _stage(self, name):
+        return self.stages.setdefault(
+            name, {'items': 0, 'busy_seconds': 0.0, 'blocked_seconds': 0.0})
+
+    def record_work(self, stage, seconds):
+        with self._lock:
+            entry = self._stage(stage)
+            entry['items'] += 1
+            entry['busy_seconds'] += seconds
+
+    def put(self, stage, q, name, item):
+        start = time.perf_counter()
+        q.put(item)
+        blocked = time.perf_counter() - start
+        depth = q.qsize()
+        with self._lock:
+            self._stage(stage)['blocked_seconds'] += blocked
+            entry = self.queues.setdefault(name, {'puts': 0, 'depth_total': 0, 'max_depth': 0})
+            entry['puts'] += 1
+            entry['depth_total'] += depth
+            entry['max_depth'] = max(entry['max_depth'], depth)
+
+    def summary(self):
+        with self._lock:
+            queues = {
+                name: {'mean_depth': entry['depth_total'] / entry['puts'],
+                       'max_depth': entry['max_depth']}
+                for name, entry in self.queues.items() if entry['puts']
+            }
+            return {'stages': {k: dict(v) for k, v in self.stages.items()}, 'queues': queues}
+
+    def log(self):
+        summary = self.summary()
+        for name, entry in summary['stages'].items():
+            logging.info(
+                f"Stage {name}: {entry['items']} items, {entry['busy_seconds']:.1f}s busy, "
+                f"{entry['blocked_seconds']:.1f}s blocked on backpressure.")
+        for name, entry in summary['queues'].items():
+            logging.info(
+                f"Queue {name}: mean depth {entry['mean_depth']:.1f}, max {entry['max_depth']}.")
+
+
+def run_pipeline(cities, known_urls=None, markets=('rent',), max_pages=2,
+                 incremental=False, fetch_workers=MAX_IN_FLIGHT,
+                 parse_workers=PARSE_WORKERS, batch_size=BATCH_SIZE, scorer=None,
+                 indexer=None):
+    """
+    Scrapes the given cities through a staged pipeline:
+
+        links -> fetch (threads) -> parse (processes) -> clean -> insert
+
+    Each stage runs concurrently and hands work to the next through a
+    bounded queue, so network, CPU and database work overlap. The insert 
+    stage commits each batch in its own pooled transaction.
+
+    Several markets are crawled through the same stages, sharing the 
+    request budget, the dedup set and the database pool. Each record is 
+    routed to the table of its market.
+
+    Args:
+        cities (list): City slugs to scrape.
+        known_urls (set, optional): `database.url_key` of the URLs already
+        in the database. New links are added to it as they are queued.
+        markets (list, optional): Markets to crawl, 'rent' and/or 'sale'.
+        max_pages (int, optional): Listing pages to walk per city.
+        incremental (bool, optional): Stop walking a city at the first page 
+        of already seen listings.
+        fetch_workers (int, optional): Number of concurrent fetch threads.
+        parse_workers (int, optional): Number of parser processes.
+        batch_size (int, optional): Rows per database insert.
+        scorer (callable, optional): Scores each insert batch, see 
+        `database.BatchSink`.
+        indexer (callable, optional): Indexes the rows each batch inserted,
+        see `database.BatchSink`.
+
+    Returns:
+        dict: Stage and queue metrics for the run.
+    """
+    metrics = PipelineMetrics()
+    known_urls = known_urls if known_urls is not None else set()
+    fetch_q = queue.Queue(QUEUE_SIZE)
+    parse_q = queue.Queue(QUEUE_SIZE)
+    # Holds pending parse futures, so its bound also caps parses in flight
+    parsed_q = queue.Queue(max(parse_workers * 2, 1))
+    insert_q = queue.Queue(QUEUE_SIZE)
+    jobs = crawl_jobs(cities, markets)
+    watermarks = {}
+    if incremental:
+        with transaction() as cursor:
+            watermarks = {
+                (market, city): get_high_water_mark(cursor, city, market)
+                for market, city in jobs
+            }
+    job_links = {}
+    # Links handed to the insert stage, the only ones the watermarks may pass
+    written = set()
+
+    def produce_links():
+        for market, city in jobs:
+            try:
+                start = time.perf_counter()
+                with registry.labels(market=market, city=city):
+                    links = get_links(prepare_url(city, market), max_pages=max_pages,
+                                      known_urls=known_urls, incremental=incremental,
+                                      since=watermarks.get((market, city)), market=market)
+                job_links[(market, city)] = links
+                metrics.record_work('links', time.perf_counter() - start)
+                for link, publication_date in links:
+                    known_urls.add(url_key(link))
+                    metrics.put('links', fetch_q, 'fetch', (link, publication_date, market))
+            except Exception as e:
+                logging.error(f'Error collecting {market} links for {city}: {e}')
+        for _ in range(fetch_workers):
+            fetch_q.put(_STOP)
+
+    def fetch_pages():
+        while True:
+            item = fetch_q.get()
+            if item is _STOP:
+                break
+            link, publication_date, market = item
+            start = time.perf_counter()
+            try:
+                with registry.timer('fetch_details', market=market):
+                    content = fetch_page(link)
+            except Exception as e:
+                logging.error(f'Error fetching property data from {link}: {e}')
+                registry.inc('detail_errors', market=market)
+                continue
+            metrics.record_work('fetch', time.perf_counter() - start)
+            metrics.put('fetch', parse_q, 'parse', (content, link, publication_date, market))
+
+    def dispatch_parses(pool):
+        while True:
+            item = parse_q.get()
+            if item is _STOP:
+                parsed_q.put(_STOP)
+                break
+            content, link, publication_date, market = item
+            future = pool.submit(_parse_timed, content, link, publication_date)
+            metrics.put('parse', parsed_q, 'parsed', (future, link, market))
+
+    def clean_records():
+        while True:
+            item = parsed_q.get()
+            if item is _STOP:
+                insert_q.put(_STOP)
+                break
+            future, link, market = item
+            try:
+                prop, seconds, cpu_seconds = future.result()
+                metrics.record_work('parse', seconds)
+                # The registry of the parser process is never collected
+                registry.observe('parse_details', seconds, market=market)
+                registry.inc('parse_details_cpu_seconds', cpu_seconds, market=market)
+                start = time.perf_counter()
+                prop = clean_property_data(prop)
+                metrics.record_work('clean', time.perf_counter() - start)
+            except Exception as e:
+                logging.error(f'Error parsing property data from {link}: {e}')
+                continue
+            metrics.put('clean', insert_q, 'insert', (prop, market))
+
+    def insert_batches():
+        with BatchSink(batch_size=batch_size, scorer=scorer, indexer=indexer) as sink:
+            while True:
+                item = insert_q.get()
+                if item is _STOP:
+                    break
+                start = time.perf_counter()
+                sink.write(*item)
+                written.add(item[0]['url'])
+                metrics.record_work('insert', time.perf_counter() - start)
+
+    with ProcessPoolExecutor(max_workers=parse_workers,
+                             mp_context=multiprocessing.get_context(PARSE_START_METHOD)) as pool:
+        producer = threading.Thread(target=produce_links, name='links')
+        fetchers = [threading.Thread(target=fetch_pages, name=f'fetch-{i}')
+                    for i in range(fetch_workers)]
+        downstream = [
+            threading.Thread(target=dispatch_parses, args=(pool,), name='parse'),
+            threading.Thread(target=clean_records, name='clean'),
+            threading.Thread(target=insert_batches, name='insert'),
+        ]
+        for thread in [producer] + fetchers + downstream:
+            thread.start()
+        producer.join()
+        for thread in fetchers:
+            thread.join()
+        parse_q.put(_STOP)
+        for thread in downstream:
+            thread.join()
+
+    with transaction() as cursor:
+        for (market, city), links in job_links.items():
+            # A listing that failed to fetch or parse is retried next run
+            update_high_water_mark(
+                cursor, city, [link for link in links if link[0] in written], market)
+
+    metrics.log()
+    return metrics.summary()
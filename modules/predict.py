@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import queue
+import pickle
+import logging
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from train import model_path, encode_records, predict_log_price, _number
+from database import MARKETS
+
+# Requests arriving within MAX_WAIT_MS of each other are scored together, in
+# batches of at most MAX_BATCH listings.
+MAX_BATCH = int(os.environ.get('PREDICT_MAX_BATCH', 1024))
+MAX_WAIT_MS = float(os.environ.get('PREDICT_MAX_WAIT_MS', 2))
+# Small batches are scored on one thread, as spinning up more costs more
+# than it saves
+PREDICT_THREADS = int(os.environ.get('PREDICT_THREADS', os.cpu_count() or 1))
+PARALLEL_BATCH = 256
+
+_predictors = {}
+_predictors_lock = threading.Lock()
+
+
+class Predictor:
+    """
+    Scores listings with a trained price model, keeping the model and its
+    vocabulary in memory between calls.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        path (str, optional): Model file, the market's latest by default.
+    """
+
+    def __init__(self, market='rent', path=None):
+        self.market = market
+        self.path = path or model_path(market)
+        self.loaded_at = os.path.getmtime(self.path)
+        with open(self.path, 'rb') as f:
+            bundle = pickle.load(f)
+        self.model = bundle['model']
+        self.backend = bundle['backend']
+        self.vocabulary = bundle['vocabulary']
+        self.report = bundle.get('report')
+        self._index = {token: i for i, token in enumerate(self.vocabulary)}
+        logging.info(f'Loaded {self.backend} {market} model from {self.path}.')
+
+    def is_stale(self):
+        """Returns True when the model file was replaced since it was loaded."""
+        try:
+            return os.path.getmtime(self.path) != self.loaded_at
+        except OSError:
+            return False
+
+    def predict(self, properties):
+        """
+        Predicts the price of several listings in one vectorized call.
+
+        Args:
+            properties (list): Dictionaries shaped like those produced by
+            `scraper.parse_details`. Missing fields are treated as unknown.
+
+        Returns:
+            np.ndarray: The predicted price of each listing.
+        """
+        if not properties:
+            return np.empty(0)
+        matrix = encode_records(properties, self._index)
+        threads = PREDICT_THREADS if len(properties) >= PARALLEL_BATCH else 1
+        return np.expm1(predict_log_price(self.model, matrix, num_threads=threads))
+
+
+def get_predictor(market='rent'):
+    """
+    Returns the shared predictor of a market, loading its model on first use
+    and reloading it once a retrained model has replaced the file.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+
+    Returns:
+        Predictor: The warm predictor.
+    """
+    with _predictors_lock:
+        predictor = _predictors.get(market)
+        if predictor is None or predictor.is_stale():
+            predictor = _predictors[market] = Predictor(market)
+        return predictor
+
+
+def predict_prices(properties, market='rent'):
+    """
+    Predicts the price of listings in process.
+
+    Args:
+        properties (dict or list): One listing or a list of them, shaped like
+        those produced by `scraper.parse_details`.
+        market (str, optional): Either 'rent' or 'sale'.
+
+    Returns:
+        float or list: The predicted price of each listing.
+    """
+    if isinstance(properties, dict):
+        return float(get_predictor(market).predict([properties])[0])
+    return get_predictor(market).predict(properties).tolist()
+
+
+def score_properties(properties, market='rent'):
+    """
+    Scores a batch of listings in place before they are inserted, setting
+    their `predicted_price` and their `price_residual`, the log of the asking
+    price over the predicted one. The whole batch is scored in one predict
+    call.
+
+    Args:
+        properties (list): Listings shaped like `scraper.parse_details`.
+        market (str, optional): Either 'rent' or 'sale'.
+    """
+    predicted = get_predictor(market).predict(properties)
+    prices = np.array([_number(prop.get('price')) for prop in properties])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        residuals = np.log(prices / predicted)
+    for prop, price, residual in zip(properties, predicted.tolist(), residuals.tolist()):
+        prop['predicted_price'] = round(price)
+        # Listings without a usable asking price keep a NULL residual
+        prop['price_residual'] = residual if np.isfinite(residual) else None
+
+
+class MicroBatcher:
+    """
+    Collects listings submitted from many threads and scores them together,
+    so concurrent callers share one vectorized predict call instead of
+    paying for one each.
+
+    A batch is scored as soon as it is full or `max_wait_ms` after its first
+    listing arrived, whichever comes first.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        max_batch (int, optional): Maximum listings per predict call.
+        max_wait_ms (float, optional): Longest a listing waits for others.
+    """
+
+    def __init__(self, market='rent', max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.market = market
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.scored = 0
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, properties):
+        """
+        Queues listings for scoring.
+
+        Args:
+            properties (list): Listings shaped like `scraper.parse_details`.
+
+        Returns:
+            concurrent.futures.Future: Resolves to their predicted prices.
+        """
+        future = Future()
+        self._queue.put((properties, future))
+        return future
+
+    def predict(self, properties, timeout=None):
+        return self.submit(properties).result(timeout)
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            batch = [prop for properties, _ in pending for prop in properties]
+            try:
+                prices = get_predictor(self.market).predict(batch).tolist()
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.scored += len(batch)
+            start = 0
+            for properties, future in pending:
+                future.set_result(prices[start:start + len(properties)])
+                start += len(properties)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    Serves POST /predict, taking one listing or a list of them as JSON and
+    answering with their predicted prices, and GET /health.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would
+    # hold back until the client's delayed ACK
+    disable_nagle_algorithm = True
+    batcher = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        predictor = get_predictor(self.batcher.market)
+        self._send_json(200, {
+            'market': predictor.market, 'backend': predictor.backend,
+            'features': len(predictor.vocabulary), 'batches': self.batcher.batches,
+            'scored': self.batcher.scored,
+        })
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length))
+            single = isinstance(body, dict)
+            properties = [body] if single else body
+            if not isinstance(properties, list) or not all(isinstance(p, dict) for p in properties):
+                raise ValueError('expected a listing object or a list of them')
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            prices = self.batcher.predict(properties)
+        except Exception as e:
+            logging.error(f'Error predicting prices: {e}')
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'price': prices[0]} if single else {'prices': prices})
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Bursts of clients connecting at once would overflow the default backlog
+    request_queue_size = 128
+
+
+def create_server(host='127.0.0.1', port=8000, market='rent'):
+    """
+    Creates the prediction HTTP server, loading the model up front so the
+    first request is not slowed down by it.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server, not yet serving.
+    """
+    get_predictor(market)
+    handler = type('Handler', (PredictionHandler,), {'batcher': MicroBatcher(market)})
+    return PredictionServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve price predictions over HTTP.')
+    parser.add_argument('--market', choices=sorted(MARKETS), default='rent',
+                        help='market whose model to serve (default: rent)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    server = create_server(args.host, args.port, args.market)
+    logging.info(f'Serving {args.market} price predictions on http://{args.host}:{args.port}.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
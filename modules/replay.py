@@ -0,0 +1,224 @@
+import os
+import gzip
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from urllib.parse import urlsplit, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from page_cache import iter_cached_pages
+
+# Recorded pages are stored gzip-compressed, with a manifest mapping each
+# URL path to its file:
+# <REPLAY_FIXTURES_DIR>/manifest.json, <REPLAY_FIXTURES_DIR>/pages/<sha256>.html.gz
+FIXTURES_DIR = os.environ.get(
+    'REPLAY_FIXTURES_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'fixtures', 'replay')
+)
+MANIFEST = 'manifest.json'
+# Links in recorded pages point here, and are rewritten to the replay server
+ORIGIN = 'https://www.mubawab.ma'
+
+
+def save_fixtures(pages, directory=FIXTURES_DIR):
+    """
+    Writes pages to a fixtures directory, adding to the pages already there.
+
+    Args:
+        pages (iterable): Tuples of (URL, raw HTML).
+        directory (str, optional): The fixtures directory.
+
+    Returns:
+        int: The number of pages written.
+    """
+    os.makedirs(os.path.join(directory, 'pages'), exist_ok=True)
+    manifest = _read_manifest(directory)
+    written = 0
+    for url, content in pages:
+        path = unquote(urlsplit(url).path)
+        name = os.path.join('pages', hashlib.sha256(path.encode('utf-8')).hexdigest() + '.html.gz')
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(gzip.compress(content))
+        manifest[path] = name
+        written += 1
+    with open(os.path.join(directory, MANIFEST + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(os.path.join(directory, MANIFEST + '.tmp'), os.path.join(directory, MANIFEST))
+    return written
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_fixtures(directory=FIXTURES_DIR):
+    """
+    Loads every recorded page of a fixtures directory.
+
+    Args:
+        directory (str, optional): The fixtures directory.
+
+    Returns:
+        dict: The raw HTML of each page, by URL path.
+    """
+    pages = {}
+    for path, name in _read_manifest(directory).items():
+        with gzip.open(os.path.join(directory, name), 'rb') as f:
+            pages[path] = f.read()
+    return pages
+
+
+def record(directory=FIXTURES_DIR):
+    """
+    Records every page of the page cache as fixtures, so any run of the
+    scraper can be replayed later.
+
+    Returns:
+        int: The number of pages recorded.
+    """
+    recorded = save_fixtures(
+        ((url, content) for url, content in iter_cached_pages() if url.startswith(ORIGIN)),
+        directory)
+    logging.info(f'Recorded {recorded} pages to {directory}.')
+    return recorded
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Serves recorded pages by URL path, after an artificial delay, failing
+    a share of requests with a 503 to exercise the scraper's retries.
+    Unknown paths get a 404, and ETags let the scraper revalidate pages.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency + server.jitter * (2 * server.random.random() - 1)
+        if delay > 0:
+            time.sleep(delay)
+        with server.lock:
+            server.requests += 1
+            fail = server.random.random() < server.error_rate
+            if fail:
+                server.errors += 1
+        if fail:
+            self._send(503, b'Service Unavailable')
+            return
+        entry = server.pages.get(unquote(self.path))
+        if entry is None:
+            self._send(404, b'Not Found')
+            return
+        content, etag = entry
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, b'', etag)
+            return
+        self._send(200, content, etag)
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if body and status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Local stand-in for mubawab.ma serving recorded pages.
+
+    Args:
+        address (tuple): Host and port to listen on, port 0 picks a free one.
+        pages (dict): The raw HTML of each page, by URL path.
+        latency_ms (float, optional): Mean delay before each response.
+        jitter_ms (float, optional): Maximum deviation from the mean delay.
+        error_rate (float, optional): Share of requests answered with a 503.
+        seed (int, optional): Seed of the delays and failures.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, pages, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=0):
+        super().__init__(address, ReplayHandler)
+        self.latency = latency_ms / 1000
+        self.jitter = min(jitter_ms, latency_ms) / 1000
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = self.errors = 0
+        # Links between recorded pages lead back to this server
+        origin = ORIGIN.encode('utf-8')
+        base = self.base_url.encode('utf-8')
+        self.pages = {}
+        for path, content in pages.items():
+            content = content.replace(origin, base)
+            self.pages[path] = (content, '"' + hashlib.md5(content).hexdigest() + '"')
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def create_server(directory=FIXTURES_DIR, host='127.0.0.1', port=0, **kwargs):
+    """
+    Creates a replay server over a fixtures directory. Run the scraper
+    against it by setting MUBAWAB_BASE_URL to its `base_url`.
+
+    Args:
+        directory (str, optional): The fixtures directory.
+        host (str, optional): Interface to listen on.
+        port (int, optional): Port to listen on, a free one by default.
+        **kwargs: Latency and error knobs passed to `ReplayServer`.
+
+    Returns:
+        ReplayServer: The server, not yet serving.
+    """
+    return ReplayServer((host, port), load_fixtures(directory), **kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded mubawab.ma pages locally.')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='fixtures directory')
+    parser.add_argument('--record', action='store_true',
+                        help='record the pages of the page cache as fixtures, then exit')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='mean delay before each response (default: 0)')
+    parser.add_argument('--jitter-ms', type=float, default=0,
+                        help='maximum deviation from the mean delay (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of requests failed with a 503 (default: 0)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    if args.record:
+        record(args.fixtures)
+    else:
+        server = create_server(args.fixtures, args.host, args.port, latency_ms=args.latency_ms,
+                               jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                               seed=args.seed)
+        logging.info(f'Replaying {len(server.pages)} pages on {server.base_url}, '
+                     f'run the scraper with MUBAWAB_BASE_URL={server.base_url}.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,213 @@
+import os
+import logging
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from database import (
+    transaction, close_pool, market_table, prepare_property_record, content_hash,
+    PROPERTY_COLUMNS, HASHED_COLUMNS, MARKETS,
+)
+from page_cache import fetch_page, fetch_changed_page
+from scraper import parse_details
+from throttle import MAX_IN_FLIGHT
+from metrics import registry
+
+# A listing page is checked again once its cached copy is this old, so a
+# revisit run only spends requests on the listings that are due
+REVISIT_HOURS = float(os.environ.get('REVISIT_HOURS', 24))
+# Listings scraped longer ago are assumed to be off the market
+REVISIT_MAX_AGE_DAYS = float(os.environ.get('REVISIT_MAX_AGE_DAYS', 90))
+REVISIT_BATCH_SIZE = int(os.environ.get('REVISIT_BATCH_SIZE', 500))
+
+_PRICE = PROPERTY_COLUMNS.index('price')
+_HASHED_POSITIONS = [PROPERTY_COLUMNS.index(column) for column in HASHED_COLUMNS]
+_INTEGER_COLUMNS = {'size', 'rooms', 'bedrooms', 'bathrooms', 'price'}
+
+
+def check_listing(url, ttl, parse_cached=False):
+    """
+    Fetches a listing page again and hashes its content, unless the page
+    is unchanged since it was cached.
+
+    Args:
+        url (str): The URL of the listing.
+        ttl (float): Seconds a cached page is not revalidated.
+        parse_cached (bool, optional): Hash an unchanged page too, for
+        listings stored without a content hash.
+
+    Returns:
+        tuple or None: The cleaned record, ordered as `PROPERTY_COLUMNS`,
+        and its content hash, or None if the page is unchanged.
+    """
+    with registry.timer('fetch_details'):
+        content = fetch_page(url, ttl) if parse_cached else fetch_changed_page(url, ttl)
+    if content is None:
+        return None
+    with registry.timer('parse_details'):
+        record = prepare_property_record(parse_details(content, url, None))
+    return record, content_hash(record)
+
+
+def record_changes(cursor, market, changes):
+    """
+    Updates the listings that changed, recomputing their price residual,
+    and adds a history row for each.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str): Either 'rent' or 'sale'.
+        changes (list): Tuples of (id, previous price, record, content
+        hash), the record ordered as `PROPERTY_COLUMNS`.
+    """
+    columns = HASHED_COLUMNS + ['content_hash']
+    # VALUES lists carry no column types, so each value is cast to the type
+    # of the column it updates
+    template = '(%s::bigint, ' + ', '.join(
+        '%s::integer' if column in _INTEGER_COLUMNS else '%s::text'
+        for column in HASHED_COLUMNS) + ', %s::bytea)'
+    execute_values(cursor, sql.SQL('''
+        UPDATE {table} p SET {assignments},
+            price_residual = CASE WHEN p.predicted_price > 0 AND v.price > 0
+                THEN ln(v.price::float / p.predicted_price) END
+        FROM (VALUES %s) AS v (id, {columns})
+        WHERE p.id = v.id
+    ''').format(
+        table=sql.Identifier(market_table(market)),
+        assignments=sql.SQL(', ').join(
+            sql.SQL('{0} = v.{0}').format(sql.Identifier(column)) for column in columns),
+        columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+    ), [(id_,) + tuple(record[position] for position in _HASHED_POSITIONS) + (digest,)
+        for id_, _, record, digest in changes], template=template)
+    execute_values(cursor, '''
+        INSERT INTO listing_history (market, id, price, previous_price, content_hash)
+        VALUES %s ON CONFLICT DO NOTHING
+    ''', [(market, id_, record[_PRICE], previous_price, digest)
+          for id_, previous_price, record, digest in changes])
+
+
+def set_baselines(cursor, market, baselines):
+    """
+    Stores the content hash of listings inserted without one, e.g. before
+    content hashes were added, without recording a change.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str): Either 'rent' or 'sale'.
+        baselines (list): Tuples of (id, content hash).
+    """
+    execute_values(cursor, sql.SQL('''
+        UPDATE {} p SET content_hash = v.content_hash
+        FROM (VALUES %s) AS v (id, content_hash) WHERE p.id = v.id
+    ''').format(sql.Identifier(market_table(market))), baselines)
+
+
+def revisit_market(market='rent', hours=REVISIT_HOURS, max_age_days=REVISIT_MAX_AGE_DAYS,
+                   batch_size=REVISIT_BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Checks the known listings of a market for price drops and edits.
+
+    Listing pages are revalidated with conditional GETs through the page
+    cache, so an unchanged page costs a 304 and nothing else. A page that
+    did change is parsed and hashed, and only a hash differing from the
+    stored one is written, as an update of the listing and a row of
+    `listing_history`.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        hours (float, optional): Hours before a listing is checked again.
+        max_age_days (float, optional): Only check listings scraped within
+        this many days.
+        batch_size (int, optional): Listings checked per database round.
+        max_in_flight (int, optional): Maximum number of concurrent requests.
+
+    Returns:
+        dict: Listings checked, not modified (304 or not yet due),
+        unchanged, changed, given a baseline hash, and failed.
+    """
+    summary = {'checked': 0, 'not_modified': 0, 'unchanged': 0, 'changed': 0,
+               'baselines': 0, 'errors': 0}
+    since = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    ttl = hours * 3600
+    last_id = 0
+    check = registry.bind(check_listing)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while True:
+            with transaction() as cursor:
+                cursor.execute(sql.SQL('''
+                    SELECT id, url, price, content_hash FROM {}
+                    WHERE id > %s AND scraped_at >= %s ORDER BY id LIMIT %s
+                ''').format(sql.Identifier(market_table(market))), (last_id, since, batch_size))
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            futures = [executor.submit(check, url, ttl, stored is None)
+                       for _, url, _, stored in rows]
+
+            changes, baselines = [], []
+            for (id_, url, price, stored), future in zip(rows, futures):
+                summary['checked'] += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Mostly listings taken down since they were scraped
+                    logging.debug(f'Error revisiting {url}: {e}')
+                    summary['errors'] += 1
+                    continue
+                if result is None:
+                    summary['not_modified'] += 1
+                    continue
+                record, digest = result
+                if stored is not None and bytes(stored) == digest:
+                    summary['unchanged'] += 1
+                elif stored is None and record[_PRICE] == price:
+                    baselines.append((id_, digest))
+                    summary['baselines'] += 1
+                else:
+                    changes.append((id_, price, record, digest))
+                    summary['changed'] += 1
+            if changes or baselines:
+                with transaction() as cursor:
+                    if changes:
+                        record_changes(cursor, market, changes)
+                    if baselines:
+                        set_baselines(cursor, market, baselines)
+
+    for outcome, count in summary.items():
+        if outcome != 'checked' and count:
+            registry.inc('listings_revisited', count, market=market, outcome=outcome)
+    logging.info(
+        f"Revisited {summary['checked']} {market} listings: {summary['changed']} changed, "
+        f"{summary['unchanged']} unchanged, {summary['not_modified']} not modified, "
+        f"{summary['baselines']} baselined, {summary['errors']} failed.")
+    return summary
+
+
+def revisit_listings(markets=('rent',), **kwargs):
+    """
+    Checks the known listings of each market, see `revisit_market`.
+
+    Returns:
+        dict: The summary of each market.
+    """
+    return {market: revisit_market(market, **kwargs) for market in markets}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check known listings for price drops and edits.')
+    parser.add_argument('--market', dest='markets', action='append', choices=sorted(MARKETS),
+                        help='market to revisit, may be repeated (default: all)')
+    parser.add_argument('--hours', type=float, default=REVISIT_HOURS,
+                        help=f'hours before a listing is checked again (default: {REVISIT_HOURS:g})')
+    parser.add_argument('--max-age-days', type=float, default=REVISIT_MAX_AGE_DAYS,
+                        help='only check listings scraped within this many days '
+                             f'(default: {REVISIT_MAX_AGE_DAYS:g})')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    try:
+        revisit_listings(args.markets or sorted(MARKETS), hours=args.hours,
+                         max_age_days=args.max_age_days)
+    finally:
+        close_pool()
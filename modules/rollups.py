@@ -0,0 +1,424 @@
+import os
+import math
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from database import transaction, close_pool, market_table, MARKETS
+
+# Dimensions listings are rolled up by. Each grouping keeps its own rows,
+# so readers of the coarse ones never merge many sketches; dimensions a
+# grouping leaves out are stored as ''.
+DIMENSIONS = ('city', 'area', 'property_type')
+GROUPINGS = {
+    'city': ('city',),
+    'city_type': ('city', 'property_type'),
+    'city_area_type': ('city', 'area', 'property_type'),
+}
+# Size of the t-digests: quantile errors are around 1/COMPRESSION in the
+# middle of the distribution and much lower in the tails
+COMPRESSION = 100
+ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', 50000))
+# Listings younger than this are left for the next update, as ids are handed
+# out before the transactions inserting them commit
+SETTLE_SECONDS = int(os.environ.get('ROLLUP_SETTLE_SECONDS', 300))
+# Listings the market median counts as in target encodings
+ENCODING_PRIOR = 20
+QUANTILES = {'p05': 0.05, 'p25': 0.25, 'median': 0.5, 'p75': 0.75, 'p95': 0.95}
+KEY_COLUMNS = ['level', *DIMENSIONS, 'month']
+ROLLUP_COLUMNS = ['listings', 'priced', 'price_sum', 'sized', 'size_sum', 'price_per_m2_sum',
+                  'price_digest', 'price_per_m2_digest']
+
+
+class TDigest:
+    """
+    Mergeable quantile sketch (Dunning's merging t-digest). Values are
+    summarised by weighted centroids, kept small near the tails, so a few
+    hundred bytes give accurate quantiles over any number of values, and
+    two digests merge into the digest of their union.
+
+    Values and merged digests are buffered, then compressed together with
+    numpy: sorted centroids are grouped by the unit step of the k1 scale
+    function their cumulative weight falls in.
+
+    Args:
+        compression (float, optional): Bounds the number of centroids.
+    """
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+        self._values = []
+        self._digests = []
+
+    @property
+    def count(self):
+        self._compress()
+        return float(self.weights.sum())
+
+    def add(self, value):
+        self._values.append(value)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._values) >= 10 * self.compression:
+            self._compress()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Adds the values summarised by another digest."""
+        other._compress()
+        if len(other.weights):
+            self._digests.append((other.means, other.weights))
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        return self
+
+    def _compress(self):
+        if not self._values and not self._digests:
+            return
+        means = np.concatenate([self.means, *(m for m, _ in self._digests), self._values])
+        weights = np.concatenate([self.weights, *(w for _, w in self._digests),
+                                  np.ones(len(self._values))])
+        self._values, self._digests = [], []
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        below = (np.cumsum(weights) - weights) / weights.sum()
+        # k1 scale function: each centroid spans at most one unit of k, so
+        # centroids near the tails hold few values
+        k = self.compression / (2 * math.pi) * np.arcsin(2 * below - 1)
+        _, starts = np.unique(np.floor(k - k[0]), return_index=True)
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q):
+        """
+        Estimates a quantile, interpolating between the centres of the
+        centroids either side of its rank, and the extremes at the ends.
+
+        Returns:
+            float or None: The estimate, or None for an empty digest.
+        """
+        self._compress()
+        if not len(self.weights):
+            return None
+        centres = np.cumsum(self.weights) - self.weights / 2
+        total = self.weights.sum()
+        return float(np.interp(q * total, np.concatenate(([0.0], centres, [total])),
+                               np.concatenate(([self.min], self.means, [self.max]))))
+
+    def to_bytes(self):
+        self._compress()
+        return np.concatenate(([self.min, self.max],
+                               np.column_stack((self.means, self.weights)).ravel())).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, compression=COMPRESSION):
+        digest = cls(compression)
+        if data:
+            values = np.frombuffer(bytes(data), dtype=np.float64)
+            digest.min, digest.max = float(values[0]), float(values[1])
+            digest.means, digest.weights = values[2::2].copy(), values[3::2].copy()
+        return digest
+
+
+class Rollup:
+    """
+    Aggregates of the listings of one group: counts, sums, and t-digests of
+    the price and of the price per m².
+    """
+
+    def __init__(self, listings=0, priced=0, price_sum=0.0, sized=0, size_sum=0.0,
+                 price_per_m2_sum=0.0, price_digest=None, price_per_m2_digest=None):
+        self.listings = listings
+        self.priced = priced
+        self.price_sum = price_sum
+        self.sized = sized
+        self.size_sum = size_sum
+        self.price_per_m2_sum = price_per_m2_sum
+        self.price = TDigest.from_bytes(price_digest)
+        self.price_per_m2 = TDigest.from_bytes(price_per_m2_digest)
+
+    def add(self, price, size):
+        self.listings += 1
+        if not price or price <= 0:
+            return
+        self.priced += 1
+        self.price_sum += price
+        self.price.add(float(price))
+        if size and size > 0:
+            self.sized += 1
+            self.size_sum += size
+            self.price_per_m2_sum += price / size
+            self.price_per_m2.add(price / size)
+
+    def merge(self, other):
+        self.listings += other.listings
+        self.priced += other.priced
+        self.price_sum += other.price_sum
+        self.sized += other.sized
+        self.size_sum += other.size_sum
+        self.price_per_m2_sum += other.price_per_m2_sum
+        self.price.merge(other.price)
+        self.price_per_m2.merge(other.price_per_m2)
+        return self
+
+    def values(self):
+        """Returns the stored columns, in the order of `ROLLUP_COLUMNS`."""
+        return (self.listings, self.priced, self.price_sum, self.sized, self.size_sum,
+                self.price_per_m2_sum, self.price.to_bytes(), self.price_per_m2.to_bytes())
+
+    def summary(self):
+        summary = {
+            'listings': self.listings,
+            'priced': self.priced,
+            'mean_price': self.price_sum / self.priced if self.priced else None,
+        }
+        summary.update({f'{name}_price': self.price.quantile(q) for name, q in QUANTILES.items()})
+        summary.update({
+            'sized': self.sized,
+            'mean_size': self.size_sum / self.sized if self.sized else None,
+            'mean_price_per_m2': self.price_per_m2_sum / self.sized if self.sized else None,
+            'median_price_per_m2': self.price_per_m2.quantile(0.5),
+        })
+        return summary
+
+
+def rollup_rows(rows):
+    """
+    Aggregates listings into the rollups of every grouping.
+
+    Args:
+        rows (iterable): Tuples of (city, area, property type, month,
+        price, size).
+
+    Returns:
+        dict: Rollups keyed by `KEY_COLUMNS` values.
+    """
+    rollups = {}
+    for city, area, property_type, month, price, size in rows:
+        values = dict(zip(DIMENSIONS, ((value or '').strip()
+                                       for value in (city, area, property_type))))
+        for level, dimensions in GROUPINGS.items():
+            key = (level, *(values[d] if d in dimensions else '' for d in DIMENSIONS), month)
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = Rollup()
+            rollup.add(price, size)
+    return rollups
+
+
+def merge_rollups(cursor, market, rollups):
+    """
+    Merges new rollups into the stored ones, in the caller's transaction.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str): Either 'rent' or 'sale'.
+        rollups (dict): Rollups keyed by `KEY_COLUMNS` values.
+    """
+    keys = sql.SQL(', ').join(map(sql.Identifier, KEY_COLUMNS))
+    stored = execute_values(cursor, sql.SQL('''
+        SELECT {keys}, {columns} FROM market_rollups
+        JOIN (VALUES %s) AS k (market, {keys}) USING (market, {keys})
+    ''').format(keys=keys, columns=sql.SQL(', ').join(map(sql.Identifier, ROLLUP_COLUMNS))),
+        [(market, *key) for key in rollups], page_size=1000, fetch=True)
+    for row in stored:
+        key = tuple(row[:len(KEY_COLUMNS)])
+        rollups[key] = Rollup(*row[len(KEY_COLUMNS):]).merge(rollups[key])
+
+    columns = KEY_COLUMNS + ROLLUP_COLUMNS
+    execute_values(cursor, sql.SQL('''
+        INSERT INTO market_rollups (market, {columns}) VALUES %s
+        ON CONFLICT (market, {keys}) DO UPDATE SET {assignments}, updated_at = now()
+    ''').format(
+        columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+        keys=keys,
+        assignments=sql.SQL(', ').join(
+            sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(column))
+            for column in ROLLUP_COLUMNS),
+    ), [(market, *key, *rollup.values()) for key, rollup in rollups.items()], page_size=1000)
+
+
+def update_rollups(market='rent', batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Adds the listings inserted since the last update to the rollups. Each
+    batch is merged and the watermark moved past it in one transaction,
+    so an interrupted update resumes without counting a listing twice.
+
+    Listings younger than `SETTLE_SECONDS` are left for the next update.
+    Rollups reflect the price a listing was inserted with, later changes
+    found by `revisit` are not applied.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        batch_size (int, optional): Listings merged per transaction.
+
+    Returns:
+        int: The number of listings added.
+    """
+    added = 0
+    while True:
+        with transaction() as cursor:
+            cursor.execute(
+                'INSERT INTO rollup_watermarks (market) VALUES (%s) ON CONFLICT DO NOTHING',
+                (market,))
+            # Also serialises concurrent updates of the market
+            cursor.execute('SELECT last_id FROM rollup_watermarks WHERE market = %s FOR UPDATE',
+                           (market,))
+            last_id = cursor.fetchone()[0]
+            cursor.execute(sql.SQL('''
+                SELECT id, COALESCE(scraped_at < now() - %s * interval '1 second', TRUE),
+                    city, area, property_type,
+                    date_trunc('month', COALESCE(date_published, scraped_at, now()))::date,
+                    price, size
+                FROM {} WHERE id > %s ORDER BY id LIMIT %s
+            ''').format(sql.Identifier(market_table(market))),
+                (SETTLE_SECONDS, last_id, batch_size))
+            rows = cursor.fetchall()
+            settled = next((i for i, row in enumerate(rows) if not row[1]), len(rows))
+            rows = rows[:settled]
+            if not rows:
+                break
+            merge_rollups(cursor, market, rollup_rows(row[2:] for row in rows))
+            cursor.execute('UPDATE rollup_watermarks SET last_id = %s WHERE market = %s',
+                           (rows[-1][0], market))
+        added += len(rows)
+        if settled < batch_size:
+            break
+    if added:
+        logging.info(f'Added {added} {market} listings to the rollups.')
+    return added
+
+
+def rebuild_rollups(market='rent'):
+    """Drops the rollups of a market and aggregates every listing again."""
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM market_rollups WHERE market = %s', (market,))
+        cursor.execute('DELETE FROM rollup_watermarks WHERE market = %s', (market,))
+    return update_rollups(market)
+
+
+def _level(by):
+    """Returns the coarsest grouping holding every dimension of `by`."""
+    dimensions = set(by) - {'month'}
+    for level, grouped in sorted(GROUPINGS.items(), key=lambda item: len(item[1])):
+        if dimensions <= set(grouped):
+            return level
+    raise ValueError(f'Cannot roll up by {by!r}, expected dimensions among {DIMENSIONS + ("month",)}')
+
+
+def load_rollups(cursor, market='rent', by=('city',), since=None, cities=None):
+    """
+    Reads market aggregates, merging the stored rollups into the requested
+    groups, e.g. the price distribution of each city over all months, or
+    of each property type of a city per month.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str, optional): Either 'rent' or 'sale'.
+        by (tuple, optional): Columns to group by, among `DIMENSIONS` and
+        'month'.
+        since (datetime.date, optional): First month to include.
+        cities (list, optional): Cities to include, all by default.
+
+    Returns:
+        DataFrame: One row per group, with the listing count, mean, price
+        quantiles, mean size and price per m², by decreasing count.
+    """
+    market_table(market)
+    query = sql.SQL('SELECT {}, {} FROM market_rollups WHERE market = %s AND level = %s').format(
+        sql.SQL(', ').join(map(sql.Identifier, DIMENSIONS + ('month',))),
+        sql.SQL(', ').join(map(sql.Identifier, ROLLUP_COLUMNS)))
+    params = [market, _level(by)]
+    if since is not None:
+        query += sql.SQL(' AND month >= %s')
+        params.append(since)
+    if cities is not None:
+        query += sql.SQL(' AND city = ANY(%s)')
+        params.append(list(cities))
+    cursor.execute(query, params)
+
+    groups = {}
+    for row in cursor.fetchall():
+        values = dict(zip(DIMENSIONS + ('month',), row))
+        key = tuple(values[column] for column in by)
+        rollup = Rollup(*row[len(DIMENSIONS) + 1:])
+        if key in groups:
+            groups[key].merge(rollup)
+        else:
+            groups[key] = rollup
+    df = pd.DataFrame([{**dict(zip(by, key)), **rollup.summary()} for key, rollup in groups.items()],
+                      columns=list(by) + list(Rollup().summary()))
+    return df.sort_values('listings', ascending=False, ignore_index=True)
+
+
+def top_cities(cursor, market='rent', n=15, since=None):
+    """Returns the aggregates of the `n` cities with the most listings."""
+    return load_rollups(cursor, market, ('city',), since).head(n)
+
+
+def price_per_m2_encoding(cursor, market='rent', by=('city',), prior=ENCODING_PRIOR):
+    """
+    Encodes groups of listings by their median price per m², for use as
+    target-encoding features. Small groups are shrunk towards the median of
+    the whole market, weighing it as `prior` listings.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str, optional): Either 'rent' or 'sale'.
+        by (tuple, optional): Columns to group by, among `DIMENSIONS`.
+        prior (float, optional): Weight of the market median.
+
+    Returns:
+        dict: The encoding of each group, keyed by its values, with None
+        for the market median.
+    """
+    df = load_rollups(cursor, market, by)
+    df = df[df['median_price_per_m2'].notna()]
+    if df.empty:
+        return {}
+    market_digest = TDigest()
+    cursor.execute(
+        "SELECT price_per_m2_digest FROM market_rollups WHERE market = %s AND level = 'city'",
+        (market,))
+    for digest, in cursor.fetchall():
+        market_digest.merge(TDigest.from_bytes(digest))
+    median = market_digest.quantile(0.5)
+    encoding = {None: median}
+    for row in df.itertuples(index=False):
+        key = tuple(getattr(row, column) for column in by)
+        encoding[key[0] if len(by) == 1 else key] = (
+            (row.sized * row.median_price_per_m2 + prior * median) / (row.sized + prior))
+    return encoding
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the market rollups with new listings.')
+    parser.add_argument('--market', dest='markets', action='append', choices=sorted(MARKETS),
+                        help='market to update, may be repeated (default: all)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='drop the rollups and aggregate every listing again')
+    parser.add_argument('--show', type=int, metavar='N',
+                        help='then print the aggregates of the N cities with the most listings')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    try:
+        for market in args.markets or sorted(MARKETS):
+            if args.rebuild:
+                rebuild_rollups(market)
+            else:
+                update_rollups(market)
+            if args.show:
+                with transaction() as cursor:
+                    print(f'\n{market}:')
+                    print(top_cities(cursor, market, args.show).to_string(index=False))
+    finally:
+        close_pool()
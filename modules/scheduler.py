@@ -0,0 +1,232 @@
+import os
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from scraper import prepare_url, crawl_jobs, iter_listing_pages, iter_details
+from database import BatchSink, transaction, url_key, get_high_water_mark, update_high_water_mark
+from throttle import MAX_IN_FLIGHT
+from metrics import registry
+
+# Bounds on the listing pages walked per city. A city starts at the default
+# budget, which then follows how deep its new listings go.
+DEFAULT_PAGES = 2
+MIN_PAGES = 1
+MAX_PAGES = int(os.environ.get('CRAWL_MAX_PAGES', 50))
+# Cities are revisited once they are expected to have about this many new
+# listings, within the revisit bounds below
+TARGET_NEW_LISTINGS = float(os.environ.get('CRAWL_TARGET_NEW_LISTINGS', 30))
+MIN_REVISIT_HOURS = float(os.environ.get('CRAWL_MIN_REVISIT_HOURS', 2))
+MAX_REVISIT_HOURS = float(os.environ.get('CRAWL_MAX_REVISIT_HOURS', 7 * 24))
+# Weight of the latest walk in the smoothed new-listing rate
+SMOOTHING = 0.5
+# Cities walked at once. They share the global politeness budget, and the
+# in-flight limit is split between them.
+CITY_WORKERS = int(os.environ.get('CRAWL_CITY_WORKERS', 4))
+
+
+def next_page_budget(budget, new_per_page):
+    """
+    Derives the page budget of a city's next walk from what its last walk
+    found. Listings are sorted newest first, so new listings sit on the
+    first pages: the budget follows the last page that had any, plus one
+    to notice a busier period, and doubles when the walk ran out of pages
+    while still finding new listings.
+
+    Args:
+        budget (int): The budget of the last walk.
+        new_per_page (list): New listings found on each page walked.
+
+    Returns:
+        int: The budget of the next walk.
+    """
+    if not new_per_page:
+        # The walk failed before its first page, which says nothing new
+        return budget
+    if new_per_page[-1] and len(new_per_page) >= budget:
+        return min(budget * 2, MAX_PAGES)
+    last_new = max((page for page, new in enumerate(new_per_page, 1) if new), default=0)
+    return max(MIN_PAGES, min(last_new + 1, MAX_PAGES))
+
+
+def revisit_hours(new_per_hour):
+    """
+    Returns how long to wait before walking a city again, given the rate
+    at which it gets new listings.
+    """
+    if not new_per_hour:
+        return MAX_REVISIT_HOURS
+    return max(MIN_REVISIT_HOURS, min(TARGET_NEW_LISTINGS / new_per_hour, MAX_REVISIT_HOURS))
+
+
+def due_jobs(cursor, jobs, now=None, force=False):
+    """
+    Selects the city walks that are due, with their page budgets.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        jobs (list): Tuples of (market, city), see `scraper.crawl_jobs`.
+        now (datetime, optional): The current time.
+        force (bool, optional): Walk every city, due or not.
+
+    Returns:
+        list: Tuples of (market, city, page budget), the cities never
+        walked first, then by decreasing rate of new listings.
+    """
+    now = now or datetime.datetime.now()
+    cursor.execute(
+        'SELECT market, city, page_budget, new_per_hour, next_due_at FROM crawl_city_stats')
+    stats = {(market, city): rest for market, city, *rest in cursor.fetchall()}
+    due = []
+    for market, city in jobs:
+        budget, new_per_hour, next_due_at = stats.get((market, city), (DEFAULT_PAGES, None, None))
+        if force or next_due_at is None or next_due_at <= now:
+            rate = float('inf') if new_per_hour is None else new_per_hour
+            due.append((rate, market, city, budget))
+    due.sort(key=lambda job: -job[0])
+    return [(market, city, budget) for _, market, city, budget in due]
+
+
+def record_walk(cursor, market, city, budget, new_per_page, requests, now=None):
+    """
+    Updates a city's statistics after a walk, and schedules its next one.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor.
+        market (str): Either 'rent' or 'sale'.
+        city (str): The city slug.
+        budget (int): The page budget of the walk.
+        new_per_page (list): New listings found on each page walked.
+        requests (int): Listing and detail pages fetched by the walk.
+        now (datetime, optional): The current time.
+
+    Returns:
+        dict: The next page budget, new listings per hour and due time.
+    """
+    now = now or datetime.datetime.now()
+    new_listings = sum(new_per_page)
+    cursor.execute(
+        'SELECT new_per_hour, last_crawled_at FROM crawl_city_stats '
+        'WHERE market = %s AND city = %s FOR UPDATE',
+        (market, city))
+    row = cursor.fetchone()
+    new_per_hour = row[0] if row else None
+    if row and row[1] and now > row[1]:
+        observed = new_listings / ((now - row[1]).total_seconds() / 3600)
+        new_per_hour = observed if new_per_hour is None else (
+            SMOOTHING * observed + (1 - SMOOTHING) * new_per_hour)
+    # A first walk finds the backlog, not the rate, so it is revisited soon
+    hours = revisit_hours(new_per_hour) if new_per_hour is not None else MIN_REVISIT_HOURS
+    stats = {
+        'page_budget': next_page_budget(budget, new_per_page),
+        'new_per_hour': new_per_hour,
+        'next_due_at': now + datetime.timedelta(hours=hours),
+    }
+    cursor.execute('''
+        INSERT INTO crawl_city_stats (market, city, runs, requests, new_listings, page_budget,
+            new_per_hour, last_crawled_at, next_due_at)
+        VALUES (%s, %s, 1, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (market, city) DO UPDATE SET
+            runs = crawl_city_stats.runs + 1,
+            requests = crawl_city_stats.requests + EXCLUDED.requests,
+            new_listings = crawl_city_stats.new_listings + EXCLUDED.new_listings,
+            page_budget = EXCLUDED.page_budget,
+            new_per_hour = EXCLUDED.new_per_hour,
+            last_crawled_at = EXCLUDED.last_crawled_at,
+            next_due_at = EXCLUDED.next_due_at
+    ''', (market, city, requests, new_listings, stats['page_budget'], new_per_hour, now,
+          stats['next_due_at']))
+    return stats
+
+
+def crawl_city(market, city, budget, known_urls, incremental=False, scorer=None,
+               indexer=None, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Walks the listing pages of a city within its page budget, scrapes the
+    new listings, and records what the walk found.
+
+    Returns:
+        tuple: The new listings found and the requests spent.
+    """
+    with registry.labels(market=market, city=city):
+        since = None
+        if incremental:
+            with transaction() as cursor:
+                since = get_high_water_mark(cursor, city, market)
+        links = []
+        new_per_page = []
+        for _, page_links in iter_listing_pages(prepare_url(city, market), budget,
+                                                known_urls=known_urls, incremental=incremental,
+                                                since=since, market=market):
+            new_per_page.append(len(page_links))
+            links.extend(page_links)
+        if links:
+            with BatchSink(scorer=scorer, indexer=indexer) as sink:
+                for prop in iter_details(links, max_in_flight):
+                    sink.write(prop, market)
+                    known_urls.add(url_key(prop['url']))
+        requests = len(new_per_page) + len(links)
+        with transaction() as cursor:
+            update_high_water_mark(cursor, city, links, market)
+            stats = record_walk(cursor, market, city, budget, new_per_page, requests)
+        logging.info(
+            f'Walked {len(new_per_page)}/{budget} {market} pages of {city}: {len(links)} new '
+            f'listings, next budget {stats["page_budget"]} pages, due {stats["next_due_at"]:%Y-%m-%d %H:%M}.')
+        return len(links), requests
+
+
+def run_schedule(cities, markets=('rent',), known_urls=None, incremental=False, scorer=None,
+                 indexer=None, city_workers=CITY_WORKERS, force=False):
+    """
+    Walks every due city concurrently, each within its adaptive page
+    budget. Every request still goes through the shared politeness budget,
+    so concurrency only fills the time one city spends waiting on the
+    network or the database.
+
+    Args:
+        cities (list): City slugs to consider.
+        markets (list, optional): Markets to crawl, 'rent' and/or 'sale'.
+        known_urls (set, optional): `database.url_key` of the URLs already
+        in the database.
+        incremental (bool, optional): Also stop each walk at the first page
+        of already seen listings.
+        scorer (callable, optional): Scores each insert batch, see
+        `database.BatchSink`.
+        indexer (callable, optional): Indexes the rows each batch inserted,
+        see `database.BatchSink`.
+        city_workers (int, optional): Cities walked at once.
+        force (bool, optional): Walk every city, due or not.
+
+    Returns:
+        dict: Walks run and failed, new listings found and requests spent.
+    """
+    known_urls = known_urls if known_urls is not None else set()
+    jobs = crawl_jobs(cities, markets)
+    with transaction() as cursor:
+        due = due_jobs(cursor, jobs, force=force)
+    logging.info(f'{len(due)} of {len(jobs)} city walks are due.')
+
+    summary = {'walks': 0, 'failed': 0, 'new_listings': 0, 'requests': 0}
+    in_flight = max(1, MAX_IN_FLIGHT // max(city_workers, 1))
+    with ThreadPoolExecutor(max_workers=city_workers) as executor:
+        futures = {
+            executor.submit(crawl_city, market, city, budget, known_urls, incremental,
+                            scorer, indexer, in_flight): (market, city)
+            for market, city, budget in due
+        }
+        for future in as_completed(futures):
+            market, city = futures[future]
+            try:
+                new_listings, requests = future.result()
+            except Exception as e:
+                logging.error(f'Error walking the {market} listings of {city}: {e}')
+                summary['failed'] += 1
+                continue
+            summary['walks'] += 1
+            summary['new_listings'] += new_listings
+            summary['requests'] += requests
+    if summary['requests']:
+        logging.info(
+            f"Scheduled crawl found {summary['new_listings']} new listings with "
+            f"{summary['requests']} requests "
+            f"({summary['new_listings'] / summary['requests']:.2f} per request).")
+    return summary
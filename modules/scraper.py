@@ -1,15 +1,24 @@
 from data_cleaning import *
 from datetime import datetime as dt
 import datetime
-from database import is_url_scraped
+from database import filter_scraped_urls, url_key
 from bs4 import BeautifulSoup
 import requests
 import pandas as pd
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import os
+import time
 import re
 from tqdm import tqdm
-from random import uniform
 import logging
+from throttle import MAX_IN_FLIGHT
+from page_cache import fetch_page
+from extractors import extract_details, get_extractor
+from metrics import registry
+
+# Site the scraper crawls. Point it at a `replay` server to run against
+# recorded pages instead of mubawab.ma.
+BASE_URL = os.environ.get('MUBAWAB_BASE_URL', 'https://www.mubawab.ma').rstrip('/')
 
 def prepare_url(location, payment):
     """
@@ -23,10 +32,32 @@ def prepare_url(location, payment):
     Returns:
         str: The full URL of the page containing all the listings.
     """
-    return 'https://www.mubawab.ma/en/ct/{}/real-estate-for-{}:o:n'.format(
-        location, payment
+    return '{}/en/ct/{}/real-estate-for-{}:o:n'.format(
+        BASE_URL, location, payment
     )
 
+def crawl_jobs(cities, markets=('rent',)):
+    """
+    Lists the listing walks of a crawl covering several markets. Markets 
+    are interleaved city by city, so every market makes progress from the 
+    start of a run.
+
+    Args:
+        cities (list): City slugs to crawl.
+        markets (list, optional): Payment slugs, 'rent' and/or 'sale'.
+
+    Returns:
+        list: Tuples of (market, city).
+    """
+    return [(market, city) for city in cities for market in markets]
+
+default_extractor = get_extractor()
+
+# Running totals for URL deduplication. Every listing checked would have 
+# cost one query with a per-URL lookup, so the difference between the two 
+# counters is the number of round trips saved.
+dedup_stats = {'checked': 0, 'queries': 0}
+
 def extract_publication_date(detail):
     try:
         span = detail.find('span', class_='listingDetails iconPadR')
@@ -51,26 +82,53 @@ def extract_publication_date(detail):
         logging.error(f'Error extracting publication date: {e}')
         return None
 
-def get_links(url, max_pages=20, cursor=None):
+def iter_listing_pages(url, max_pages=20, cursor=None, known_urls=None, start_page=1,
+                       incremental=False, since=None, market='rent', raise_errors=False):
     """
-    Scrapes property links from mubaweb.ma and handles pagination.
+    Walks the listing pages of mubaweb.ma, yielding the new property links 
+    found on each page.
+
+    Already scraped listings are filtered out once per page: against 
+    `known_urls` in memory when it is given, otherwise with a single 
+    batched query through `cursor`.
+
+    In incremental mode, the walk stops at the first page made up entirely 
+    of already seen listings. Since listings are sorted newest first, every 
+    later page would be too. A listing counts as seen when it has been 
+    scraped, or when it was published more than a day before `since` 
+    (publication dates are only precise to the day).
 
     Args:
         url (str): The base URL containing all the property listings.
-        max_pages (int, optional): Number of pages to scrape. Defaults to 20.
+        max_pages (int, optional): Last page to scrape. Defaults to 20.
+        cursor (psycopg2.extensions.cursor, optional): The database cursor.
+        known_urls (set, optional): `database.url_key` of the URLs already
+        in the database.
+        start_page (int, optional): Page to start from, to resume a walk.
+        incremental (bool, optional): Stop at the first fully seen page.
+        since (date, optional): The newest publication date seen in 
+        previous walks of this URL.
+        market (str, optional): The market of the listings, whose table 
+        `cursor` checks.
+        raise_errors (bool, optional): Raise request errors instead of 
+        stopping, so the caller can tell a failed walk from one that 
+        reached the end of the listings.
 
-    Returns:
-        list: URLs of all the specific property pages to be scraped.
+    Yields:
+        tuple: The page number and a list of (URL, publication date) tuples 
+        for the listings on that page that have not been scraped yet.
     """
-    prop_links = []
-    page = 1  # Start from the first page
+    checked = queries = 0
+    error = None
+    page = start_page
     while page <= max_pages:
         page_url = url + f':p:{page}'
         
         try:
-            response = requests.get(page_url)
-            response.raise_for_status()  # Raise an error for bad status codes
-            soup = BeautifulSoup(response.content, 'html.parser')
+            # Listing pages change constantly, so always revalidate them
+            with registry.timer('fetch_listing_page'):
+                content = fetch_page(page_url, ttl=0)
+            soup = BeautifulSoup(content, 'html.parser')
             
             # Find all the listing links on the page
             listings = soup.find_all('li', class_='listingBox')
@@ -80,6 +138,7 @@ def get_links(url, max_pages=20, cursor=None):
                 logging.info(f"No listings found on page {page}. Stopping pagination.")
                 break
 
+            page_links = []
             for listing in listings:
                 try:
                     link_tag = listing.find('h2', class_='listingTit').find('a')
@@ -88,18 +147,41 @@ def get_links(url, max_pages=20, cursor=None):
                     else:
                         continue
                     
-                    if cursor and is_url_scraped(cursor, link):
-                        continue
-                    
                     detail = listing.find('div', class_='controlBar sMargTop')
                     publication_date = extract_publication_date(detail)
-
-                    # Append to list
-                    prop_links.append((link, publication_date))
+                    page_links.append((link, publication_date))
                 
                 except AttributeError as e:
                     logging.error(f"Error finding a link: {e}")
 
+            # Drop the listings that are already in the database
+            checked += len(page_links)
+            if known_urls is not None:
+                scraped = {link for link, _ in page_links if url_key(link) in known_urls}
+            elif cursor and page_links:
+                scraped = filter_scraped_urls(
+                    cursor, [link for link, _ in page_links], market)
+                queries += 1
+            else:
+                scraped = set()
+            new_links = [
+                (link, publication_date) for link, publication_date in page_links
+                if link not in scraped
+            ]
+            if since is not None:
+                cutoff = since - datetime.timedelta(days=1)
+                unseen = [
+                    link for link, publication_date in new_links
+                    if publication_date is None or publication_date.date() >= cutoff
+                ]
+            else:
+                unseen = new_links
+            yield page, new_links
+
+            if incremental and page_links and not unseen:
+                logging.info(f"Page {page} has only seen listings. Stopping pagination.")
+                break
+
             # Check if there is a "Next" page
             next_page = soup.find('a', class_='arrowDot')
             if not next_page:
@@ -107,124 +189,218 @@ def get_links(url, max_pages=20, cursor=None):
                 break
             
             page += 1
-            # Random sleep between 1 and 3 seconds to prevent overloading the server
-            sleep(uniform(1, 3))
             
         except requests.exceptions.HTTPError as http_err:
             logging.error(f"HTTP error occurred on page {page}: {http_err}")
+            error = http_err
             break  # Stop the loop if we hit an HTTP error
         
         except requests.RequestException as req_e:
             logging.error(f"Request error on page {page}: {req_e}")
+            error = req_e
             break  # Stop the loop for other request issues
 
+    if cursor or known_urls is not None:
+        dedup_stats['checked'] += checked
+        dedup_stats['queries'] += queries
+        logging.info(
+            f'Deduplicated {checked} listings with {queries} queries '
+            f'({checked - queries} queries saved).')
+    if error is not None and raise_errors:
+        raise error
+
+@registry.timed('get_links')
+def get_links(url, max_pages=20, cursor=None, known_urls=None, incremental=False,
+              since=None, market='rent'):
+    """
+    Scrapes property links from mubaweb.ma and handles pagination.
+
+    Args:
+        url (str): The base URL containing all the property listings.
+        max_pages (int, optional): Number of pages to scrape. Defaults to 20.
+        cursor (psycopg2.extensions.cursor, optional): The database cursor.
+        known_urls (set, optional): `database.url_key` of the URLs already
+        in the database.
+        incremental (bool, optional): Stop at the first page with only 
+        already seen listings.
+        since (date, optional): The newest publication date seen in 
+        previous walks of this URL.
+        market (str, optional): The market of the listings, whose table 
+        `cursor` checks.
+
+    Returns:
+        list: URLs of all the specific property pages to be scraped.
+    """
+    prop_links = []
+    for _, page_links in iter_listing_pages(url, max_pages, cursor, known_urls,
+                                            incremental=incremental, since=since,
+                                            market=market):
+        prop_links.extend(page_links)
     return prop_links
 
-def get_details(links_with_dates):
+def parse_details(content, link, publication_date, extractor=None):
     """
-    Scrapes the important features of each property.
+    Parses the important features of a single property page.
 
     Args:
-        links (str): The URLs of each property to be scraped.
-        cursor (psycopg2.extensions.cursor): The database cursor.
+        content (bytes): The raw HTML of the property page.
+        link (str): The URL the page was fetched from.
+        publication_date (datetime or None): The date the listing was 
+        published, as extracted from the listing page.
+        extractor (optional): The parser backend from `extractors`. 
+        Defaults to the fastest one installed.
 
     Returns:
-        DataFrame: A pandas DataFrame containing all the features of the 
-        property
+        dict: The features of the property.
     """
-    full_list = []
+    raw = extract_details(content, extractor or default_extractor)
     
-    for link, publication_date in tqdm(links_with_dates, desc="Fetching property details"):
-        try:
-            response = requests.get(link)
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            raw_price = soup.find('h3', class_='orangeTit').text.strip()
-            raw_area_text = soup.find('h3', class_='greyTit').text.strip()
-            raw_title = soup.find('h1', class_='searchTitle').text.strip()
-            
-            price = clean_integer(raw_price)
-            title = clean_text(raw_title)
-            
-            area, city = parse_area_and_city(raw_area_text)
-            
-            text_content = None
-            div_block = soup.find('div', class_='blockProp')
-            if div_block:
-                p_tag = div_block.find('p')
-                if p_tag:
-                    text_content = p_tag.get_text(separator=" ").strip()
-            
-            description = soup.find_all(
-                'p', class_='adMainFeatureContentValue')
+    price = clean_integer(raw['price'])
+    title = clean_text(raw['title'])
+    
+    area, city = parse_area_and_city(raw['area_text'])
+    
+    text_content = raw['description']
+    
+    description_titles = ['Property Type', 'Condition', 'Age']
+    descriptor_list = [clean_text(desc) for desc in raw['descriptors']]
+    desc_dict = dict(zip(description_titles, descriptor_list))
+    
+    size = rooms = bedrooms = bathrooms = None
+    # This is extra info like size, number of rooms etc.
+    for text, value in raw['details']:
+        # Check for size (since it's the first one with 'm²')
+        if 'm²' in text:
+            size = clean_integer(value)
+        
+        # Check for number of rooms (called pieces on site)
+        if 'Pieces' in text or 'Piece' in text:
+            rooms = clean_integer(value)
+        
+        # Check for number of bedrooms
+        if 'Rooms' in text or 'Room' in text:
+            bedrooms = clean_integer(value)
+        
+        # Check for number of bathrooms
+        if 'Bathrooms' in text or 'Bathroom' in text:
+            bathrooms = clean_integer(value)
             
-            description_titles = ['Property Type', 'Condition', 'Age']
-            descriptor_list = [clean_text(desc.text) for desc in description]
-            desc_dict = dict(zip(description_titles, descriptor_list))
+    # If there are no rooms extracted, the function searches the description
+    if rooms is None and text_content:
+        rooms = clean_rooms(text_content)
             
-            size = rooms = bedrooms = bathrooms = None
-            # This is extra info like size, number of rooms etc.
-            details = soup.find_all('div', class_='adDetailFeature')
+    feature_list = [clean_text(feature) for feature in raw['features']]   
+    feature_str = ', '.join(filter(None, feature_list))
+             
+    return {
+            'title': title,
+            'description': text_content,
+            'property_type': desc_dict.get('Property Type'),
+            'city' : city, 
+            'area': area, 
+            'size': size, 
+            'rooms': rooms, 
+            'bedrooms': bedrooms, 
+            'bathrooms': bathrooms, 
+            'price': price,
+            'features': feature_str,
+            'condition': clean_condition(desc_dict.get('Condition')),
+            'age': clean_age(desc_dict.get('Age')),
+            'date_published': publication_date,
+            'url': link
+            }
 
-            for detail in details:
-                text = detail.text
-                value = detail.find('span').text.strip()
-                
-                # Check for size (since it's the first one with 'm²')
-                if 'm²' in text:
-                    size = clean_integer(value)
-                
-                # Check for number of rooms (called pieces on site)
-                if 'Pieces' in text or 'Piece' in text:
-                    rooms = clean_integer(value)
-                
-                # Check for number of bedrooms
-                if 'Rooms' in text or 'Room' in text:
-                    bedrooms = clean_integer(value)
-                
-                # Check for number of bathrooms
-                if 'Bathrooms' in text or 'Bathroom' in text:
-                    bathrooms = clean_integer(value)
-                    
-            # If there are no rooms extracted, the function searches the description
-            if rooms is None and text_content:
-                rooms = clean_rooms(text_content)
-                    
-            features = soup.find_all('span', class_='fSize11 centered')
-            feature_list = [clean_text(feature.text) for feature in features]   
-            feature_str = ', '.join(filter(None, feature_list))
-                     
-            property_details = {
-                                'title': title,
-                                'description': text_content,
-                                'property_type': desc_dict.get('Property Type'),
-                                'city' : city, 
-                                'area': area, 
-                                'size': size, 
-                                'rooms': rooms, 
-                                'bedrooms': bedrooms, 
-                                'bathrooms': bathrooms, 
-                                'price': price,
-                                'features': feature_str,
-                                'condition': clean_condition(desc_dict.get('Condition')),
-                                'age': clean_age(desc_dict.get('Age')),
-                                'date_published': publication_date,
-                                'url': link
-                                }
-            
-            full_list.append(property_details)
-            sleep(uniform(1, 3))
-            
-        except Exception as e:
-            logging.error(f'Error fetching property data from {link}: {e}')
-            
-    return pd.DataFrame(full_list)
+def fetch_details(link, publication_date):
+    """
+    Fetches and parses a single property page.
+
+    Args:
+        link (str): The URL of the property page.
+        publication_date (datetime or None): The publication date of the 
+        listing.
+
+    Returns:
+        dict or None: The features of the property, or None on failure.
+    """
+    try:
+        with registry.timer('fetch_details'):
+            content = fetch_page(link)
+        with registry.timer('parse_details'):
+            return parse_details(content, link, publication_date)
+    except Exception as e:
+        logging.error(f'Error fetching property data from {link}: {e}')
+        registry.inc('detail_errors')
+        return None
+
+def iter_details(links_with_dates, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Scrapes the important features of each property, yielding each one as 
+    soon as its page has been parsed.
+
+    Pages are fetched concurrently by a bounded pool of workers, while the 
+    shared token bucket in `throttle` keeps the overall request rate within 
+    the politeness budget. Only a small window of pages is in flight at any 
+    time, so memory stays flat however many links are passed in.
+
+    Args:
+        links_with_dates (iterable): Tuples of (URL, publication date) for 
+        each property to be scraped.
+        max_in_flight (int, optional): Maximum number of concurrent requests.
+
+    Yields:
+        dict: The features of each property that was scraped successfully.
+    """
+    total = len(links_with_dates) if hasattr(links_with_dates, '__len__') else None
+    fetched = 0
+    start = time.perf_counter()
+    # Workers record their timings under the caller's city and market
+    fetch = registry.bind(fetch_details)
+    
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor, \
+            tqdm(total=total, desc="Fetching property details") as progress:
+        pending = set()
+        for link, publication_date in links_with_dates:
+            pending.add(executor.submit(fetch, link, publication_date))
+            if len(pending) < 2 * max_in_flight:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fetched += 1
+                progress.update()
+                if future.result() is not None:
+                    yield future.result()
+        for future in as_completed(pending):
+            fetched += 1
+            progress.update()
+            if future.result() is not None:
+                yield future.result()
+    
+    elapsed = time.perf_counter() - start
+    registry.observe('get_details', elapsed)
+    if fetched:
+        logging.info(
+            f'Fetched {fetched} property pages in {elapsed:.1f}s '
+            f'({fetched / max(elapsed, 1e-9):.2f} pages/sec).')
+
+def get_details(links_with_dates, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Scrapes the important features of each property.
+
+    Args:
+        links_with_dates (list): Tuples of (URL, publication date) for each 
+        property to be scraped.
+        max_in_flight (int, optional): Maximum number of concurrent requests.
+
+    Returns:
+        DataFrame: A pandas DataFrame containing all the features of the 
+        property
+    """
+    return pd.DataFrame(list(iter_details(links_with_dates, max_in_flight)))
 
 def fetch_raw_area_text_from_url(url):
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad status codes
-        soup = BeautifulSoup(response.content, 'html.parser')
+        content = fetch_page(url)
+        soup = BeautifulSoup(content, 'html.parser')
         raw_area_text_element = soup.find('h3', class_='greyTit')
         if raw_area_text_element:
             return raw_area_text_element.text.strip()
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+# Politeness budget shared by every request made against mubawab.ma. Both
+# values can be tuned per run through environment variables; a rate of 0
+# disables throttling, e.g. against a local replay server.
+REQUESTS_PER_SECOND = float(os.environ.get('SCRAPER_REQUESTS_PER_SECOND', 2))
+MAX_IN_FLIGHT = int(os.environ.get('SCRAPER_MAX_IN_FLIGHT', 4))
+if REQUESTS_PER_SECOND < 0:
+    raise ValueError(
+        f'SCRAPER_REQUESTS_PER_SECOND must be 0 (unthrottled) or positive, '
+        f'got {REQUESTS_PER_SECOND:g}')
+if MAX_IN_FLIGHT < 1:
+    raise ValueError(f'SCRAPER_MAX_IN_FLIGHT must be at least 1, got {MAX_IN_FLIGHT}')
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to cap the global request rate.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Each
+    request takes one token, blocking until one is available. A rate of 0
+    never blocks.
+
+    Raises:
+        ValueError: If the rate is negative.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate < 0:
+            raise ValueError(f'Token bucket rate must be 0 or positive, got {rate:g}')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and consumes it.
+
+        Returns:
+            float: The number of seconds spent waiting for the token.
+        """
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+politeness = TokenBucket(REQUESTS_PER_SECOND)
@@ -0,0 +1,433 @@
+import os
+import json
+import time
+import pickle
+import logging
+import resource
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from scipy import sparse
+from export import export_properties, load_properties
+from database import transaction, close_pool, MARKETS
+from near_duplicates import duplicate_ids
+
+try:
+    import lightgbm
+except ImportError:  # lightgbm is optional, scikit-learn remains the fallback
+    lightgbm = None
+
+# The feature matrix of each market is cached under FEATURE_DIR/<market> and
+# extended with new rows only; trained models are written to MODEL_DIR.
+FEATURE_DIR = os.environ.get(
+    'FEATURE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'processed', 'features')
+)
+MODEL_DIR = os.environ.get(
+    'MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'models')
+)
+TRAIN_THREADS = int(os.environ.get('TRAIN_THREADS', os.cpu_count() or 1))
+
+NUMERIC_COLUMNS = ['size', 'rooms', 'bedrooms', 'bathrooms']
+CATEGORICAL_COLUMNS = ['city', 'area', 'property_type']
+SOURCE_COLUMNS = ['id', 'price', 'features'] + NUMERIC_COLUMNS + CATEGORICAL_COLUMNS
+# Listings outside these price quantiles are mostly typos or misfiled sales
+PRICE_QUANTILES = (0.005, 0.995)
+VALIDATION_FRACTION = 0.1
+
+LIGHTGBM_PARAMS = {
+    'objective': 'regression',
+    'learning_rate': 0.05,
+    'num_leaves': 63,
+    'min_data_in_leaf': 20,
+    'feature_fraction': 0.8,
+    'verbose': -1,
+}
+NUM_BOOST_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 50
+
+
+def _tokens(df):
+    """
+    Lists the one-hot tokens of every row: one per categorical column, and
+    one per entry of the comma-separated features.
+
+    Returns:
+        pd.DataFrame: Pairs of (row position, token) such as 'city=rabat'.
+    """
+    positions = np.arange(len(df))
+    parts = []
+    for column in CATEGORICAL_COLUMNS:
+        values = df[column].astype('string').str.strip().str.lower()
+        parts.append(pd.DataFrame({'row': positions, 'token': column + '=' + values}))
+    features = df['features'].astype('string').str.split(',')
+    exploded = pd.DataFrame({'row': positions, 'token': features}).explode('token')
+    exploded['token'] = 'features=' + exploded['token'].astype('string').str.strip().str.lower()
+    parts.append(exploded)
+    tokens = pd.concat(parts, ignore_index=True).dropna()
+    tokens = tokens[~tokens['token'].str.endswith('=')]
+    return tokens.drop_duplicates()
+
+
+def encode_frame(df, vocabulary, grow=True, index=None):
+    """
+    Encodes properties as a sparse matrix: the numeric columns first, then
+    one column per token of `vocabulary`.
+
+    Missing numeric values are stored as explicit NaNs, which the model
+    treats as missing rather than zero. The vocabulary only ever grows at
+    the end, so columns keep their meaning as new tokens are seen.
+
+    Args:
+        df (pd.DataFrame): Properties with the columns of `SOURCE_COLUMNS`.
+        vocabulary (list): Known tokens, extended in place when `grow`.
+        grow (bool, optional): Add unseen tokens to the vocabulary. When
+        False, unseen tokens are ignored, as at prediction time.
+        index (dict, optional): Column of each token of `vocabulary`, to
+        avoid rebuilding it on every call when the vocabulary is fixed.
+
+    Returns:
+        scipy.sparse.csr_matrix: The feature matrix.
+    """
+    n = len(df)
+    rows = [np.repeat(np.arange(n), len(NUMERIC_COLUMNS))]
+    cols = [np.tile(np.arange(len(NUMERIC_COLUMNS)), n)]
+    numeric = df[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    vals = [numeric.to_numpy(dtype=np.float32).ravel()]
+
+    tokens = _tokens(df)
+    if index is None or grow:
+        index = {token: i for i, token in enumerate(vocabulary)}
+    if grow:
+        for token in tokens['token'].unique():
+            if token not in index:
+                index[token] = len(vocabulary)
+                vocabulary.append(token)
+    codes = tokens['token'].map(index)
+    known = codes.notna().to_numpy()
+    rows.append(tokens['row'].to_numpy()[known])
+    cols.append(len(NUMERIC_COLUMNS) + codes.to_numpy()[known].astype(np.int64))
+    vals.append(np.ones(known.sum(), dtype=np.float32))
+
+    # Numeric zeros are dropped like any sparse zero, NaNs are kept
+    matrix = sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n, len(NUMERIC_COLUMNS) + len(vocabulary)), dtype=np.float32)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _token(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return str(value).strip().lower() or None
+
+
+def encode_records(properties, index):
+    """
+    Encodes property dictionaries against a fixed vocabulary, producing the
+    same matrix as `encode_frame(..., grow=False)`. Building the CSR arrays
+    directly avoids the per-call overhead of pandas, which dominates when
+    scoring a handful of listings at a time.
+
+    Args:
+        properties (list): Dictionaries with the fields of `SOURCE_COLUMNS`.
+        index (dict): Column of each token of the vocabulary.
+
+    Returns:
+        scipy.sparse.csr_matrix: The feature matrix.
+    """
+    offset = len(NUMERIC_COLUMNS)
+    indptr, indices, data = [0], [], []
+    for prop in properties:
+        for j, column in enumerate(NUMERIC_COLUMNS):
+            value = _number(prop.get(column))
+            if value != 0:
+                indices.append(j)
+                data.append(value)
+        columns = set()
+        for column in CATEGORICAL_COLUMNS:
+            token = _token(prop.get(column))
+            if token is not None:
+                columns.add(index.get(column + '=' + token))
+        features = prop.get('features')
+        if isinstance(features, str):
+            for feature in features.split(','):
+                token = _token(feature)
+                if token is not None:
+                    columns.add(index.get('features=' + token))
+        columns.discard(None)
+        for column in sorted(columns):
+            indices.append(offset + column)
+            data.append(1.0)
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), indptr),
+        shape=(len(properties), offset + len(index)))
+
+
+def feature_names(vocabulary):
+    return NUMERIC_COLUMNS + list(vocabulary)
+
+
+def _feature_path(market, name):
+    return os.path.join(FEATURE_DIR, market, name)
+
+
+def load_feature_cache(market='rent'):
+    """
+    Loads the cached feature matrix of a market.
+
+    Returns:
+        tuple or None: The matrix, log prices, ids and metadata (vocabulary
+        and last id), or None when nothing is cached.
+    """
+    try:
+        with open(_feature_path(market, 'meta.json')) as f:
+            meta = json.load(f)
+        matrix = sparse.load_npz(_feature_path(market, 'X.npz'))
+        target = np.load(_feature_path(market, 'y.npy'))
+        ids = np.load(_feature_path(market, 'ids.npy'))
+    except FileNotFoundError:
+        return None
+    return matrix, target, ids, meta
+
+
+def _save_feature_cache(market, matrix, target, ids, meta):
+    os.makedirs(os.path.join(FEATURE_DIR, market), exist_ok=True)
+    sparse.save_npz(_feature_path(market, 'X.npz'), matrix)
+    np.save(_feature_path(market, 'y.npy'), target)
+    np.save(_feature_path(market, 'ids.npy'), ids)
+    # The metadata is written last: a build interrupted before it is redone
+    path = _feature_path(market, 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+
+def build_features(market='rent', rebuild=False):
+    """
+    Brings the cached feature matrix of a market up to date with its
+    Parquet snapshot, encoding only the rows added since the last build.
+
+    Rows updated in place after they were encoded, e.g. by the city
+    backfill, are only picked up by a full rebuild.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        rebuild (bool, optional): Discard the cache and encode every row.
+
+    Returns:
+        tuple: The feature matrix, log prices (NaN where unknown), ids and
+        metadata.
+    """
+    cached = None if rebuild else load_feature_cache(market)
+    if cached:
+        matrix, target, ids, meta = cached
+    else:
+        matrix = sparse.csr_matrix((0, len(NUMERIC_COLUMNS)), dtype=np.float32)
+        target = np.empty(0)
+        ids = np.empty(0, dtype=np.int64)
+        meta = {'last_id': 0, 'vocabulary': []}
+
+    df = load_properties(market, columns=SOURCE_COLUMNS,
+                         filter=ds.field('id') > meta['last_id'])
+    if df.empty:
+        logging.info(f'Feature cache of {market} is up to date ({matrix.shape[0]} rows).')
+        return matrix, target, ids, meta
+
+    df = df.sort_values('id')
+    vocabulary = meta['vocabulary']
+    new_matrix = encode_frame(df, vocabulary)
+    # Older rows have no entries in the columns of new tokens
+    matrix.resize(matrix.shape[0], new_matrix.shape[1])
+    matrix = sparse.vstack([matrix, new_matrix], format='csr')
+    price = pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype=float)
+    target = np.concatenate([target, np.log1p(price)])
+    ids = np.concatenate([ids, df['id'].to_numpy(dtype=np.int64)])
+    meta = {'last_id': int(ids[-1]), 'vocabulary': vocabulary}
+    _save_feature_cache(market, matrix, target, ids, meta)
+    logging.info(
+        f'Encoded {len(df)} new {market} rows; feature matrix is {matrix.shape[0]} x '
+        f'{matrix.shape[1]} with {matrix.nnz} stored values.')
+    return matrix, target, ids, meta
+
+
+def _training_rows(target, ids=None, exclude=None):
+    """
+    Selects rows with a price inside the `PRICE_QUANTILES`, leaving out the
+    listings in `exclude`.
+    """
+    known = ~np.isnan(target)
+    if exclude:
+        known &= ~np.isin(ids, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+    low, high = np.quantile(target[known], PRICE_QUANTILES)
+    return np.flatnonzero(known & (target >= low) & (target <= high))
+
+
+def fit_model(X_train, y_train, X_valid, y_valid, names):
+    """
+    Fits a gradient-boosted regressor, with LightGBM when it is installed
+    and scikit-learn's histogram boosting otherwise.
+
+    Returns:
+        tuple: The fitted model and the name of the backend.
+    """
+    if lightgbm is not None:
+        params = dict(LIGHTGBM_PARAMS, num_threads=TRAIN_THREADS)
+        train_set = lightgbm.Dataset(X_train, y_train, feature_name=names, free_raw_data=True)
+        valid_set = lightgbm.Dataset(X_valid, y_valid, reference=train_set)
+        model = lightgbm.train(
+            params, train_set, num_boost_round=NUM_BOOST_ROUNDS, valid_sets=[valid_set],
+            callbacks=[lightgbm.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+        return model, 'lightgbm'
+
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    logging.warning('lightgbm is not installed, training with scikit-learn on a dense matrix.')
+    model = HistGradientBoostingRegressor(
+        learning_rate=LIGHTGBM_PARAMS['learning_rate'], max_iter=NUM_BOOST_ROUNDS,
+        max_leaf_nodes=LIGHTGBM_PARAMS['num_leaves'], early_stopping=True,
+        n_iter_no_change=EARLY_STOPPING_ROUNDS)
+    model.fit(X_train.toarray(), y_train)
+    return model, 'sklearn'
+
+
+def predict_log_price(model, matrix, num_threads=TRAIN_THREADS):
+    if lightgbm is not None and isinstance(model, lightgbm.Booster):
+        return model.predict(matrix, num_threads=num_threads)
+    return model.predict(matrix.toarray())
+
+
+def model_path(market='rent'):
+    return os.path.join(MODEL_DIR, market, 'model.pkl')
+
+
+def save_model(market, model, backend, meta, report=None):
+    """
+    Saves a model with the vocabulary needed to encode listings for it. The
+    file is replaced atomically, so a running predictor never reads half
+    of it.
+    """
+    path = model_path(market)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump({'model': model, 'backend': backend, 'vocabulary': meta['vocabulary'],
+                     'last_id': meta['last_id'], 'report': report}, f)
+    os.replace(path + '.tmp', path)
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if os.uname().sysname == 'Darwin' else 1024)
+
+
+def mean_absolute_percentage_error(predicted, actual):
+    """
+    Computes the MAPE of predicted prices over the listings with a positive
+    price, as a price of 0 would make it infinite.
+
+    Returns:
+        float or None: The error, None when no listing has a positive price.
+    """
+    priced = actual > 0
+    if not priced.any():
+        return None
+    return float(np.mean(np.abs(predicted[priced] - actual[priced]) / actual[priced]))
+
+
+def train(market='rent', rebuild=False, exclude=None):
+    """
+    Trains a price model on log1p(price) from the cached feature matrix.
+
+    The newest listings are held out for validation, which also drives
+    early stopping, then the model is saved with the vocabulary needed to
+    encode listings for prediction.
+
+    Args:
+        market (str, optional): Either 'rent' or 'sale'.
+        rebuild (bool, optional): Re-encode every row instead of only new ones.
+        exclude (set, optional): Ids of listings to leave out, such as near
+        duplicates of other listings.
+
+    Returns:
+        dict: Row counts, validation error, time spent building features and
+        training, and the peak memory of the process.
+    """
+    start = time.perf_counter()
+    matrix, target, ids, meta = build_features(market, rebuild)
+    build_seconds = time.perf_counter() - start
+
+    rows = _training_rows(target, ids, exclude)
+    # Rows are in id order, so the tail holds the newest listings
+    split = int(len(rows) * (1 - VALIDATION_FRACTION))
+    train_rows, valid_rows = rows[:split], rows[split:]
+    names = feature_names(meta['vocabulary'])
+
+    start = time.perf_counter()
+    model, backend = fit_model(matrix[train_rows], target[train_rows],
+                               matrix[valid_rows], target[valid_rows], names)
+    train_seconds = time.perf_counter() - start
+
+    predicted = np.expm1(predict_log_price(model, matrix[valid_rows]))
+    actual = np.expm1(target[valid_rows])
+    report = {
+        'market': market,
+        'backend': backend,
+        'rows': int(matrix.shape[0]),
+        'features': int(matrix.shape[1]),
+        'excluded': len(exclude or ()),
+        'train_rows': int(len(train_rows)),
+        'valid_rows': int(len(valid_rows)),
+        'valid_mae': float(np.mean(np.abs(predicted - actual))),
+        'valid_mape': mean_absolute_percentage_error(predicted, actual),
+        'build_seconds': build_seconds,
+        'train_seconds': train_seconds,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+
+    save_model(market, model, backend, meta, report)
+
+    mape = 'n/a' if report['valid_mape'] is None else f"{100 * report['valid_mape']:.1f}%"
+    logging.info(
+        f"Trained {backend} {market} model on {report['train_rows']} rows x "
+        f"{report['features']} features in {train_seconds:.1f}s (features {build_seconds:.1f}s); "
+        f"validation MAE {report['valid_mae']:.0f} MAD, MAPE {mape}; "
+        f"peak memory {report['peak_memory_mb']:.0f} MB.")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the price prediction model.')
+    parser.add_argument('--market', choices=sorted(MARKETS), default='rent',
+                        help='market to train on (default: rent)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='re-encode every row instead of only the new ones')
+    parser.add_argument('--no-export', action='store_true',
+                        help='train on the existing Parquet snapshot without updating it')
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help='also train on listings that near-duplicate an older one')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    exclude = None
+    try:
+        if not args.no_export:
+            export_properties(args.market)
+        if not args.keep_duplicates:
+            try:
+                with transaction() as cursor:
+                    exclude = duplicate_ids(cursor, args.market)
+            except Exception as e:
+                logging.warning(f'Could not load the near duplicates, training on every listing: {e}')
+    finally:
+        close_pool()
+    print(json.dumps(train(args.market, args.rebuild, exclude), indent=2))
@@ -0,0 +1,136 @@
+import random
+import datetime
+import pandas as pd
+import pytest
+import data_cleaning
+from data_cleaning import (
+    clean_integer, clean_text, clean_age, clean_rooms, clean_condition,
+    parse_area_and_city, clean_property_data, clean_integer_column,
+    clean_text_column, clean_age_column, clean_rooms_column,
+    clean_condition_column, parse_area_and_city_column, clean_raw_frame,
+)
+
+# Fragments combined at random, including the awkward ones: Arabic-Indic
+# digits, leading zeros, huge numbers, newlines and stray whitespace
+TOKENS = [
+    '5', '12', '007', '2 500', '١٢', '99999999999999999999', 'DH', 'm²',
+    'years', 'Years', 'rooms', 'Room', 'bed room', 'in', 'In', ' ', '  ',
+    '\n', '-', 'Maarif', 'Casablanca', 'Good condition', 'Due for reform',
+    'New', 'between', 'and', '', ',', 'Price on request',
+]
+FUZZ_ROWS = 3000
+
+
+def random_string(rng):
+    if rng.random() < 0.1:
+        return rng.choice([None, ''])
+    return ''.join(rng.choice(TOKENS) + rng.choice(['', ' ']) for _ in range(rng.randint(1, 6)))
+
+
+def normalise(value):
+    return None if value is None or value is pd.NA or value != value else value
+
+
+def rooms_or_none(value):
+    # clean_rooms expects a description; missing ones never reach it
+    return clean_rooms(value) if value else None
+
+
+def area_and_city(values):
+    area, city = parse_area_and_city_column(values)
+    return list(zip(area, city))
+
+
+@pytest.fixture(params=['arrow', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'arrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(data_cleaning, 'pa', None)
+        monkeypatch.setattr(data_cleaning, 'pc', None)
+    return request.param
+
+
+@pytest.fixture
+def values():
+    rng = random.Random(0)
+    return [random_string(rng) for _ in range(FUZZ_ROWS)]
+
+
+@pytest.mark.parametrize('scalar, column', [
+    (clean_integer, clean_integer_column),
+    (clean_text, clean_text_column),
+    (clean_age, clean_age_column),
+    (rooms_or_none, clean_rooms_column),
+    (parse_area_and_city, area_and_city),
+], ids=['clean_integer', 'clean_text', 'clean_age', 'clean_rooms', 'parse_area_and_city'])
+def test_column_matches_scalar(backend, values, scalar, column):
+    expected = [scalar(value) for value in values]
+    actual = [normalise(value) for value in column(pd.Series(values, dtype=object))]
+    assert actual == expected
+
+
+def test_condition_column_matches_scalar(backend):
+    rng = random.Random(1)
+    values = [rng.choice(TOKENS + [None]) for _ in range(FUZZ_ROWS)]
+    expected = [clean_condition(value) for value in values]
+    actual = [normalise(value) for value in clean_condition_column(pd.Series(values, dtype=object))]
+    assert actual == expected
+
+
+def test_raw_frame_matches_scalar(backend):
+    rng = random.Random(2)
+    today = datetime.datetime(2024, 6, 1)
+    n = FUZZ_ROWS
+    raw = pd.DataFrame({
+        'title': [random_string(rng) for _ in range(n)],
+        'description': [random_string(rng) for _ in range(n)],
+        'property_type': [rng.choice(['Apartment', 'Villa', None]) for _ in range(n)],
+        'area_text': [random_string(rng) for _ in range(n)],
+        'size': [random_string(rng) for _ in range(n)],
+        'rooms': [random_string(rng) for _ in range(n)],
+        'bedrooms': [random_string(rng) for _ in range(n)],
+        'bathrooms': [random_string(rng) for _ in range(n)],
+        'price': [random_string(rng) for _ in range(n)],
+        'features': [random_string(rng) for _ in range(n)],
+        'condition': [rng.choice(TOKENS + [None]) for _ in range(n)],
+        'age': [random_string(rng) for _ in range(n)],
+        'date_published': [today - datetime.timedelta(days=rng.randint(0, 99)) for _ in range(n)],
+        'url': [f'https://www.mubawab.ma/en/a/{i}' for i in range(n)],
+    })
+    expected = []
+    for row in raw.to_dict('records'):
+        area, city = parse_area_and_city(row['area_text'])
+        rooms = clean_integer(row['rooms'])
+        if rooms is None and row['description']:
+            rooms = clean_rooms(row['description'])
+        expected.append(clean_property_data({
+            'title': clean_text(row['title']),
+            'description': row['description'],
+            'property_type': row['property_type'],
+            'city': city,
+            'area': area,
+            'size': clean_integer(row['size']),
+            'rooms': rooms,
+            'bedrooms': clean_integer(row['bedrooms']),
+            'bathrooms': clean_integer(row['bathrooms']),
+            'price': clean_integer(row['price']),
+            'features': row['features'],
+            'condition': clean_condition(row['condition']),
+            'age': clean_age(row['age']),
+            'date_published': row['date_published'],
+            'url': row['url'],
+        }))
+    actual = [{key: normalise(value) for key, value in row.items()}
+              for row in clean_raw_frame(raw).astype(object).to_dict('records')]
+    assert actual == expected
+
+
+def test_known_values():
+    assert clean_integer('2 500 000 DH') == 2500000
+    assert clean_integer('١٢') == 12
+    assert clean_integer('Price on request') is None
+    assert clean_age('5-10 years') == '5-10'
+    assert parse_area_and_city('Agdal in Rabat') == ('Agdal', 'Rabat')
+    column = clean_integer_column(pd.Series(['120 m²', None, '', '99999999999999999999'], dtype=object))
+    assert [normalise(value) for value in column] == [120, None, None, 99999999999999999999]
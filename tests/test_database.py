@@ -0,0 +1,46 @@
+import datetime
+import pandas as pd
+import database
+from database import (
+    load_property_file, prepare_property_record, _copy_csv_line, PROPERTY_COLUMNS,
+)
+
+
+def listing(i, **values):
+    prop = {column: None for column in PROPERTY_COLUMNS}
+    prop.update(title=f'Apartment {i}', city='Rabat', size=80 + i, price=5000 + i,
+                date_published=datetime.date(2024, 1, 5 + i),
+                url=f'https://www.mubawab.ma/en/a/{i}')
+    prop.update(values)
+    return prop
+
+
+def test_prepare_parses_string_dates():
+    record = prepare_property_record(listing(0, date_published='2024-01-05'))
+    assert record[PROPERTY_COLUMNS.index('date_published')] == datetime.date(2024, 1, 5)
+
+
+def test_csv_round_trip_keeps_dates(tmp_path, monkeypatch):
+    props = [listing(0), listing(1, date_published=None, rooms=3)]
+    path = str(tmp_path / 'properties.csv')
+    pd.DataFrame(props).to_csv(path, index=False)
+
+    loaded = []
+    def bulk_load(cursor, properties, table, upsert):
+        loaded.extend(prepare_property_record(prop) for prop in properties)
+        return len(loaded)
+    monkeypatch.setattr(database, 'bulk_load_properties', bulk_load)
+    assert load_property_file(None, path, upsert=True) == 2
+
+    assert loaded == [prepare_property_record(prop) for prop in props]
+    position = PROPERTY_COLUMNS.index('date_published')
+    assert [record[position] for record in loaded] == [datetime.date(2024, 1, 5), None]
+
+
+def test_copy_line_quotes_strings_and_leaves_nulls_bare():
+    line = _copy_csv_line(('say "hi"', '', None, 3, datetime.date(2024, 1, 5)))
+    assert line == '"say ""hi""","",,3,2024-01-05\n'
+
+
+def test_copy_line_writes_bytes_as_bytea_hex():
+    assert _copy_csv_line(('a', b'\x01\xab')) == '"a",\\x01ab\n'
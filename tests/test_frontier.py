@@ -0,0 +1,97 @@
+import contextlib
+import pytest
+import requests
+import frontier
+from frontier import _is_local_worker, release_dead_claims, discover_city
+
+
+class FakeCursor:
+    def __init__(self, rows=(), row=None):
+        self.rows = list(rows)
+        self.row = row
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append((' '.join(query.split()), params))
+
+    def executemany(self, query, params):
+        self.statements.append((' '.join(query.split()), list(params)))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.row
+
+
+@pytest.fixture
+def host(monkeypatch):
+    monkeypatch.setattr(frontier.socket, 'gethostname', lambda: 'web')
+    return 'web'
+
+
+def test_local_workers_match_the_whole_hostname(host):
+    assert _is_local_worker('web-1234')
+    assert not _is_local_worker('web-2-1234')
+    assert not _is_local_worker('webserver-1234')
+    assert not _is_local_worker('web-')
+
+
+def test_only_stopped_local_workers_are_released(host, monkeypatch):
+    monkeypatch.setattr(frontier, '_pid_alive', lambda pid: pid == 1)
+    cursor = FakeCursor(rows=[('web-1',), ('web-2',), ('web-2-3',)])
+    release_dead_claims(cursor)
+    query, params = cursor.statements[0]
+    assert '~' in query and 'LIKE' not in query
+    assert params == (r'^web-\d+$',) * 2
+    released = [params for query, params in cursor.statements[1:]]
+    assert released == [(['web-2'],), (['web-2'],)]
+
+
+def test_nothing_is_released_while_workers_run(host, monkeypatch):
+    monkeypatch.setattr(frontier, '_pid_alive', lambda pid: True)
+    cursor = FakeCursor(rows=[('web-1',)])
+    release_dead_claims(cursor)
+    assert len(cursor.statements) == 1
+
+
+@pytest.fixture
+def walk(monkeypatch):
+    """
+    Runs `discover_city` over fake listing pages, and returns the
+    statements it ran.
+    """
+    cursor = FakeCursor(row=(1, 1))
+
+    @contextlib.contextmanager
+    def transaction():
+        yield cursor
+
+    def run(pages):
+        monkeypatch.setattr(frontier, 'iter_listing_pages', lambda *args, **kwargs: pages())
+        finished = discover_city('sale', 'rabat', 0, 5, set())
+        return finished, [query for query, _ in cursor.statements]
+
+    monkeypatch.setattr(frontier, 'transaction', transaction)
+    monkeypatch.setattr(frontier, 'update_high_water_mark', lambda *args: None)
+    return run
+
+
+def test_walk_is_finished_at_the_end_of_the_listings(walk):
+    def pages():
+        yield 1, [('https://www.mubawab.ma/fr/a/1', None)]
+
+    finished, queries = walk(pages)
+    assert finished
+    assert 'finished = TRUE' in queries[-1]
+
+
+def test_failed_walk_is_released_not_finished(walk):
+    def pages():
+        yield 1, [('https://www.mubawab.ma/fr/a/1', None)]
+        raise requests.ConnectionError('reset')
+
+    finished, queries = walk(pages)
+    assert not finished
+    assert 'attempts = attempts + 1, claimed_by = NULL' in queries[-1]
+    assert not any('finished = TRUE' in query for query in queries)
@@ -0,0 +1,72 @@
+import random
+import numpy as np
+from near_duplicates import (
+    shingles, signatures, listing_text, block_key, probe_keys, band_buckets,
+    SIMILARITY_THRESHOLD,
+)
+
+WORDS = (
+    'appartement villa studio lumineux spacieux calme moderne neuf terrasse jardin piscine '
+    'parking garage ascenseur concierge cuisine salon chambres douche proche tram école '
+    'commerces plage centre quartier résidence bright spacious quiet furnished balcony '
+    'elevator kitchen living bedroom bathroom close school shops beach downtown sea view'
+).split()
+
+
+def listing(rng):
+    return {'text': ' '.join(rng.choices(WORDS, k=rng.randint(40, 100))), 'city': 'rabat',
+            'size': rng.randint(40, 300), 'price': rng.randint(3000, 30000)}
+
+
+def repost(original, rng):
+    """The same flat posted again: a word edited, size and price nudged."""
+    words = original['text'].split()
+    words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return {'text': ' '.join(words), 'city': original['city'].title(),
+            'size': original['size'] + rng.randint(-3, 3),
+            'price': int(round(original['price'] * rng.uniform(0.97, 1.03), -2))}
+
+
+def jaccard(a, b):
+    a, b = set(shingles(a).tolist()), set(shingles(b).tolist())
+    return len(a & b) / len(a | b)
+
+
+def test_signature_agreement_estimates_jaccard():
+    rng = random.Random(0)
+    originals = [listing(rng) for _ in range(50)]
+    # Half reposts, half unrelated listings
+    others = [repost(p, rng) if i % 2 else listing(rng) for i, p in enumerate(originals)]
+    for a, b in ((p['text'], q['text']) for p, q in zip(originals, others)):
+        sig = signatures([a, b])
+        assert abs(np.mean(sig[0] == sig[1]) - jaccard(a, b)) < 0.15
+
+
+def test_reposts_share_a_bucket_and_pass_the_threshold():
+    rng = random.Random(1)
+    originals = [listing(rng) for _ in range(200)]
+    reposts = [repost(p, rng) for p in originals]
+    sigs = signatures([p['text'] for p in originals + reposts])
+    found = 0
+    for i, (original, copy) in enumerate(zip(originals, reposts)):
+        indexed = set(band_buckets(sigs[i], [block_key(original['city'], original['size'],
+                                                       original['price'])]))
+        probed = set(band_buckets(sigs[len(originals) + i],
+                                  probe_keys(copy['city'], copy['size'], copy['price'])))
+        if indexed & probed and np.mean(sigs[i] == sigs[len(originals) + i]) >= SIMILARITY_THRESHOLD:
+            found += 1
+    assert found / len(originals) >= 0.95
+
+
+def test_unrelated_listings_stay_apart():
+    rng = random.Random(2)
+    texts = [listing(rng)['text'] for _ in range(100)]
+    sigs = signatures(texts)
+    similar = sum(np.mean(sigs[i] == sigs[j]) >= SIMILARITY_THRESHOLD
+                  for i in range(len(texts)) for j in range(i + 1, len(texts)))
+    assert similar == 0
+
+
+def test_empty_text_has_no_shingles():
+    assert len(shingles('')) == 0
+    assert listing_text('Studio', None, '') == 'Studio'
@@ -0,0 +1,69 @@
+import pytest
+import requests
+import page_cache
+from page_cache import fetch_page, fetch_changed_page, PageNotCached
+
+URL = 'https://www.mubawab.ma/en/a/101/listing-101-in-rabat'
+
+
+class FakeServer:
+    """Answers GETs with a page and its ETag, or 304 when the ETag matches."""
+
+    def __init__(self, content=b'<html>v1</html>', etag='"v1"'):
+        self.content, self.etag = content, etag
+        self.requests = []
+
+    def __call__(self, url, headers=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        response = requests.Response()
+        response.url = url
+        if headers and headers.get('If-None-Match') == self.etag:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = self.content
+            response.headers['ETag'] = self.etag
+        return response
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(page_cache, '_index', None)
+    monkeypatch.setattr(page_cache, '_total_bytes', 0)
+    monkeypatch.setattr(page_cache, 'OFFLINE', False)
+    server = FakeServer()
+    monkeypatch.setattr(page_cache, 'fetch', server)
+    yield server
+    page_cache._index.close()
+
+
+def test_fresh_page_is_served_from_disk(server):
+    assert fetch_page(URL) == b'<html>v1</html>'
+    assert fetch_page(URL, ttl=3600) == b'<html>v1</html>'
+    assert len(server.requests) == 1
+
+
+def test_stale_page_is_revalidated_with_its_etag(server):
+    fetch_page(URL)
+    assert fetch_page(URL, ttl=0) == b'<html>v1</html>'
+    assert server.requests[-1]['If-None-Match'] == '"v1"'
+    assert fetch_changed_page(URL, ttl=0) is None
+
+
+def test_changed_page_replaces_the_cached_copy(server):
+    fetch_page(URL)
+    server.content, server.etag = b'<html>v2</html>', '"v2"'
+    assert fetch_changed_page(URL, ttl=0) == b'<html>v2</html>'
+    assert fetch_page(URL, ttl=3600) == b'<html>v2</html>'
+    assert len(server.requests) == 2
+
+
+def test_offline_serves_stale_pages_and_fails_on_misses(server, monkeypatch):
+    fetch_page(URL)
+    monkeypatch.setattr(page_cache, 'OFFLINE', True)
+    assert fetch_page(URL, ttl=0) == b'<html>v1</html>'
+    with pytest.raises(PageNotCached):
+        fetch_page(URL + '-missing')
+    assert len(server.requests) == 1
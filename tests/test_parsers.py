@@ -0,0 +1,64 @@
+import pytest
+import replay
+from extractors import SoupExtractor
+from scraper import parse_details
+
+pytest.importorskip('lxml')
+from extractors import LxmlExtractor
+
+PAGES = replay.load_fixtures()
+DETAIL_PATHS = sorted(path for path in PAGES if path.startswith('/en/a/'))
+
+
+def parse(path, extractor):
+    return parse_details(PAGES[path], replay.ORIGIN + path, None, extractor=extractor)
+
+
+def test_fixtures_present():
+    assert len(DETAIL_PATHS) >= 10
+
+
+@pytest.mark.parametrize('path', DETAIL_PATHS)
+def test_backends_agree(path):
+    expected = parse(path, SoupExtractor())
+    actual = parse(path, LxmlExtractor())
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert actual[key] == expected[key], key
+
+
+@pytest.mark.parametrize('extractor', [SoupExtractor(), LxmlExtractor()], ids=lambda e: e.name)
+def test_detail_fields(extractor):
+    details = parse('/en/a/101/listing-101-in-rabat', extractor)
+    assert details['title'] == 'Bright 3 bedroom apartment in Agdal'
+    assert (details['city'], details['area']) == ('Rabat', 'Agdal')
+    assert (details['size'], details['rooms'], details['bedrooms'], details['bathrooms']) == (120, 5, 3, 2)
+    assert details['price'] == 8500
+    assert details['features'] == 'Terrace, Elevator, Concierge'
+    assert (details['condition'], details['age']) == ('Good', '5-10')
+
+
+@pytest.mark.parametrize('extractor', [SoupExtractor(), LxmlExtractor()], ids=lambda e: e.name)
+def test_awkward_details(extractor):
+    studio = parse('/en/a/102/listing-102-in-rabat', extractor)
+    assert studio['title'] == 'Studio meublé'
+    assert studio['price'] is None
+    assert studio['description'] == 'Studio meublé, idéal étudiant. Charges incluses & internet.'
+    villa = parse('/en/a/103/listing-103-in-rabat', extractor)
+    assert villa['price'] == 25000
+    assert villa['rooms'] == 4
+    assert 'agent note' not in villa['description']
+    assert parse('/en/a/105/listing-105-in-rabat', extractor)['description'] is None
+
+
+def test_listing_dedup_matches_normalized_urls(monkeypatch):
+    import scraper
+    from database import url_key
+    monkeypatch.setattr(scraper, 'fetch_page',
+                        lambda url, ttl=None: PAGES[url[len(replay.ORIGIN):]])
+    url = replay.ORIGIN + '/en/ct/rabat/real-estate-for-rent:o:n'
+    seen = replay.ORIGIN + '/en/a/101/listing-101-in-rabat'
+    known = {url_key(seen + '/?utm_source=feed')}
+    links = [link for _, page in scraper.iter_listing_pages(url, 1, known_urls=known)
+             for link, _ in page]
+    assert len(links) == 3 and seen not in links
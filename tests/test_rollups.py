@@ -0,0 +1,69 @@
+import datetime
+import numpy as np
+import pytest
+from rollups import TDigest, Rollup, rollup_rows, QUANTILES
+
+
+@pytest.fixture
+def prices():
+    return np.random.default_rng(0).lognormal(9, 0.5, 50_000)
+
+
+def relative_error(estimate, exact):
+    return abs(estimate - exact) / exact
+
+
+def test_quantiles_match_exact_ones(prices):
+    digest = TDigest()
+    digest.update(prices.tolist())
+    assert digest.count == len(prices)
+    for q in QUANTILES.values():
+        assert relative_error(digest.quantile(q), np.quantile(prices, q)) < 0.01
+    assert (digest.quantile(0), digest.quantile(1)) == (prices.min(), prices.max())
+
+
+def test_merged_digests_match_the_whole(prices):
+    merged = TDigest()
+    for part in np.array_split(prices, 24):
+        digest = TDigest()
+        digest.update(part.tolist())
+        # Digests are merged as read back from the database
+        merged.merge(TDigest.from_bytes(digest.to_bytes()))
+    assert merged.count == len(prices)
+    for q in QUANTILES.values():
+        assert relative_error(merged.quantile(q), np.quantile(prices, q)) < 0.01
+
+
+def test_digest_stays_small(prices):
+    digest = TDigest()
+    digest.update(prices.tolist())
+    assert len(digest.to_bytes()) < 4096
+    assert TDigest().quantile(0.5) is None
+
+
+def test_rollups_count_unpriced_and_unsized_listings():
+    month = datetime.date(2024, 1, 1)
+    rollups = rollup_rows([
+        ('Rabat', 'Agdal', 'Apartment', month, 10000, 100),
+        ('Rabat', 'Agdal', 'Apartment', month, 6000, None),
+        (' Rabat ', None, 'Villa', month, None, 300),
+    ])
+    city = rollups[('city', 'Rabat', '', '', month)]
+    assert (city.listings, city.priced, city.sized) == (3, 2, 1)
+    summary = city.summary()
+    assert summary['mean_price'] == 8000
+    assert summary['mean_price_per_m2'] == 100
+    area = rollups[('city_area_type', 'Rabat', 'Agdal', 'Apartment', month)]
+    assert area.listings == 2
+    assert rollups[('city_type', 'Rabat', '', 'Villa', month)].priced == 0
+
+
+def test_rollup_merge_adds_counts_and_digests():
+    a, b = Rollup(), Rollup()
+    for price in range(1000, 2000):
+        a.add(price, 50)
+    for price in range(2000, 3000):
+        b.add(price, 50)
+    merged = Rollup(*a.values()).merge(Rollup(*b.values()))
+    assert (merged.listings, merged.priced, merged.sized) == (2000, 2000, 2000)
+    assert merged.summary()['median_price'] == pytest.approx(2000, rel=0.01)
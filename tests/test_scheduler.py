@@ -0,0 +1,48 @@
+import datetime
+import pytest
+from scheduler import (next_page_budget, revisit_hours, due_jobs, DEFAULT_PAGES, MIN_PAGES, MAX_PAGES,
+                       MIN_REVISIT_HOURS, MAX_REVISIT_HOURS, TARGET_NEW_LISTINGS)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_budget_follows_the_last_page_with_new_listings():
+    assert next_page_budget(10, [5, 3, 0, 0]) == 3
+    assert next_page_budget(10, [0, 0, 0]) == MIN_PAGES
+    # A failed walk keeps its budget
+    assert next_page_budget(7, []) == 7
+
+
+def test_budget_doubles_up_to_the_cap():
+    assert next_page_budget(4, [5, 5, 5, 1]) == 8
+    assert next_page_budget(MAX_PAGES - 1, [1] * (MAX_PAGES - 1)) == MAX_PAGES
+    assert next_page_budget(MAX_PAGES, [1] * MAX_PAGES) == MAX_PAGES
+
+
+def test_revisit_hours_are_clamped():
+    assert revisit_hours(0) == revisit_hours(None) == MAX_REVISIT_HOURS
+    assert revisit_hours(TARGET_NEW_LISTINGS / 10) == pytest.approx(10)
+    assert revisit_hours(1e6) == MIN_REVISIT_HOURS
+    assert revisit_hours(1e-6) == MAX_REVISIT_HOURS
+
+
+def test_due_jobs_put_new_and_busy_cities_first():
+    now = datetime.datetime(2024, 1, 1, 12)
+    cursor = FakeCursor([
+        ('sale', 'rabat', 4, 1.0, now - datetime.timedelta(hours=1)),
+        ('sale', 'fes', 6, 9.0, now - datetime.timedelta(hours=1)),
+        ('sale', 'agadir', 3, 50.0, now + datetime.timedelta(hours=1)),
+    ])
+    jobs = [('sale', 'rabat'), ('sale', 'fes'), ('sale', 'agadir'), ('sale', 'tanger')]
+    assert due_jobs(cursor, jobs, now) == [
+        ('sale', 'tanger', DEFAULT_PAGES), ('sale', 'fes', 6), ('sale', 'rabat', 4)]
+    assert len(due_jobs(cursor, jobs, now, force=True)) == 4
@@ -0,0 +1,66 @@
+import os
+import sys
+import subprocess
+import pytest
+import throttle
+from throttle import TokenBucket
+
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules')
+
+
+class FakeClock:
+    """Stands in for the time module, advancing only when slept."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throttle, 'time', clock)
+    return clock
+
+
+def test_rate_is_enforced_after_the_burst(clock):
+    bucket = TokenBucket(4, capacity=2)
+    waits = [bucket.acquire() for _ in range(6)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2:] == pytest.approx([0.25] * 4)
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_tokens_refill_while_idle(clock):
+    bucket = TokenBucket(2, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.sleep(1.0)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+
+
+def test_zero_rate_never_blocks(clock):
+    bucket = TokenBucket(0)
+    assert [bucket.acquire() for _ in range(100)] == [0.0] * 100
+    assert clock.now == 0.0
+
+
+def test_negative_rate_is_rejected():
+    with pytest.raises(ValueError):
+        TokenBucket(-1)
+
+
+@pytest.mark.parametrize('rate, ok', [('0', True), ('2.5', True), ('-1', False)])
+def test_requests_per_second_setting(rate, ok):
+    env = dict(os.environ, SCRAPER_REQUESTS_PER_SECOND=rate, PYTHONPATH=MODULES)
+    result = subprocess.run([sys.executable, '-c', 'import throttle'], env=env,
+                            capture_output=True, text=True)
+    assert (result.returncode == 0) == ok
+    if not ok:
+        assert 'SCRAPER_REQUESTS_PER_SECOND' in result.stderr
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+from train import mean_absolute_percentage_error
+
+
+def test_mape_ignores_unpriced_listings():
+    predicted = np.array([110.0, 90.0, 500.0])
+    actual = np.array([100.0, 100.0, 0.0])
+    assert mean_absolute_percentage_error(predicted, actual) == pytest.approx(0.1)
+
+
+def test_mape_without_priced_listings():
+    assert mean_absolute_percentage_error(np.array([5.0]), np.array([0.0])) is None